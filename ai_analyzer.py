@@ -2,14 +2,18 @@
 
 # ai_analyzer.py
 import os
+import asyncio
+import concurrent.futures
 import json
-import re
+import threading
+import weakref
 import streamlit as st
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 import requests
 import time
 import google.generativeai as genai
+from ai_analyzer_simple import SimpleAIAnalyzer
 from advanced_prompts import (
     LEGAL_ANALYSIS_PROMPTS,
     PROBLEM_DETECTION_PROMPTS,
@@ -17,21 +21,200 @@ from advanced_prompts import (
     get_quality_config,
     build_specialized_prompt
 )
+from document_processor import build_document_index
+from json_stream import JSONArrayStreamParser, extract_json_block
+from prompt_budget import (DocumentChunk, PackedDocument, calibrate, estimate_tokens, is_calibrated,
+                           pack_document, split_document)
+from chat_session import DocumentChatSession
+from circuit_breaker import CLOSED, CircuitBreaker, CircuitOpenError
+from context_cache import CachedContext, ContextCache
+from persistent_cache import PersistentCache, content_digest
+from rate_limiter import QuotaExceededError, RateLimiter, is_quota_error
+from semantic_cache import SemanticCache, refers_to_history
 
 MODEL_DEFAULT = "gemini-2.0-flash-exp"
 
-def _extract_json_block(text: str) -> str:
-    """Extrae el primer bloque JSON válido ({...} o [...]) de un texto."""
-    if not text:
+# Modo del análisis completo: "fused" pide análisis, problemas y recomendaciones en
+# una sola llamada; "separate" hace una llamada por paso (más lento, más detallado)
+PIPELINE_MODE = os.getenv("GEMINI_PIPELINE_MODE", "fused")
+
+# La detección de problemas envía el documento completo en una sola llamada si cabe en
+# el contexto del modelo (GEMINI_CONTEXT_TOKENS, descontando instrucciones y respuesta).
+# Si no cabe se revisa por fragmentos de GEMINI_MAPREDUCE_CHUNK_TOKENS (map-reduce), a lo
+# sumo GEMINI_MAPREDUCE_MAX_CHUNKS (el tamaño crece si hace falta) y
+# GEMINI_MAPREDUCE_CONCURRENCY consultados a la vez
+CONTEXT_TOKENS = int(os.getenv("GEMINI_CONTEXT_TOKENS", "1000000"))
+CONTEXT_RESERVE_TOKENS = 8000
+PROBLEMS_DOCUMENT_TOKENS = max(CONTEXT_TOKENS - CONTEXT_RESERVE_TOKENS, 1)
+MAPREDUCE_CHUNK_TOKENS = int(os.getenv("GEMINI_MAPREDUCE_CHUNK_TOKENS", "4000"))
+MAPREDUCE_MAX_CHUNKS = max(int(os.getenv("GEMINI_MAPREDUCE_MAX_CHUNKS", "64")), 1)
+MAPREDUCE_CONCURRENCY = max(int(os.getenv("GEMINI_MAPREDUCE_CONCURRENCY", "4")), 1)
+
+# Versión de los prompts y parsers: al cambiarlos se sube para no servir respuestas viejas
+PROMPT_VERSION = "1"
+
+# Campos del análisis que cambian entre dos análisis del mismo documento: no cuentan para
+# decidir si una respuesta del chat guardada sirve
+VOLATILE_ANALYSIS_FIELDS = ("fecha_analisis",)
+
+# Conteo de tokens para el presupuesto de los prompts: con calibración se hace una
+# llamada a count_tokens por modelo y luego se estima localmente con esa relación
+TOKEN_CALIBRATION = os.getenv("GEMINI_TOKEN_CALIBRATION", "true").lower() in ("1", "true", "yes")
+CALIBRATION_SAMPLE_CHARS = 4000
+
+# Salida estructurada: Gemini responde JSON válido con la forma de cada tarea, sin texto
+# alrededor, y el parser lo lee de una vez. Se puede desactivar para modelos sin soporte
+STRUCTURED_OUTPUT = os.getenv("GEMINI_STRUCTURED_OUTPUT", "true").lower() in ("1", "true", "yes")
+
+def _object_schema(campos: Dict[str, Any], requeridos: List[str]) -> Dict[str, Any]:
+    return {"type": "object", "properties": campos, "required": requeridos}
+
+_TEXTO = {"type": "string"}
+
+ANALYSIS_SCHEMA = _object_schema({
+    "tipo_documento": _TEXTO,
+    "longitud": {"type": "integer"},
+    "palabras_clave": {"type": "array", "items": _TEXTO},
+    "confianza": {"type": "number"},
+    "analisis_markdown": _TEXTO,
+}, ["tipo_documento", "palabras_clave", "confianza", "analisis_markdown"])
+
+PROBLEMS_SCHEMA = {"type": "array", "items": _object_schema({
+    "tipo": _TEXTO,
+    "descripcion": _TEXTO,
+    "severidad": _TEXTO,
+    "linea": _TEXTO,
+    "fundamento_legal": _TEXTO,
+    "impacto": _TEXTO,
+    "recomendacion_breve": _TEXTO,
+}, ["tipo", "descripcion", "severidad"])}
+
+RECOMMENDATIONS_SCHEMA = {"type": "array", "items": _object_schema({
+    "titulo": _TEXTO,
+    "descripcion": _TEXTO,
+    "prioridad": _TEXTO,
+    "accion": _TEXTO,
+    "fundamento_legal": _TEXTO,
+    "tiempo_estimado": _TEXTO,
+    "recursos_necesarios": _TEXTO,
+    "impacto_esperado": _TEXTO,
+    "riesgos": _TEXTO,
+}, ["titulo", "descripcion", "prioridad", "accion"])}
+
+FUSED_SCHEMA = _object_schema({
+    "analisis": ANALYSIS_SCHEMA,
+    "problemas": PROBLEMS_SCHEMA,
+    "recomendaciones": RECOMMENDATIONS_SCHEMA,
+}, ["analisis", "problemas", "recomendaciones"])
+
+# Cache persistente de respuestas del modelo: el mismo prompt con el mismo modelo y
+# configuración no vuelve a llamar a la API, ni siquiera después de reiniciar
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".cache")
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "64"))
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "168"))
+response_cache = PersistentCache(
+    os.path.join(LLM_CACHE_DIR, "llm_responses.sqlite3"),
+    max_bytes=LLM_CACHE_MAX_MB * 1024 * 1024,
+    ttl=LLM_CACHE_TTL_HOURS * 3600 if LLM_CACHE_TTL_HOURS > 0 else None,
+)
+
+# Cache semántico del chat: preguntas equivalentes sobre el mismo documento reutilizan
+# la respuesta si su similitud (0-1) alcanza el umbral
+CHAT_SEMANTIC_THRESHOLD = float(os.getenv("CHAT_SEMANTIC_THRESHOLD", "0.75"))
+chat_cache = SemanticCache(CHAT_SEMANTIC_THRESHOLD)
+
+# Tokens de historial reciente que se reenvían completos en cada pregunta del chat;
+# los turnos más viejos se resumen
+CHAT_WINDOW_TOKENS = int(os.getenv("CHAT_WINDOW_TOKENS", "2000"))
+
+# Cache de contexto de Gemini: las instrucciones de cada tarea y el documento se registran
+# una vez por caso y las llamadas solo envían la solicitud. "off" (por defecto), "gemini"
+# (requiere un modelo con cache de contexto y documentos que superen su mínimo de tokens)
+# o "local" (sustituto en memoria para pruebas)
+CONTEXT_CACHE_MODE = os.getenv("GEMINI_CONTEXT_CACHE", "off").lower()
+CONTEXT_CACHE_TTL_MINUTES = float(os.getenv("GEMINI_CONTEXT_CACHE_TTL_MINUTES", "60"))
+
+# Reemplaza en el prompt el extracto del documento cuando el documento completo va en la cache
+DOCUMENTO_EN_CACHE = "[El documento completo está en el contexto de esta conversación]"
+
+# Límite de solicitudes y tokens por minuto hacia Gemini, compartido por todas las sesiones.
+# Ante un 429 se reintenta con espera exponencial; si la espera supera el máximo se avisa
+# con "Cuota de Google Gemini excedida" en lugar de responder con texto predefinido
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "10"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_MAX_WAIT_SECONDS = float(os.getenv("GEMINI_MAX_WAIT_SECONDS", "60"))
+rate_limiter = RateLimiter(GEMINI_RPM, GEMINI_TPM, max_wait=GEMINI_MAX_WAIT_SECONDS)
+
+# Interruptor del backend: tras GEMINI_BREAKER_FAILURES fallas seguidas (o respuestas más
+# lentas que GEMINI_LATENCY_SLO_SECONDS) las llamadas se atienden con SimpleAIAnalyzer;
+# cada GEMINI_BREAKER_RESET_SECONDS una sonda en segundo plano vuelve a probar Gemini
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "3"))
+GEMINI_LATENCY_SLO_SECONDS = float(os.getenv("GEMINI_LATENCY_SLO_SECONDS", "20"))
+GEMINI_BREAKER_RESET_SECONDS = float(os.getenv("GEMINI_BREAKER_RESET_SECONDS", "30"))
+# Velocidad de generación que se da por normal: una respuesta larga tiene ese margen
+# adicional sobre el objetivo de latencia antes de contar como lenta
+GEMINI_OUTPUT_TOKENS_PER_SECOND = float(os.getenv("GEMINI_OUTPUT_TOKENS_PER_SECOND", "100"))
+
+def _probe_gemini() -> bool:
+    """Sonda del interruptor: una generación mínima con el modelo por defecto."""
+    modelo = genai.GenerativeModel(MODEL_DEFAULT)
+    rate_limiter.call(lambda: modelo.generate_content(
+        "ping", generation_config=genai.types.GenerationConfig(max_output_tokens=1),
+        request_options={"timeout": GEMINI_LATENCY_SLO_SECONDS}), tokens=1)
+    return True
+
+gemini_breaker = CircuitBreaker(GEMINI_BREAKER_FAILURES, GEMINI_LATENCY_SLO_SECONDS,
+                                GEMINI_BREAKER_RESET_SECONDS, probe=_probe_gemini)
+
+def _breaker_failure(error: BaseException) -> None:
+    # Un 429 no es una falla del backend: de eso se encarga el límite de solicitudes
+    if not is_quota_error(error):
+        gemini_breaker.record_failure(str(error)[:120])
+
+def _breaker_success(inicio: float, texto: str) -> None:
+    """Respuesta completa: la latencia se compara con el objetivo más el tiempo de generar su salida."""
+    margen = estimate_tokens(texto) / GEMINI_OUTPUT_TOKENS_PER_SECOND
+    gemini_breaker.record_success(time.monotonic() - inicio, margen)
+
+def _raise_if_open(error: BaseException) -> None:
+    """Si la falla dejó el interruptor abierto, el resto de la operación va al analizador local."""
+    if gemini_breaker.state != CLOSED:
+        raise CircuitOpenError("Gemini no disponible") from error
+
+def _response_text(respuesta: Any) -> str:
+    try:
+        return respuesta.text or ""
+    except ValueError:
+        # Respuesta sin texto (por ejemplo, bloqueada por seguridad)
         return ""
-    candidates = re.findall(r'(\{.*?\}|\[.*?\])', text, flags=re.DOTALL)
-    for c in candidates:
+
+# Bucle de eventos compartido para las llamadas asíncronas a Gemini. El cliente
+# asíncrono queda ligado al bucle donde se crea, así que se usa siempre el mismo
+# (en un hilo propio) en lugar de un asyncio.run() por cada ejecución de Streamlit
+_async_loop = None
+_async_loop_lock = threading.Lock()
+
+def _run_async(coro, on_wait: Optional[Callable[[float], None]] = None, grupo: Any = None):
+    """
+    Ejecuta una corrutina en el bucle compartido y espera su resultado. Mientras
+    espera, `on_wait` recibe los segundos que faltan si hay llamadas del `grupo` en
+    cola por el límite de solicitudes (se invoca desde el hilo que llama, no desde el bucle).
+    """
+    global _async_loop
+    with _async_loop_lock:
+        if _async_loop is None:
+            _async_loop = asyncio.new_event_loop()
+            threading.Thread(target=_async_loop.run_forever, daemon=True).start()
+    futuro = asyncio.run_coroutine_threadsafe(coro, _async_loop)
+    if on_wait is None:
+        return futuro.result()
+    while True:
         try:
-            json.loads(c)
-            return c
-        except Exception:
-            continue
-    return ""
+            return futuro.result(timeout=0.5)
+        except concurrent.futures.TimeoutError:
+            espera = rate_limiter.pending_wait(grupo)
+            if espera > 0:
+                on_wait(espera)
 
 def _safe_json_loads(text: str, fallback: Any) -> Any:
     """Carga JSON de forma segura; si falla, devuelve fallback."""
@@ -40,7 +223,98 @@ def _safe_json_loads(text: str, fallback: Any) -> Any:
     except Exception:
         return fallback
 
+def _load_json(raw: str, reparar: bool = True) -> Any:
+    """
+    JSON de la respuesta: directo con salida estructurada; si no, se busca el bloque
+    en el texto (con `reparar`, también el de una respuesta cortada).
+    """
+    data = _safe_json_loads(raw, None) if raw else None
+    if data is None:
+        data = _safe_json_loads(extract_json_block(raw, reparar), None)
+    return data
+
+def _matches_schema(data: Any, schema: Dict[str, Any]) -> bool:
+    """Forma exterior del esquema: tipo y campos requeridos (no revisa los elementos uno a uno)."""
+    if schema.get("type") == "array":
+        return isinstance(data, list)
+    return isinstance(data, dict) and all(campo in data for campo in schema.get("required", []))
+
+def _store_response(clave: str, texto: str, schema: Optional[Dict[str, Any]]) -> None:
+    """
+    Guarda una respuesta en el cache. Si se pidió JSON, solo cuando se lee sin
+    reparar y con la forma del esquema: de una respuesta cortada solo quedan
+    bloques internos, así que se vuelve a pedir en lugar de repetirse.
+    """
+    if schema is None or _matches_schema(_load_json(texto, reparar=False), schema):
+        response_cache.set(clave, texto)
+
+_SEVERIDADES = {"ALTA": 3, "MEDIA": 2, "BAJA": 1}
+
+def _dedupe_problems(problemas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Une los problemas con el mismo tipo y descripción; se queda con la severidad más alta."""
+    unicos: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for problema in problemas:
+        descripcion = " ".join(str(problema.get("descripcion", "")).lower().split())
+        clave = (str(problema.get("tipo", "")).upper(), descripcion)
+        anterior = unicos.get(clave)
+        if anterior is None:
+            unicos[clave] = problema
+        elif (_SEVERIDADES.get(str(problema.get("severidad", "")).split(" ")[0].upper(), 0)
+              > _SEVERIDADES.get(str(anterior.get("severidad", "")).split(" ")[0].upper(), 0)):
+            unicos[clave] = {**anterior, "severidad": problema["severidad"]}
+    return list(unicos.values())
+
+# Instrucciones del asistente de chat; van una sola vez por sesión, junto con el contexto del documento
+CHAT_SYSTEM_PROMPT = """Eres un asistente legal especializado en derecho administrativo colombiano con amplia experiencia en derecho administrativo, constitucional y procedimental.
+
+INSTRUCCIONES ESPECÍFICAS:
+1. Responde de manera profesional, clara y útil
+2. Utiliza el contexto del análisis previo cuando esté disponible
+3. Proporciona información legal precisa y actualizada
+4. Incluye fundamento legal cuando sea relevante
+5. Ofrece orientación práctica y accionable
+6. Mantén un tono profesional pero accesible
+7. Si la pregunta no está relacionada con el documento, responde con tu conocimiento legal general
+
+ÁREAS DE EXPERTISE:
+- Derecho Administrativo Colombiano
+- Derecho Constitucional
+- Procedimiento Administrativo
+- Derecho de Petición
+- Recursos Administrativos
+- Control de Legalidad
+- Jurisprudencia relevante"""
+
+class _PreparedCall:
+    """
+    Llamada a Gemini armada sin tocar la API. Si la tarea puede usar el cache de
+    contexto, el prompt y la clave de respuesta ya cuentan con él; el contexto se
+    registra en `AIAnalyzer._bind_context`, solo cuando hay que llamar a Gemini.
+    """
+
+    def __init__(self, full_prompt: str, kwargs: Dict[str, Any], clave: str,
+                 pendiente: Optional[Tuple[str, str, str, Dict[str, Any]]] = None):
+        self.full_prompt = full_prompt
+        self.kwargs = kwargs
+        self.clave = clave  # Clave en el cache de respuestas
+        # Instrucciones, documento y prompt completo (por si no se puede registrar el contexto)
+        self.pendiente = pendiente
+        self.contexto: Optional[CachedContext] = None
+
 class AIAnalyzer:
+    # Presupuesto de tokens del documento en el prompt de cada paso; se llena con las
+    # secciones de más valor para la tarea, en este orden
+    ANALYSIS_TOKENS = 1200
+    # Los problemas pueden estar en cualquier sección: el documento va completo si cabe
+    # en la llamada; si no, se revisa por fragmentos (ver `_problem_chunks`)
+    PROBLEMS_TOKENS = PROBLEMS_DOCUMENT_TOKENS
+    RECOMMENDATIONS_TOKENS = 600
+    SECTION_PRIORITIES = {
+        "analisis": ("encabezado", "petición", "hechos", "fundamentos", "firma"),
+        "problemas": ("petición", "encabezado", "fundamentos", "firma", "hechos"),
+        "recomendaciones": ("petición", "fundamentos", "encabezado", "hechos", "firma"),
+    }
+
     def __init__(self, api_key: str | None = None, connection_id: str | None = None):
         key = api_key or os.getenv("GEMINI_API_KEY")
         if not key or key == "tu_clave_aqui":
@@ -52,6 +326,17 @@ class AIAnalyzer:
         # Usar Gemini 2.0 Flash Exp
         self.model = genai.GenerativeModel(MODEL_DEFAULT)
         self.timeout = 30  # Timeout en segundos
+        self.packing_reports: Dict[str, PackedDocument] = {}  # Último empaquetado de cada paso
+        self.chat_session: Optional[DocumentChatSession] = None  # Sesión de chat del documento actual
+        self.chat_scope: Optional[str] = None
+        # Cache de contexto de la sesión de Streamlit: se borra cuando se descarta el analizador
+        self.context_cache = ContextCache(CONTEXT_CACHE_MODE, CONTEXT_CACHE_TTL_MINUTES * 60)
+        weakref.finalize(self, self.context_cache.release)
+        # La app lo asigna para mostrar la espera cuando la llamada queda en cola por el límite de
+        # solicitudes; las llamadas del analizador van en su propio grupo (el de la sesión)
+        self.wait_notifier: Optional[Callable[[float], None]] = None
+        # Atiende los pasos mientras el interruptor de Gemini está abierto
+        self.local = SimpleAIAnalyzer()
         
         # Mantener configuración de Brainbox para otros métodos
         self.api_key = api_key
@@ -153,62 +438,296 @@ class AIAnalyzer:
         
         return "\n\n".join(context_parts)
 
-    def _chat(self, messages: List[Dict[str, str]], temperature: float = 0.2) -> str:
-        """Chat directo con Gemini 2.0 Flash para respuestas de alta calidad."""
-        try:
-            # Construir prompt optimizado para Gemini
-            system_content = ""
-            user_content = ""
-            
-            for msg in messages:
-                if msg["role"] == "system":
-                    system_content = msg['content']
-                elif msg["role"] == "user":
-                    user_content = msg['content']
-            
-            # Crear prompt estructurado para mejor comprensión
-            full_prompt = f"""INSTRUCCIONES DEL SISTEMA:
+    def _split_messages(self, messages: List[Dict[str, str]]) -> Tuple[str, str]:
+        """Separa el contenido de sistema y de usuario de una lista de mensajes."""
+        system_content = ""
+        user_content = ""
+        
+        for msg in messages:
+            if msg["role"] == "system":
+                system_content = msg['content']
+            elif msg["role"] == "user":
+                user_content = msg['content']
+        return system_content, user_content
+
+    def _generation_request(self, messages: List[Dict[str, str]], temperature: float,
+                            schema: Optional[Dict[str, Any]] = None,
+                            sistema_en_cache: bool = False) -> Tuple[str, Dict[str, Any]]:
+        """
+        Prompt y parámetros de generación comunes a las llamadas síncronas y asíncronas.
+        Con `schema` se pide salida JSON con esa forma (si GEMINI_STRUCTURED_OUTPUT lo permite).
+        Con `sistema_en_cache` las instrucciones ya están en el contexto en cache y no se repiten.
+        """
+        system_content, user_content = self._split_messages(messages)
+        
+        # Crear prompt estructurado para mejor comprensión
+        instrucciones = "" if sistema_en_cache else f"""INSTRUCCIONES DEL SISTEMA:
 {system_content}
 
-SOLICITUD DEL USUARIO:
+"""
+        full_prompt = f"""{instrucciones}SOLICITUD DEL USUARIO:
 {user_content}
 
 IMPORTANTE: Responde de manera completa, profesional y fundamentada. Si se solicita JSON, asegúrate de que sea válido y completo."""
+        
+        # Obtener configuración de calidad según el tipo de análisis
+        quality_config = get_quality_config("legal_expertise" if "legal" in system_content.lower() else "detailed_analysis")
+        estructurada = {}
+        if schema is not None and STRUCTURED_OUTPUT:
+            estructurada = {"response_mime_type": "application/json", "response_schema": schema}
+        
+        return full_prompt, {
+            "generation_config": genai.types.GenerationConfig(
+                temperature=temperature,
+                max_output_tokens=quality_config["max_tokens"],
+                top_p=quality_config["top_p"],
+                top_k=quality_config["top_k"],
+                candidate_count=1,      # Una sola respuesta de alta calidad
+                stop_sequences=[],      # Sin secuencias de parada para respuestas completas
+                **estructurada,
+            ),
+            "safety_settings": [
+                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+            ],
+        }
+
+    def _response_cache_key(self, full_prompt: str, kwargs: Dict[str, Any],
+                            clave_contexto: Optional[str] = None) -> str:
+        """Clave de una respuesta: versión de prompts, modelo, configuración de generación y huella del prompt."""
+        configuracion = content_digest(repr(kwargs).encode("utf-8"))
+        # Con cache de contexto el documento no va en el prompt: cuenta la huella del contenido en cache
+        if clave_contexto is not None:
+            full_prompt = f"{clave_contexto}\n{full_prompt}"
+        return f"llm:{PROMPT_VERSION}:{self.model.model_name}:{configuracion}:{content_digest(full_prompt.encode('utf-8'))}"
+
+    def _document_messages(self, system: str, user: str, texto: str, documento: str) -> List[Dict[str, str]]:
+        """
+        Mensajes de una tarea sobre el documento. El mensaje "document" lleva el texto
+        completo y el extracto que va en `user`: con cache de contexto se registra el
+        documento completo con las instrucciones y el extracto sale del prompt.
+        """
+        return [{"role": "system", "content": system},
+                {"role": "user", "content": user},
+                {"role": "document", "content": texto, "extracto": documento}]
+
+    def _prepare_call(self, messages: List[Dict[str, str]], temperature: float,
+                      schema: Optional[Dict[str, Any]] = None) -> _PreparedCall:
+        """Prompt, parámetros y clave de respuesta de una llamada; no llama a la API."""
+        full_prompt, kwargs = self._generation_request(messages, temperature, schema)
+        documento = next((m for m in messages if m["role"] == "document"), None)
+        if documento is not None:
+            system_content, _ = self._split_messages(messages)
+            clave_contexto = self.context_cache.key_for(self.model, system_content, documento["content"])
+            if clave_contexto is not None:
+                if documento["extracto"]:
+                    messages = [{**m, "content": m["content"].replace(documento["extracto"], DOCUMENTO_EN_CACHE)}
+                                if m["role"] == "user" else m for m in messages]
+                en_cache, kwargs_en_cache = self._generation_request(messages, temperature, schema, sistema_en_cache=True)
+                return _PreparedCall(en_cache, kwargs_en_cache,
+                                     self._response_cache_key(en_cache, kwargs_en_cache, clave_contexto),
+                                     (system_content, documento["content"], full_prompt, kwargs))
+        return _PreparedCall(full_prompt, kwargs, self._response_cache_key(full_prompt, kwargs))
+
+    def _bind_context(self, llamada: _PreparedCall) -> Any:
+        """
+        Modelo con el que se envía la llamada. Registra el contexto previsto (dentro del
+        límite de solicitudes); si no se pudo, la llamada vuelve al prompt completo.
+        """
+        if llamada.pendiente is None:
+            return self.model
+        instrucciones, documento, full_prompt, kwargs = llamada.pendiente
+        llamada.pendiente = None
+        tokens = self._estimate_tokens(f"{instrucciones}\n{documento}")
+        contexto = self.context_cache.get(self.model, instrucciones, documento,
+                                          via=lambda crear: rate_limiter.call(crear, tokens, self.wait_notifier, grupo=self))
+        if contexto is None:
+            llamada.full_prompt, llamada.kwargs = full_prompt, kwargs
+            llamada.clave = self._response_cache_key(full_prompt, kwargs)
+            return self.model
+        llamada.contexto = contexto
+        return self.context_cache.model_for(self.model, contexto)
+
+    def _call_gemini(self, llamada: Callable[[], Any], tokens: int) -> Any:
+        """Llamada a Gemini dentro del límite de solicitudes; su resultado y latencia alimentan el interruptor."""
+        def medida():
+            inicio = time.monotonic()
+            try:
+                resultado = llamada()
+            except Exception as e:
+                _breaker_failure(e)
+                raise
+            _breaker_success(inicio, _response_text(resultado))
+            return resultado
+        return rate_limiter.call(medida, tokens, self.wait_notifier, grupo=self)
+
+    async def _call_gemini_async(self, llamada: Callable[[], Any], tokens: int) -> Any:
+        """Como `_call_gemini`, sin bloquear el bucle de eventos."""
+        async def medida():
+            inicio = time.monotonic()
+            try:
+                resultado = await llamada()
+            except Exception as e:
+                _breaker_failure(e)
+                raise
+            _breaker_success(inicio, _response_text(resultado))
+            return resultado
+        return await rate_limiter.call_async(medida, tokens, grupo=self)
+
+    def _stream_gemini(self, llamada: Callable[[], Any], tokens: int) -> Iterator[str]:
+        """
+        Fragmentos de texto de una llamada en streaming. El interruptor registra el
+        resultado cuando la respuesta terminó de llegar: los errores a mitad de la
+        respuesta cuentan como fallas y la latencia es la de la respuesta completa.
+        """
+        inicio = 0.0
+        def iniciar():
+            nonlocal inicio
+            inicio = time.monotonic()
+            return llamada()
+        partes = []
+        try:
+            for chunk in rate_limiter.call(iniciar, tokens, self.wait_notifier, grupo=self):
+                try:
+                    fragmento = chunk.text
+                except ValueError:
+                    # Fragmento sin texto (por ejemplo, solo metadatos de seguridad)
+                    continue
+                if fragmento:
+                    partes.append(fragmento)
+                    yield fragmento
+        except Exception as e:
+            _breaker_failure(e)
+            raise
+        _breaker_success(inicio, "".join(partes))
+
+    def _estimate_tokens(self, prompt: str) -> int:
+        """Tokens de entrada estimados de un prompt, para el límite de tokens por minuto."""
+        return estimate_tokens(prompt, self.model.model_name)
+
+    def _forget_context(self, llamada: Optional[_PreparedCall]) -> None:
+        """Tras un error con contexto en cache (por ejemplo, vencido en el servidor) se deja de usar."""
+        if llamada is not None and llamada.contexto is not None:
+            self.context_cache.discard(llamada.contexto)
+
+    def _chat(self, messages: List[Dict[str, str]], temperature: float = 0.2,
+              schema: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Chat directo con Gemini 2.0 Flash para respuestas de alta calidad. Si el interruptor
+        está abierto, o la falla lo abre, lanza CircuitOpenError: el paso que llama lo
+        termina con el analizador local.
+        """
+        llamada = None
+        try:
+            llamada = self._prepare_call(messages, temperature, schema)
+            guardada = response_cache.get(llamada.clave)
+            if guardada is not None:
+                return guardada
             
-            # Obtener configuración de calidad según el tipo de análisis
-            quality_config = get_quality_config("legal_expertise" if "legal" in system_content.lower() else "detailed_analysis")
+            # Con el interruptor abierto no se espera el timeout de Gemini
+            if not gemini_breaker.allow():
+                raise CircuitOpenError("Gemini no disponible")
             
-            # Generar respuesta con Gemini 2.0 Flash
-            response = self.model.generate_content(
-                full_prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=temperature,
-                    max_output_tokens=quality_config["max_tokens"],
-                    top_p=quality_config["top_p"],
-                    top_k=quality_config["top_k"],
-                    candidate_count=1,      # Una sola respuesta de alta calidad
-                    stop_sequences=[],      # Sin secuencias de parada para respuestas completas
-                ),
-                safety_settings=[
-                    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                ]
-            )
+            # Generar respuesta con Gemini 2.0 Flash (dentro del límite de solicitudes por minuto)
+            modelo = self._bind_context(llamada)
+            response = self._call_gemini(lambda: modelo.generate_content(llamada.full_prompt, **llamada.kwargs),
+                                         self._estimate_tokens(llamada.full_prompt))
             
-            # Verificar que la respuesta sea válida
+            # Verificar que la respuesta sea válida (los fallbacks no se guardan en el cache)
             if response and response.text:
-                return response.text.strip()
+                texto = response.text.strip()
+                _store_response(llamada.clave, texto, schema)
+                return texto
             else:
                 # Si Gemini falla, usar fallback
-                return self._generate_fallback_response(user_content, system_content)
+                return self._fallback_for(messages)
                 
+        except (QuotaExceededError, CircuitOpenError):
+            # La cuota agotada se informa al usuario; no se disimula con el fallback
+            raise
         except Exception as e:
-            error_msg = str(e)
             # En caso de error con Gemini, usar fallback
-            return self._generate_fallback_response(user_content, system_content)
-    
+            self._forget_context(llamada)
+            _raise_if_open(e)
+            return self._fallback_for(messages)
+
+    async def _chat_async(self, messages: List[Dict[str, str]], temperature: float = 0.2,
+                          schema: Optional[Dict[str, Any]] = None) -> str:
+        """Igual que `_chat` pero sin bloquear: permite lanzar varias llamadas a la vez."""
+        llamada = None
+        try:
+            llamada = self._prepare_call(messages, temperature, schema)
+            guardada = response_cache.get(llamada.clave)
+            if guardada is not None:
+                return guardada
+            if not gemini_breaker.allow():
+                raise CircuitOpenError("Gemini no disponible")
+            modelo = await asyncio.to_thread(self._bind_context, llamada)
+            response = await self._call_gemini_async(
+                lambda: modelo.generate_content_async(llamada.full_prompt, **llamada.kwargs),
+                self._estimate_tokens(llamada.full_prompt))
+            if response and response.text:
+                texto = response.text.strip()
+                _store_response(llamada.clave, texto, schema)
+                return texto
+            return self._fallback_for(messages)
+        except (QuotaExceededError, CircuitOpenError):
+            raise
+        except Exception as e:
+            self._forget_context(llamada)
+            _raise_if_open(e)
+            return self._fallback_for(messages)
+
+    def _chat_stream(self, messages: List[Dict[str, str]], temperature: float = 0.2,
+                     on_complete: Optional[Callable[[str], None]] = None,
+                     schema: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """
+        Igual que `_chat` pero entrega los fragmentos a medida que Gemini los genera.
+        `on_complete` recibe el texto solo si la respuesta llegó entera (no con el fallback).
+        """
+        emitido = False
+        llamada = None
+        try:
+            llamada = self._prepare_call(messages, temperature, schema)
+            guardada = response_cache.get(llamada.clave)
+            if guardada is not None:
+                yield guardada
+                if on_complete is not None:
+                    on_complete(guardada)
+                return
+            partes = []
+            if not gemini_breaker.allow():
+                raise CircuitOpenError("Gemini no disponible")
+            modelo = self._bind_context(llamada)
+            for fragmento in self._stream_gemini(
+                    lambda: modelo.generate_content(llamada.full_prompt, stream=True, **llamada.kwargs),
+                    self._estimate_tokens(llamada.full_prompt)):
+                emitido = True
+                partes.append(fragmento)
+                yield fragmento
+            # Solo una respuesta recibida completa queda en el cache
+            if emitido:
+                completa = "".join(partes).strip()
+                _store_response(llamada.clave, completa, schema)
+                if on_complete is not None:
+                    on_complete(completa)
+        except (QuotaExceededError, CircuitOpenError):
+            raise
+        except Exception as e:
+            self._forget_context(llamada)
+            # Si el corte ocurre a mitad de respuesta se conserva lo ya mostrado
+            if emitido:
+                return
+            _raise_if_open(e)
+        if not emitido:
+            yield self._fallback_for(messages)
+
+    def _fallback_for(self, messages: List[Dict[str, str]]) -> str:
+        system_content, user_content = self._split_messages(messages)
+        return self._generate_fallback_response(user_content, system_content)
+
     def _generate_fallback_response(self, user_content: str, system_content: str) -> str:
         """Genera una respuesta de fallback cuando Brainbox no puede responder"""
         
@@ -344,9 +863,23 @@ Si necesitas ayuda específica, reformula tu pregunta mencionando el aspecto par
 **💬 CHAT DISPONIBLE:**
 Puedes hacer preguntas específicas sobre tu documento y recibirás respuestas detalladas y fundamentadas."""
 
-    @st.cache_data
-    def analyze_document_cached(_self, texto: str, _analyzer=None) -> Dict[str, Any]:
-        """Cache para análisis de documentos."""
+    def _calibrate(self, texto: str) -> str:
+        """Calibra la cuenta de tokens del modelo (una vez) y devuelve su nombre."""
+        modelo = self.model.model_name
+        if TOKEN_CALIBRATION and not is_calibrated(modelo):
+            calibrate(modelo, texto[:CALIBRATION_SAMPLE_CHARS],
+                      lambda muestra: self.model.count_tokens(muestra, request_options={"timeout": 10}).total_tokens)
+        return modelo
+
+    def _pack(self, tarea: str, texto: str, presupuesto: int) -> str:
+        """Documento para el prompt de `tarea` dentro de su presupuesto de tokens; guarda el informe del corte."""
+        modelo = self._calibrate(texto)
+        paquete = pack_document(texto, presupuesto, self.SECTION_PRIORITIES[tarea], modelo)
+        self.packing_reports[tarea] = paquete
+        return paquete.texto
+
+    def _analysis_messages(self, texto: str) -> List[Dict[str, str]]:
+        """Prompt del análisis del documento (paso 2)."""
         system = build_specialized_prompt(
             """Eres un abogado experto en derecho administrativo colombiano con más de 15 años de experiencia. 
             Tu especialidad es el análisis de derechos de petición y procedimientos administrativos.
@@ -376,9 +909,10 @@ Puedes hacer preguntas específicas sobre tu documento y recibirás respuestas d
             "administrative_law"
         )
         
+        documento = self._pack("analisis", texto, self.ANALYSIS_TOKENS)
         user = f"""
 DOCUMENTO A ANALIZAR:
-\"\"\"{texto[:4000]}\"\"\"
+\"\"\"{documento}\"\"\"
 
 REQUISITOS DEL ANÁLISIS:
 - Realiza un análisis exhaustivo y profesional
@@ -391,14 +925,15 @@ REQUISITOS DEL ANÁLISIS:
 IMPORTANTE: Responde ÚNICAMENTE con el JSON solicitado, sin texto adicional.
         """.strip()
 
-        raw = _self._chat(
-            [{"role": "system", "content": system},
-             {"role": "user", "content": user}],
-            temperature=0.1,
-        )
+        return self._document_messages(system, user, texto, documento)
 
-        block = _extract_json_block(raw)
-        data = _safe_json_loads(block, {
+    def _parse_analysis(self, raw: str, texto: str) -> Dict[str, Any]:
+        """Convierte la respuesta del modelo en el análisis que muestra el paso 2."""
+        return self._analysis_from(_load_json(raw), texto)
+
+    def _analysis_from(self, data: Any, texto: str) -> Dict[str, Any]:
+        """Normaliza el JSON del análisis; si no es válido usa el análisis básico."""
+        fallback = {
             "tipo_documento": "Derecho de Petición",
             "longitud": len(texto),
             "palabras_clave": ["petición", "derecho", "solicitud", "administrativo", "procedimiento"],
@@ -425,7 +960,9 @@ El documento analizado corresponde a un derecho de petición presentado ante una
 4. Analizar argumentación sustancial
 
 *Nota: Este es un análisis básico. Se requiere procesamiento completo para evaluación detallada.*""",
-        })
+        }
+        if not isinstance(data, dict):
+            data = fallback
 
         return {
             "tipo_documento": data.get("tipo_documento", "Derecho de Petición"),
@@ -437,13 +974,18 @@ El documento analizado corresponde a un derecho de petición presentado ante una
         }
 
     def analyze_document(self, texto: str) -> Dict[str, Any]:
-        """Análisis de documento con cache."""
-        return self.analyze_document_cached(texto, self)
-
-    @st.cache_data
-    def detect_problems_cached(_self, texto: str, contexto: Dict[str, Any], _analyzer=None) -> List[Dict[str, Any]]:
-        """Cache para detección de problemas."""
-        system = build_specialized_prompt(
+        """Análisis de documento (la respuesta del modelo queda en el cache persistente)."""
+        if not gemini_breaker.allow():
+            return self.local.analyze_document(texto)
+        try:
+            raw = self._chat(self._analysis_messages(texto), temperature=0.1, schema=ANALYSIS_SCHEMA)
+        except CircuitOpenError:
+            return self.local.analyze_document(texto)
+        return self._parse_analysis(raw, texto)
+
+    def _problems_system(self) -> str:
+        """Rol e instrucciones de la detección de problemas (documento completo o por fragmentos)."""
+        return build_specialized_prompt(
             """Eres un abogado revisor especializado en derecho administrativo colombiano con amplia experiencia en control de legalidad.
             
             INSTRUCCIONES ESPECÍFICAS:
@@ -472,10 +1014,15 @@ El documento analizado corresponde a un derecho de petición presentado ante una
             }""",
             "procedural_law"
         )
+
+    def _problems_messages(self, texto: str, contexto: Dict[str, Any]) -> List[Dict[str, str]]:
+        """Prompt de la detección de problemas (paso 3)."""
+        system = self._problems_system()
         
+        documento = self._pack("problemas", texto, self.PROBLEMS_TOKENS)
         user = f"""
 DOCUMENTO A REVISAR:
-\"\"\"{texto[:3000]}\"\"\"
+\"\"\"{documento}\"\"\"
 
 CONTEXTO DEL ANÁLISIS PREVIO:
 {json.dumps(contexto, ensure_ascii=False, default=str)}
@@ -491,13 +1038,14 @@ REQUISITOS DE LA REVISIÓN:
 IMPORTANTE: Responde ÚNICAMENTE con el array JSON solicitado, sin texto adicional.
         """.strip()
 
-        raw = _self._chat(
-            [{"role": "system", "content": system},
-             {"role": "user", "content": user}],
-            temperature=0.1,
-        )
+        return self._document_messages(system, user, texto, documento)
+
+    def _parse_problems(self, raw: str) -> List[Dict[str, Any]]:
+        """Convierte la respuesta del modelo en la lista de problemas del paso 3."""
+        return self._problems_from(_load_json(raw))
 
-        block = _extract_json_block(raw)
+    def _problems_from(self, data: Any) -> List[Dict[str, Any]]:
+        """Lista de problemas del JSON; si no es válida usa los problemas predefinidos."""
         fallback = [
             {
                 "tipo": "FORMAL",
@@ -527,15 +1075,150 @@ IMPORTANTE: Responde ÚNICAMENTE con el array JSON solicitado, sin texto adicion
                 "recomendacion_breve": "Incluir fundamento legal y argumentación jurídica"
             }
         ]
-        return _safe_json_loads(block, fallback)
+        return data if isinstance(data, list) else fallback
 
     def detect_problems(self, texto: str, contexto: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """Detección de problemas con cache."""
-        return self.detect_problems_cached(texto, contexto, self)
+        """Detección de problemas (la respuesta del modelo queda en el cache persistente)."""
+        if not gemini_breaker.allow():
+            return self.local.detect_problems(texto, contexto)
+        fragmentos = self._problem_chunks(texto)
+        try:
+            if fragmentos:
+                return _run_async(self._map_reduce_problems(fragmentos), self.wait_notifier, grupo=self)
+            raw = self._chat(self._problems_messages(texto, contexto), temperature=0.1, schema=PROBLEMS_SCHEMA)
+        except CircuitOpenError:
+            return self.local.detect_problems(texto, contexto)
+        return self._parse_problems(raw)
+
+    def _problem_chunks(self, texto: str) -> List[DocumentChunk]:
+        """
+        Fragmentos por sección para la detección de problemas; ninguno si el documento
+        cabe completo en el presupuesto de la llamada única (`PROBLEMS_TOKENS`).
+        """
+        modelo = self._calibrate(texto)
+        if estimate_tokens(texto, modelo) <= self.PROBLEMS_TOKENS:
+            return []
+        # Se revisa el documento completo: no hay recorte que informar
+        self.packing_reports.pop("problemas", None)
+        return split_document(texto, MAPREDUCE_CHUNK_TOKENS, modelo, MAPREDUCE_MAX_CHUNKS)
+
+    def _chunk_problems_messages(self, fragmento: DocumentChunk) -> List[Dict[str, str]]:
+        """
+        Prompt de un fragmento (fase map). Solo depende del texto del fragmento, así
+        que su respuesta queda en el cache persistente con la huella de ese texto y al
+        editar el documento solo se vuelven a consultar los fragmentos que cambiaron.
+        """
+        user = f"""
+FRAGMENTO DEL DOCUMENTO A REVISAR (secciones: {", ".join(fragmento.secciones)}):
+\"\"\"{fragmento.texto}\"\"\"
 
-    @st.cache_data
-    def generate_recommendations_cached(_self, texto: str, problemas: List[Dict[str, Any]], _analyzer=None) -> List[Dict[str, Any]]:
-        """Cache para generación de recomendaciones."""
+REQUISITOS DE LA REVISIÓN:
+- Identifica solo los problemas que se ven en este fragmento; el resto del documento se revisa aparte
+- Clasifica por categoría y severidad, con fundamento legal específico
+- En "linea" indica la línea dentro del fragmento (la primera línea es 1) o 'N/A'
+- Si el fragmento no tiene problemas, responde con un array vacío
+
+IMPORTANTE: Responde ÚNICAMENTE con el array JSON solicitado, sin texto adicional.
+        """.strip()
+
+        return [{"role": "system", "content": self._problems_system()},
+                {"role": "user", "content": user}]
+
+    def _chunk_problems_from(self, data: Any, fragmento: DocumentChunk) -> List[Dict[str, Any]]:
+        """Problemas válidos de un fragmento con la línea llevada a la numeración del documento."""
+        if not isinstance(data, list):
+            return []
+        problemas = []
+        for problema in data:
+            if not isinstance(problema, dict):
+                continue
+            linea = str(problema.get("linea", "")).strip()
+            if linea.isdigit():
+                problema = {**problema, "linea": str(fragmento.linea_inicial + int(linea) - 1)}
+            problemas.append(problema)
+        return problemas
+
+    def _reduce_problems_messages(self, problemas: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """Prompt de la fase reduce: une los problemas de todos los fragmentos sin repetir."""
+        system = build_specialized_prompt(
+            """Eres un abogado revisor especializado en derecho administrativo colombiano.
+            Recibes los problemas detectados por separado en cada fragmento de un mismo documento.
+            
+            INSTRUCCIONES ESPECÍFICAS:
+            1. Une los problemas que describen la misma falla aunque estén redactados distinto
+            2. Al unir, conserva la severidad más alta, el fundamento legal más específico y la primera línea
+            3. No inventes problemas nuevos ni descartes problemas distintos
+            4. Ordena el resultado de mayor a menor severidad
+            
+            FORMATO DE RESPUESTA: Devuelve SOLO un array JSON con la misma estructura de los problemas recibidos""",
+            "procedural_law"
+        )
+        user = f"""
+PROBLEMAS DETECTADOS POR FRAGMENTO:
+{json.dumps(problemas, ensure_ascii=False)}
+
+IMPORTANTE: Responde ÚNICAMENTE con el array JSON consolidado, sin texto adicional.
+        """.strip()
+
+        return [{"role": "system", "content": system},
+                {"role": "user", "content": user}]
+
+    async def _map_reduce_problems(self, fragmentos: List[DocumentChunk]) -> List[Dict[str, Any]]:
+        """
+        Detección de problemas en documentos largos: cada fragmento se revisa por
+        separado (a lo sumo MAPREDUCE_CONCURRENCY a la vez) y una última llamada une
+        y depura los resultados. Si esa llamada falla se usa la unión local.
+        """
+        semaforo = asyncio.Semaphore(MAPREDUCE_CONCURRENCY)
+
+        async def revisar(fragmento: DocumentChunk) -> List[Dict[str, Any]]:
+            async with semaforo:
+                raw = await self._chat_async(self._chunk_problems_messages(fragmento),
+                                             temperature=0.1, schema=PROBLEMS_SCHEMA)
+            return self._chunk_problems_from(_load_json(raw), fragmento)
+
+        parciales = await asyncio.gather(*(revisar(fragmento) for fragmento in fragmentos))
+        candidatos = _dedupe_problems([problema for parcial in parciales for problema in parcial])
+        if len(candidatos) <= 1:
+            return candidatos or self._problems_from(None)
+
+        raw = await self._chat_async(self._reduce_problems_messages(candidatos), temperature=0.1, schema=PROBLEMS_SCHEMA)
+        data = _load_json(raw)
+        consolidados = [problema for problema in data if isinstance(problema, dict)] if isinstance(data, list) else []
+        return consolidados or candidatos
+
+    def _stream_items(self, messages: List[Dict[str, str]], temperature: float,
+                      schema: Dict[str, Any]) -> Iterator[Any]:
+        """Elementos del array JSON de la respuesta a medida que el modelo los cierra."""
+        parser = JSONArrayStreamParser()
+        for fragmento in self._chat_stream(messages, temperature, schema=schema):
+            yield from parser.feed(fragmento)
+
+    def detect_problems_stream(self, texto: str, contexto: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Como `detect_problems`, pero entrega cada problema apenas llega completo."""
+        if not gemini_breaker.allow():
+            yield from self.local.detect_problems_stream(texto, contexto)
+            return
+        fragmentos = self._problem_chunks(texto)
+        emitidos = 0
+        try:
+            if fragmentos:
+                # Por fragmentos la lista solo es definitiva después de la fase reduce
+                yield from _run_async(self._map_reduce_problems(fragmentos), self.wait_notifier, grupo=self)
+                return
+            for problema in self._stream_items(self._problems_messages(texto, contexto), 0.1, PROBLEMS_SCHEMA):
+                if isinstance(problema, dict):
+                    emitidos += 1
+                    yield problema
+        except CircuitOpenError:
+            # Se abre antes del primer fragmento de la respuesta: todavía no se mostró nada
+            yield from self.local.detect_problems_stream(texto, contexto)
+            return
+        if not emitidos:
+            yield from self._problems_from(None)
+
+    def _recommendations_messages(self, texto: str, problemas: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """Prompt de la generación de recomendaciones (paso 4)."""
         system = build_specialized_prompt(
             """Eres un abogado redactor especializado en derecho administrativo colombiano con experiencia en litigio y asesoría.
             
@@ -567,12 +1250,13 @@ IMPORTANTE: Responde ÚNICAMENTE con el array JSON solicitado, sin texto adicion
             "strategic_improvements"
         )
         
+        documento = self._pack("recomendaciones", texto, self.RECOMMENDATIONS_TOKENS)
         user = f"""
 PROBLEMAS IDENTIFICADOS:
 {json.dumps(problemas, ensure_ascii=False, default=str)}
 
 CONTEXTO DEL DOCUMENTO:
-\"\"\"{texto[:2000]}\"\"\"
+\"\"\"{documento}\"\"\"
 
 REQUISITOS DE LAS RECOMENDACIONES:
 - Genera recomendaciones específicas para CADA problema identificado
@@ -586,27 +1270,23 @@ REQUISITOS DE LAS RECOMENDACIONES:
 IMPORTANTE: Responde ÚNICAMENTE con el array JSON solicitado, sin texto adicional.
         """.strip()
 
-        try:
-            raw = _self._chat(
-                [{"role": "system", "content": system},
-                 {"role": "user", "content": user}],
-                temperature=0.2,
-            )
-
-            block = _extract_json_block(raw)
-            if block:
-                parsed = _safe_json_loads(block, None)
-                if isinstance(parsed, list) and len(parsed) > 0:
-                    # Validar que cada elemento tenga la estructura correcta
-                    valid_recommendations = []
-                    for rec in parsed:
-                        if isinstance(rec, dict) and "titulo" in rec:
-                            valid_recommendations.append(rec)
-                    
-                    if valid_recommendations:
-                        return valid_recommendations
-        except Exception as e:
-            st.warning(f"Error generando recomendaciones con IA: {str(e)}")
+        return self._document_messages(system, user, texto, documento)
+
+    def _parse_recommendations(self, raw: str, problemas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Convierte la respuesta del modelo en la lista de recomendaciones del paso 4."""
+        return self._recommendations_from(_load_json(raw), problemas)
+
+    def _recommendations_from(self, data: Any, problemas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Valida las recomendaciones del JSON; si no sirven, usa las predefinidas."""
+        if isinstance(data, list) and len(data) > 0:
+            # Validar que cada elemento tenga la estructura correcta
+            valid_recommendations = []
+            for rec in data:
+                if isinstance(rec, dict) and "titulo" in rec:
+                    valid_recommendations.append(rec)
+
+            if valid_recommendations:
+                return valid_recommendations
         
         # Fallback robusto con recomendaciones predefinidas
         fallback = [
@@ -702,58 +1382,329 @@ IMPORTANTE: Responde ÚNICAMENTE con el array JSON solicitado, sin texto adicion
         return fallback
 
     def generate_recommendations(self, texto: str, problemas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Generación de recomendaciones con cache."""
-        return self.generate_recommendations_cached(texto, problemas, self)
+        """Generación de recomendaciones (la respuesta del modelo queda en el cache persistente)."""
+        if not gemini_breaker.allow():
+            return self.local.generate_recommendations(texto, problemas)
+        try:
+            raw = self._chat(self._recommendations_messages(texto, problemas), temperature=0.2,
+                             schema=RECOMMENDATIONS_SCHEMA)
+        except QuotaExceededError:
+            raise
+        except CircuitOpenError:
+            return self.local.generate_recommendations(texto, problemas)
+        except Exception as e:
+            st.warning(f"Error generando recomendaciones con IA: {str(e)}")
+            raw = ""
+        return self._parse_recommendations(raw, problemas)
+
+    def generate_recommendations_stream(self, texto: str, problemas: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Como `generate_recommendations`, pero entrega cada recomendación apenas llega completa."""
+        if not gemini_breaker.allow():
+            yield from self.local.generate_recommendations_stream(texto, problemas)
+            return
+        emitidas = 0
+        try:
+            for rec in self._stream_items(self._recommendations_messages(texto, problemas), 0.2, RECOMMENDATIONS_SCHEMA):
+                if isinstance(rec, dict) and "titulo" in rec:
+                    emitidas += 1
+                    yield rec
+        except CircuitOpenError:
+            yield from self.local.generate_recommendations_stream(texto, problemas)
+            return
+        if not emitidas:
+            yield from self._recommendations_from(None, problemas)
+
+    def _pipeline_context(self, texto: str) -> Dict[str, Any]:
+        """Contexto local (sin IA) para detectar problemas sin esperar al análisis."""
+        indice = build_document_index(texto)
+        return {
+            "longitud": len(texto),
+            "palabras": indice.word_count,
+            "secciones_detectadas": [nombre for nombre in indice.sections if nombre != "encabezado"],
+        }
 
-    def chat_response(self, pregunta: str, contexto: Dict[str, Any]) -> str:
-        """Respuesta de chat usando solo Gemini 2.0 Flash."""
+    def _fused_messages(self, texto: str) -> List[Dict[str, str]]:
+        """Prompt único con las tres tareas: el documento y el rol se envían una sola vez."""
+        system = build_specialized_prompt(
+            """Eres un abogado experto en derecho administrativo colombiano con más de 15 años de experiencia
+            en derechos de petición, control de legalidad y redacción de contestaciones.
+            
+            INSTRUCCIONES ESPECÍFICAS (en una sola respuesta):
+            1. ANÁLISIS: evalúa el documento desde una perspectiva legal integral (forma y fondo)
+            2. PROBLEMAS: identifica problemas formales, sustanciales, constitucionales y administrativos,
+               con severidad justificada y fundamento legal
+            3. RECOMENDACIONES: propone al menos una recomendación concreta para cada problema,
+               priorizada según su impacto en el procedimiento
+            
+            FORMATO DE RESPUESTA: Devuelve SOLO un JSON válido con la siguiente estructura:
+            {
+              "analisis": {
+                "tipo_documento": "Tipo específico del documento",
+                "longitud": <número de caracteres>,
+                "palabras_clave": ["término1", "término2", "término3", "término4", "término5"],
+                "confianza": <número entre 0.0 y 1.0>,
+                "analisis_markdown": "Análisis estructurado en Markdown: resumen ejecutivo, estructura formal,
+                  contenido sustancial, fortalezas y debilidades, observaciones legales"
+              },
+              "problemas": [
+                {
+                  "tipo": "FORMAL/SUSTANCIAL/CONSTITUCIONAL/ADMINISTRATIVO",
+                  "descripcion": "Descripción detallada del problema",
+                  "severidad": "ALTA/MEDIA/BAJA",
+                  "linea": "Número de línea aproximado o 'N/A'",
+                  "fundamento_legal": "Norma o jurisprudencia aplicable",
+                  "impacto": "Impacto en el procedimiento",
+                  "recomendacion_breve": "Sugerencia de corrección específica"
+                }
+              ],
+              "recomendaciones": [
+                {
+                  "titulo": "Título específico de la recomendación",
+                  "descripcion": "Descripción detallada con fundamento",
+                  "prioridad": "ALTA/MEDIA/BAJA",
+                  "accion": "Acción específica y ejecutable",
+                  "fundamento_legal": "Norma o jurisprudencia que la respalda",
+                  "tiempo_estimado": "inmediato/corto/mediano plazo",
+                  "recursos_necesarios": "Recursos requeridos",
+                  "impacto_esperado": "Resultado esperado",
+                  "riesgos": "Riesgos o consideraciones"
+                }
+              ]
+            }""",
+            "administrative_law"
+        )
         
-        try:
-            # Prompt para respuesta legal directa con Gemini
-            system_prompt = """Eres un asistente legal especializado en derecho administrativo colombiano con amplia experiencia en derecho administrativo, constitucional y procedimental.
+        # La misma llamada detecta los problemas: el documento va con el presupuesto de esa tarea
+        documento = self._pack("problemas", texto, self.PROBLEMS_TOKENS)
+        user = f"""
+DOCUMENTO A ANALIZAR:
+\"\"\"{documento}\"\"\"
 
-INSTRUCCIONES ESPECÍFICAS:
-1. Responde de manera profesional, clara y útil
-2. Utiliza el contexto del análisis previo cuando esté disponible
-3. Proporciona información legal precisa y actualizada
-4. Incluye fundamento legal cuando sea relevante
-5. Ofrece orientación práctica y accionable
-6. Mantén un tono profesional pero accesible
+REQUISITOS:
+- Análisis exhaustivo y profesional del derecho de petición
+- Identifica TODOS los problemas relevantes (mínimo 3-5 problemas)
+- Genera recomendaciones específicas para CADA problema identificado
+- Incluye fundamento legal específico en problemas y recomendaciones
 
-ÁREAS DE EXPERTISE:
-- Derecho Administrativo Colombiano
-- Derecho Constitucional
-- Procedimiento Administrativo
-- Derecho de Petición
-- Recursos Administrativos
-- Control de Legalidad
-- Jurisprudencia relevante"""
-            
-            user_prompt = f"""
-PREGUNTA DEL USUARIO: {pregunta}
-
-CONTEXTO DISPONIBLE DEL ANÁLISIS PREVIO:
-- Análisis del documento: {str(contexto.get('analisis', 'No disponible'))}
-- Problemas detectados: {str(contexto.get('problemas', 'No disponibles'))}
-- Recomendaciones generadas: {str(contexto.get('recomendaciones', 'No disponibles'))}
-
-INSTRUCCIONES:
-- Responde la pregunta de manera completa y útil
-- Utiliza el contexto del análisis cuando sea relevante
-- Proporciona fundamento legal cuando sea apropiado
-- Ofrece orientación práctica y accionable
-- Si la pregunta no está relacionada con el análisis previo, responde basándote en tu conocimiento legal general
-
-Responde de manera profesional y útil, considerando el contexto disponible.
+IMPORTANTE: Responde ÚNICAMENTE con el JSON solicitado, sin texto adicional.
         """.strip()
 
-            # Llamada directa a Gemini usando _chat
-            return self._chat(
-                [{"role": "system", "content": system_prompt},
-                 {"role": "user", "content": user_prompt}],
-                temperature=0.2
-            )
+        return self._document_messages(system, user, texto, documento)
+
+    def _parse_fused(self, raw: str, texto: str) -> Dict[str, Any] | None:
+        """Separa la respuesta única en las tres estructuras; None si está incompleta."""
+        data = _load_json(raw)
+        if not isinstance(data, dict) or not all(k in data for k in ("analisis", "problemas", "recomendaciones")):
+            return None
+        problemas = self._problems_from(data["problemas"])
+        return {
+            "analisis": self._analysis_from(data["analisis"], texto),
+            "problemas": problemas,
+            "recomendaciones": self._recommendations_from(data["recomendaciones"], problemas),
+        }
+
+    async def run_pipeline_async(self, texto: str, fusionado: bool = True) -> Dict[str, Any]:
+        """
+        Pasos 2-4 en el menor tiempo posible. En modo fusionado basta una llamada;
+        si su respuesta llega incompleta, o en modo separado, el análisis corre en
+        paralelo con la cadena problemas → recomendaciones, así que el tiempo total
+        lo marca la rama más lenta y no la suma de las tres llamadas.
+        """
+        # Un documento que no cabe en una llamada se revisa por fragmentos
+        fragmentos = self._problem_chunks(texto)
+        if fusionado and not fragmentos:
+            resultado = self._parse_fused(
+                await self._chat_async(self._fused_messages(texto), temperature=0.1, schema=FUSED_SCHEMA), texto)
+            if resultado is not None:
+                return resultado
+
+        analisis_task = asyncio.create_task(
+            self._chat_async(self._analysis_messages(texto), temperature=0.1, schema=ANALYSIS_SCHEMA))
+        try:
+            if fragmentos:
+                problemas = await self._map_reduce_problems(fragmentos)
+            else:
+                raw_problemas = await self._chat_async(
+                    self._problems_messages(texto, self._pipeline_context(texto)), temperature=0.1, schema=PROBLEMS_SCHEMA)
+                problemas = self._parse_problems(raw_problemas)
+            raw_recomendaciones = await self._chat_async(
+                self._recommendations_messages(texto, problemas), temperature=0.2, schema=RECOMMENDATIONS_SCHEMA)
+            raw_analisis = await analisis_task
+        except BaseException:
+            # Si una rama falla (por ejemplo, con el interruptor abierto) la otra no sigue llamando a Gemini
+            analisis_task.cancel()
+            raise
+        return {
+            "analisis": self._parse_analysis(raw_analisis, texto),
+            "problemas": problemas,
+            "recomendaciones": self._parse_recommendations(raw_recomendaciones, problemas),
+        }
+
+    def run_pipeline(self, texto: str, fusionado: bool | None = None) -> Dict[str, Any]:
+        """Análisis, problemas y recomendaciones; por defecto según GEMINI_PIPELINE_MODE."""
+        if not gemini_breaker.allow():
+            return self.local.run_pipeline(texto)
+        if fusionado is None:
+            fusionado = PIPELINE_MODE == "fused"
+        try:
+            return _run_async(self.run_pipeline_async(texto, fusionado), self.wait_notifier, grupo=self)
+        except CircuitOpenError:
+            return self.local.run_pipeline(texto)
+
+    def _chat_context(self, contexto: Dict[str, Any]) -> str:
+        """Contexto del documento para la sesión de chat: el análisis y una línea por problema y recomendación."""
+        analisis = contexto.get("analisis") or {}
+        lineas = []
+        if isinstance(analisis, dict):
+            for clave, etiqueta in (("tipo_documento", "Tipo de documento"), ("tipo", "Tipo de documento"),
+                                    ("palabras_clave", "Palabras clave")):
+                if analisis.get(clave):
+                    valor = analisis[clave]
+                    lineas.append(f"{etiqueta}: {', '.join(map(str, valor)) if isinstance(valor, list) else valor}")
+            if analisis.get("analisis_markdown"):
+                lineas.append(f"ANÁLISIS:\n{analisis['analisis_markdown']}")
+        elif analisis:
+            lineas.append(f"ANÁLISIS:\n{analisis}")
+        problemas = [p for p in contexto.get("problemas") or [] if isinstance(p, dict)]
+        if problemas:
+            lineas.append("PROBLEMAS DETECTADOS:")
+            lineas += [f"- [{p.get('severidad', 'N/A')}] {p.get('tipo', '')}: {p.get('descripcion', '')}"
+                       + (f" ({p['fundamento_legal']})" if p.get("fundamento_legal") else "") for p in problemas]
+        recomendaciones = [r for r in contexto.get("recomendaciones") or [] if isinstance(r, dict)]
+        if recomendaciones:
+            lineas.append("RECOMENDACIONES:")
+            lineas += [f"- [{r.get('prioridad', 'N/A')}] {r.get('titulo', '')}"
+                       + (f": {r['accion']}" if r.get("accion") else "") for r in recomendaciones]
+        return "\n".join(lineas) or "Análisis no disponible"
+
+    def _summarize_turns(self, resumen: str, turnos: List[Tuple[str, str]]) -> str:
+        """Condensa en un resumen corto los turnos que salen de la ventana del chat ("" si la IA no responde)."""
+        conversacion = "\n\n".join(f"USUARIO: {pregunta}\nASISTENTE: {respuesta}" for pregunta, respuesta in turnos)
+        messages = [
+            {"role": "system", "content": "Eres un asistente legal que resume conversaciones sobre un derecho de petición. "
+                                          "Conserva las preguntas, las conclusiones y las normas citadas; omite lo demás."},
+            {"role": "user", "content": f"RESUMEN PREVIO:\n{resumen or 'Ninguno'}\n\nNUEVOS TURNOS:\n{conversacion}\n\n"
+                                        "Devuelve un único resumen actualizado de máximo 150 palabras."},
+        ]
+        try:
+            respuesta = self._chat(messages, temperature=0.1)
+        except CircuitOpenError:
+            return ""
+        return "" if respuesta == self._fallback_for(messages) else respuesta
+
+    def _chat_session(self, alcance: str, contexto: Dict[str, Any]) -> DocumentChatSession:
+        """Sesión de chat del documento actual; un documento (o análisis) nuevo abre otra sesión."""
+        if self.chat_session is None or self.chat_scope != alcance:
+            texto_contexto = self._chat_context(contexto)
+            modelo = self.model
+            # Con cache de contexto las instrucciones y el contexto quedan registrados en el modelo
+            tokens = self._estimate_tokens(f"{CHAT_SYSTEM_PROMPT}\n{texto_contexto}")
+            en_cache = self.context_cache.get(self.model, CHAT_SYSTEM_PROMPT, texto_contexto,
+                                              via=lambda crear: rate_limiter.call(crear, tokens, self.wait_notifier, grupo=self))
+            if en_cache is not None:
+                modelo = self.context_cache.model_for(self.model, en_cache)
+            self.chat_session = DocumentChatSession(modelo, CHAT_SYSTEM_PROMPT, texto_contexto, CHAT_WINDOW_TOKENS,
+                                                    self._summarize_turns, contexto_en_cache=en_cache is not None)
+            self.chat_scope = alcance
+        return self.chat_session
+
+    def _session_stream(self, sesion: DocumentChatSession, pregunta: str, kwargs: Dict[str, Any],
+                        on_complete: Callable[[str], None], fallback: str) -> Iterator[str]:
+        """Fragmentos de la respuesta de la sesión; el turno se guarda solo si llegó completo."""
+        emitido = False
+        partes = []
+        try:
+            chat = sesion.prepare()
+            for fragmento in self._stream_gemini(lambda: chat.send_message(pregunta, stream=True, **kwargs),
+                                                 sesion.prompt_tokens(pregunta)):
+                emitido = True
+                partes.append(fragmento)
+                yield fragmento
+            if emitido:
+                on_complete("".join(partes).strip())
+        except QuotaExceededError:
+            raise
+        except Exception:
+            if emitido:
+                return
+        if not emitido:
+            yield fallback
+
+    @staticmethod
+    def _semantic_scope(contexto: Dict[str, Any], documento: Optional[str]) -> str:
+        """
+        Alcance del cache semántico: la huella del texto del documento y la versión de los prompts.
+        Sin texto se usa el contexto sin los campos que cambian en cada análisis (la fecha).
+        """
+        if documento:
+            huella = content_digest(documento.encode("utf-8"))
+        else:
+            analisis = contexto.get("analisis")
+            if isinstance(analisis, dict):
+                contexto = {**contexto, "analisis": {clave: valor for clave, valor in analisis.items()
+                                                     if clave not in VOLATILE_ANALYSIS_FIELDS}}
+            huella = content_digest(json.dumps(contexto, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+        return f"{PROMPT_VERSION}:{huella}"
+
+    def chat_response(self, pregunta: str, contexto: Dict[str, Any], stream: bool = False,
+                      documento: Optional[str] = None) -> Union[str, Iterator[str]]:
+        """
+        Respuesta de chat usando solo Gemini 2.0 Flash, dentro de la sesión del documento:
+        el contexto se arma una vez y cada pregunta solo agrega su turno al historial.
+        Con `stream=True` devuelve un iterador de fragmentos para mostrarlos a medida que llegan.
+        `documento` (el texto extraído) identifica el documento en el cache semántico, de modo
+        que volver a analizar el mismo archivo sigue sirviendo las respuestas ya guardadas.
+        Las preguntas que no remiten a turnos anteriores usan ese cache en cualquier turno.
+        Con el interruptor de Gemini abierto responde el analizador local.
+        """
+        if not gemini_breaker.allow():
+            return self.local.chat_response(pregunta, contexto, stream=stream)
+        
+        try:
+            # La sesión sigue al contexto completo (un análisis nuevo abre otra sesión); las
+            # preguntas solo se comparan con las hechas sobre el mismo documento
+            sesion = self._chat_session(
+                content_digest(json.dumps(contexto, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")),
+                contexto)
+            alcance = self._semantic_scope(contexto, documento)
+            # Una pregunta que remite a la conversación ("explica eso", "¿y el plazo?") no se
+            # responde desde el cache ni se guarda en él; las demás sí, en cualquier turno
+            independiente = not sesion.started or not refers_to_history(pregunta)
+            guardada = chat_cache.lookup(alcance, pregunta) if independiente else None
+            if guardada is not None:
+                sesion.record(pregunta, guardada[0])
+                return iter([guardada[0]]) if stream else guardada[0]
+
+            def recordar(respuesta: str) -> None:
+                sesion.record(pregunta, respuesta)
+                if independiente:
+                    chat_cache.store(alcance, pregunta, respuesta)
+
+            # El fallback se elige por la pregunta; no se guarda en el historial ni en el cache
+            messages = [{"role": "system", "content": CHAT_SYSTEM_PROMPT},
+                        {"role": "user", "content": pregunta}]
+            fallback = self._fallback_for(messages)
+            _, kwargs = self._generation_request(messages, temperature=0.2)
+
+            if stream:
+                return self._session_stream(sesion, pregunta, kwargs, recordar, fallback)
+
+            try:
+                chat = sesion.prepare()
+                response = self._call_gemini(lambda: chat.send_message(pregunta, **kwargs),
+                                             sesion.prompt_tokens(pregunta))
+                respuesta = response.text.strip() if response and response.text else ""
+            except QuotaExceededError:
+                raise
+            except Exception:
+                respuesta = ""
+            if not respuesta:
+                return fallback
+            recordar(respuesta)
+            return respuesta
                 
+        except QuotaExceededError:
+            raise
         except Exception as e:
             error_msg = str(e)
             # Respuesta de fallback en caso de error
@@ -5,8 +5,9 @@ Analizador de IA simple que funciona sin dependencias externas
 
 import json
 import re
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterator, List, Any, Optional, Union
 import streamlit as st
+from document_processor import build_document_index
 
 class SimpleAIAnalyzer:
     """Analizador de IA simple que funciona localmente"""
@@ -18,21 +19,21 @@ class SimpleAIAnalyzer:
     def analyze_document(self, texto: str) -> Dict[str, Any]:
         """Análisis detallado del documento"""
         try:
-            # Análisis básico del texto
-            palabras = texto.split()
+            # Análisis básico del texto (índice compartido, calculado una sola vez)
+            indice = build_document_index(texto)
             caracteres = len(texto)
-            parrafos = texto.count('\n\n') + 1
-            oraciones = texto.count('.') + texto.count('!') + texto.count('?')
+            parrafos = indice.paragraph_count
+            oraciones = indice.sentence_count
             
             # Detectar tipo de documento con análisis más inteligente
             tipo_documento = "Documento Administrativo"
-            if any(palabra in texto.lower() for palabra in ["derecho de petición", "derecho de peticion", "petición", "peticion"]):
+            if indice.contains("derecho de petición", "derecho de peticion", "petición", "peticion"):
                 tipo_documento = "Derecho de Petición"
-            elif any(palabra in texto.lower() for palabra in ["recurso", "apelación", "apelacion", "reconsideración"]):
+            elif indice.contains("recurso", "apelación", "apelacion", "reconsideración"):
                 tipo_documento = "Recurso Administrativo"
-            elif any(palabra in texto.lower() for palabra in ["acto administrativo", "resolución", "resolucion", "decreto"]):
+            elif indice.contains("acto administrativo", "resolución", "resolucion", "decreto"):
                 tipo_documento = "Acto Administrativo"
-            elif any(palabra in texto.lower() for palabra in ["contrato", "convenio", "acuerdo"]):
+            elif indice.contains("contrato", "convenio", "acuerdo"):
                 tipo_documento = "Contrato o Convenio"
             
             # Análisis de calidad más sofisticado
@@ -51,21 +52,21 @@ class SimpleAIAnalyzer:
             
             # Detectar palabras clave más específicas
             palabras_clave = []
-            if "constitución" in texto.lower() or "constitucion" in texto.lower():
+            if indice.contains("constitución", "constitucion"):
                 palabras_clave.append("Constitución Política")
-            if "ley" in texto.lower():
+            if indice.contains("ley"):
                 palabras_clave.append("Normativa Legal")
-            if "decreto" in texto.lower():
+            if indice.contains("decreto"):
                 palabras_clave.append("Decreto")
-            if "resolución" in texto.lower() or "resolucion" in texto.lower():
+            if indice.contains("resolución", "resolucion"):
                 palabras_clave.append("Resolución")
-            if "competencia" in texto.lower() or "competente" in texto.lower():
+            if indice.contains("competencia", "competente"):
                 palabras_clave.append("Competencia Administrativa")
-            if "fundamento" in texto.lower() or "fundamentación" in texto.lower():
+            if indice.contains("fundamento", "fundamentación"):
                 palabras_clave.append("Fundamentación Legal")
-            if "derecho" in texto.lower():
+            if indice.contains("derecho"):
                 palabras_clave.append("Derechos")
-            if "procedimiento" in texto.lower():
+            if indice.contains("procedimiento"):
                 palabras_clave.append("Procedimiento")
             
             # Si no hay palabras clave específicas, agregar generales
@@ -74,11 +75,11 @@ class SimpleAIAnalyzer:
             
             # Análisis de estructura
             estructura = "BÁSICA"
-            if "encabezado" in texto.lower() or "fecha" in texto.lower():
+            if indice.contains("encabezado", "fecha"):
                 estructura = "FORMAL"
-            if "artículo" in texto.lower() or "fundamento" in texto.lower():
+            if indice.contains("artículo", "fundamento"):
                 estructura = "FUNDAMENTADA"
-            if "conclusión" in texto.lower() or "resuelve" in texto.lower():
+            if indice.contains("conclusión", "resuelve"):
                 estructura = "COMPLETA"
             
             # Fecha de análisis
@@ -92,7 +93,7 @@ class SimpleAIAnalyzer:
                 "fecha_analisis": fecha_analisis,
                 "calidad": calidad,
                 "estructura": estructura,
-                "palabras": len(palabras),
+                "palabras": indice.word_count,
                 "parrafos": parrafos,
                 "oraciones": oraciones,
                 "palabras_clave": palabras_clave,
@@ -125,6 +126,7 @@ class SimpleAIAnalyzer:
     def detect_problems(self, texto: str, contexto: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Detección inteligente de problemas"""
         problemas = []
+        indice = build_document_index(texto)
         
         # Análisis de longitud y estructura
         if len(texto) < 200:
@@ -140,7 +142,7 @@ class SimpleAIAnalyzer:
         
         # Análisis de fundamentación legal
         fundamentacion_indicadores = ["fundamento", "fundamentación", "artículo", "articulo", "ley", "decreto", "constitución", "constitucion"]
-        if not any(indicator in texto.lower() for indicator in fundamentacion_indicadores):
+        if not indice.contains(*fundamentacion_indicadores):
             problemas.append({
                 "tipo": "LEGAL",
                 "descripcion": "Falta fundamentación legal específica y citas de normas",
@@ -153,7 +155,7 @@ class SimpleAIAnalyzer:
         
         # Análisis de competencia administrativa
         competencia_indicadores = ["competente", "competencia", "funcionario", "autoridad", "delegado", "delegación"]
-        if not any(indicator in texto.lower() for indicator in competencia_indicadores):
+        if not indice.contains(*competencia_indicadores):
             problemas.append({
                 "tipo": "ADMINISTRATIVO",
                 "descripcion": "No se especifica la competencia del funcionario o autoridad",
@@ -166,7 +168,7 @@ class SimpleAIAnalyzer:
         
         # Análisis de estructura formal
         estructura_indicadores = ["encabezado", "fecha", "número", "numero", "radicado", "referencia"]
-        if not any(indicator in texto.lower() for indicator in estructura_indicadores):
+        if not indice.contains(*estructura_indicadores):
             problemas.append({
                 "tipo": "FORMAL",
                 "descripcion": "Falta estructura formal del documento (encabezado, fecha, número de radicado)",
@@ -178,8 +180,8 @@ class SimpleAIAnalyzer:
             })
         
         # Análisis de claridad y lenguaje
-        if len(texto.split()) > 50:  # Solo si el documento es suficientemente largo
-            oraciones_largas = sum(1 for oracion in texto.split('.') if len(oracion.split()) > 30)
+        if indice.word_count > 50:  # Solo si el documento es suficientemente largo
+            oraciones_largas = sum(1 for oracion in indice.sentences() if len(oracion.split()) > 30)
             if oraciones_largas > 2:
                 problemas.append({
                     "tipo": "COMUNICACIÓN",
@@ -193,7 +195,7 @@ class SimpleAIAnalyzer:
         
         # Análisis de términos técnicos sin explicación
         terminos_tecnicos = ["competencia", "fundamento", "motivación", "motivacion", "recurso", "apelación", "apelacion"]
-        terminos_sin_explicar = [term for term in terminos_tecnicos if term in texto.lower() and len(texto) < 1000]
+        terminos_sin_explicar = [term for term in terminos_tecnicos if term in indice.lower and len(texto) < 1000]
         if terminos_sin_explicar:
             problemas.append({
                 "tipo": "COMUNICACIÓN",
@@ -206,8 +208,8 @@ class SimpleAIAnalyzer:
             })
         
         # Análisis de respuesta completa
-        if "no procede" in texto.lower() or "no se accede" in texto.lower() or "se niega" in texto.lower():
-            if "fundamento" not in texto.lower() and "motivo" not in texto.lower():
+        if indice.contains("no procede", "no se accede", "se niega"):
+            if not indice.contains("fundamento", "motivo"):
                 problemas.append({
                     "tipo": "LEGAL",
                     "descripcion": "Respuesta negativa sin fundamentación legal clara",
@@ -219,8 +221,8 @@ class SimpleAIAnalyzer:
                 })
         
         # Análisis de términos legales
-        if "derecho de petición" in texto.lower() or "derecho de peticion" in texto.lower():
-            if "15 días" not in texto.lower() and "quince días" not in texto.lower():
+        if indice.contains("derecho de petición", "derecho de peticion"):
+            if not indice.contains("15 días", "quince días"):
                 problemas.append({
                     "tipo": "PROCEDIMENTAL",
                     "descripcion": "No se especifica el término de respuesta (15 días hábiles)",
@@ -236,6 +238,7 @@ class SimpleAIAnalyzer:
     def generate_recommendations(self, texto: str, problemas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Generación inteligente de recomendaciones"""
         recomendaciones = []
+        indice = build_document_index(texto)
         
         # Generar recomendaciones basadas en problemas específicos
         for problema in problemas:
@@ -251,7 +254,7 @@ class SimpleAIAnalyzer:
                 })
                 
                 # Recomendación adicional para respuestas negativas
-                if any(palabra in texto.lower() for palabra in ["no procede", "no se accede", "se niega"]):
+                if indice.contains("no procede", "no se accede", "se niega"):
                     recomendaciones.append({
                         "titulo": "Fundamentar respuesta negativa",
                         "descripcion": "Explicar claramente los motivos legales de la negativa con citas específicas",
@@ -342,8 +345,31 @@ class SimpleAIAnalyzer:
         
         return recomendaciones
         
-    def chat_response(self, pregunta: str, contexto: Dict[str, Any]) -> str:
-        """Respuesta de chat simple pero funcional"""
+    def detect_problems_stream(self, texto: str, contexto: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Problemas uno a uno (el análisis local no tiene demora entre ellos)"""
+        yield from self.detect_problems(texto, contexto)
+        
+    def generate_recommendations_stream(self, texto: str, problemas: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Recomendaciones una a una (el análisis local no tiene demora entre ellas)"""
+        yield from self.generate_recommendations(texto, problemas)
+        
+    def run_pipeline(self, texto: str, fusionado: Optional[bool] = None) -> Dict[str, Any]:
+        """Análisis, problemas y recomendaciones en una sola llamada (local, en serie; el modo no aplica)"""
+        analisis = self.analyze_document(texto)
+        problemas = self.detect_problems(texto, analisis)
+        return {
+            "analisis": analisis,
+            "problemas": problemas,
+            "recomendaciones": self.generate_recommendations(texto, problemas)
+        }
+        
+    def chat_response(self, pregunta: str, contexto: Dict[str, Any], stream: bool = False,
+                      documento: Optional[str] = None) -> Union[str, Iterator[str]]:
+        """Respuesta de chat simple pero funcional (`documento` no se usa: las respuestas son predefinidas)"""
+        
+        if stream:
+            # Las respuestas predefinidas están listas de inmediato: un solo fragmento
+            return iter([self.chat_response(pregunta, contexto)])
         
         # Respuestas predefinidas para preguntas comunes
         respuestas_comunes = {
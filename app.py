@@ -5,20 +5,30 @@ from datetime import datetime
 import time
 import random
 import os
+import threading
+import concurrent.futures
 from dotenv import load_dotenv
 
-# Importar módulos personalizados
-from document_processor import process_document
-from ai_analyzer import AIAnalyzer
-from ai_analyzer_simple import SimpleAIAnalyzer
-
-# Cargar variables de entorno
+# Cargar variables de entorno (antes de importar los módulos que leen su configuración)
 try:
     load_dotenv()
 except:
     # Si hay problemas con .env, usar configuración por defecto
     os.environ["GEMINI_API_KEY"] = "bbfe_key_55DzECZtUTOPicncc14IaAjjl98QeN9yMTdco6fPeUfzAQgfoUgR-GgMvBT1ljyAyiHZpVAkCepRs8ttQ34be-l-ji"
 
+# Importar módulos personalizados
+from document_processor import (
+    PREVIEW_CHARS,
+    LazyDocument,
+    extraction_cache,
+    iter_batch_results,
+    process_document_lazy,
+    spool_upload,
+)
+from ai_analyzer import PIPELINE_MODE, AIAnalyzer, chat_cache, gemini_breaker, rate_limiter, response_cache
+from ai_analyzer_simple import SimpleAIAnalyzer
+from speculative_executor import SpeculativeExecutor
+
 # Configuración de la página
 st.set_page_config(
     page_title="Sistema de Contestación Automática de Derechos de Petición",
@@ -123,6 +133,8 @@ if 'uploaded_file' not in st.session_state:
     st.session_state.uploaded_file = None
 if 'document_text' not in st.session_state:
     st.session_state.document_text = None
+if 'document' not in st.session_state:
+    st.session_state.document = None
 if 'analysis_complete' not in st.session_state:
     st.session_state.analysis_complete = False
 if 'problems_detected' not in st.session_state:
@@ -133,15 +145,55 @@ if 'ai_analyzer' not in st.session_state:
     st.session_state.ai_analyzer = None
 if 'ai_connected' not in st.session_state:
     st.session_state.ai_connected = False
+if 'speculative' not in st.session_state:
+    st.session_state.speculative = SpeculativeExecutor()
 
 # Debug: Mostrar estado en la consola
 st.caption(f"Estado actual: Paso {st.session_state.current_step}, Progreso: {st.session_state.progress}%")
 
-# Cache para funciones costosas
-@st.cache_data
-def process_document_cached(uploaded_file):
-    """Cache para el procesamiento de documentos"""
-    return process_document(uploaded_file)
+def get_document_text():
+    """
+    Texto completo del documento. Los pasos de IA lo necesitan entero porque el
+    empaquetado puede usar cualquier sección (las peticiones suelen ir al final).
+    """
+    documento = st.session_state.get('document')
+    if documento is None:
+        return st.session_state.document_text
+    texto = documento.full_text()
+    st.session_state.document_text = texto
+    return texto
+
+def forget_document():
+    """
+    Descarta el trabajo ligado al documento anterior: pasos anticipados, cache de
+    contexto de la IA y el temporal en disco del archivo subido.
+    """
+    st.session_state.speculative.discard()
+    subido = st.session_state.get('uploaded_file')
+    if subido is not None:
+        subido.close()
+        st.session_state.uploaded_file = None
+    context_cache = getattr(st.session_state.get('ai_analyzer'), 'context_cache', None)
+    if context_cache is not None:
+        context_cache.release()
+
+def prefetch_problems():
+    """Lanza la detección de problemas en segundo plano mientras se leen los resultados del análisis."""
+    analyzer = st.session_state.ai_analyzer
+    if analyzer is not None and st.session_state.get('analysis'):
+        st.session_state.speculative.prefetch(
+            "problems", analyzer.detect_problems,
+            get_document_text(), st.session_state.analysis
+        )
+
+def prefetch_recommendations():
+    """Lanza la generación de recomendaciones en segundo plano mientras se leen los problemas."""
+    analyzer = st.session_state.ai_analyzer
+    if analyzer is not None and st.session_state.get('problems'):
+        st.session_state.speculative.prefetch(
+            "recommendations", analyzer.generate_recommendations,
+            get_document_text(), st.session_state.problems
+        )
 
 def connect_ai_with_key(key: str) -> bool:
     """Guarda la clave en sesión e inicializa el analizador IA."""
@@ -161,6 +213,18 @@ def connect_ai_with_key(key: str) -> bool:
         st.session_state.ai_connected = False
         return False
 
+def show_breaker_state() -> None:
+    """Estado del interruptor de Gemini: si está abierto, los pasos los atiende el análisis local."""
+    estado = gemini_breaker.stats()
+    if estado['state'] == 'open':
+        st.warning(f"🔴 Gemini no responde: modo local, se reintenta en {estado['retry_in']:.0f} s")
+        if estado['last_cause']:
+            st.caption(f"Última falla: {estado['last_cause']}")
+    elif estado['state'] == 'half_open':
+        st.info("🟡 Probando si Gemini volvió a responder...")
+    else:
+        st.caption("🟢 Gemini disponible")
+
 def ia_connected() -> bool:
     """True si hay analizador IA listo en sesión."""
     return st.session_state.get("ai_connected", False)
@@ -202,6 +266,39 @@ def initialize_ai():
         st.session_state.ai_connected = True
         return True
 
+def show_rate_limit_waits():
+    """
+    Las llamadas a la IA que quedan en cola por el límite de solicitudes de Gemini
+    muestran cuánto falta en un aviso de esta ejecución, en lugar de esperar en silencio.
+    """
+    analyzer = st.session_state.get('ai_analyzer')
+    if not hasattr(analyzer, 'wait_notifier'):
+        return
+    aviso = st.empty()
+    hilo = threading.current_thread()
+    
+    def avisar(segundos):
+        # Solo desde el hilo del script: los hilos en segundo plano no pueden usar st.*
+        if threading.current_thread() is hilo:
+            aviso.info(f"⏳ Límite de solicitudes de Gemini alcanzado: tu solicitud sale en {segundos:.0f} s")
+    
+    analyzer.wait_notifier = avisar
+
+def wait_result(future):
+    """
+    Resultado de un paso anticipado; si sus llamadas están en cola por el límite de
+    solicitudes se muestra la espera (solo la de esta sesión, no la de las demás).
+    """
+    analyzer = st.session_state.get('ai_analyzer')
+    avisar = getattr(analyzer, 'wait_notifier', None)
+    while True:
+        try:
+            return future.result(timeout=0.5)
+        except concurrent.futures.TimeoutError:
+            espera = rate_limiter.pending_wait(analyzer)
+            if espera > 0 and avisar is not None:
+                avisar(espera)
+
 def main():
     # Configurar página para mejor UX
     st.set_page_config(
@@ -213,6 +310,7 @@ def main():
     
     # Inicializar IA al inicio
     initialize_ai()
+    show_rate_limit_waits()
     
     # Header compacto y funcional
     col1, col2, col3 = st.columns([2, 1, 1])
@@ -270,11 +368,51 @@ def main():
         
         st.divider()
         
+        if isinstance(st.session_state.get('ai_analyzer'), AIAnalyzer):
+            show_breaker_state()
+        
         # Debug compacto
         with st.expander("🔧 Debug Info", expanded=False):
             st.caption(f"Paso: {st.session_state.current_step}")
             st.caption(f"Progreso: {st.session_state.progress}%")
             st.caption(f"IA: {'Conectada' if ia_connected() else 'No Conectada'}")
+            cache_stats = extraction_cache.stats()
+            st.caption(f"Cache extracción: {cache_stats['hits']} aciertos / {cache_stats['misses']} fallos "
+                       f"({cache_stats['hit_rate']:.0%}), {cache_stats['bytes'] / 1024 / 1024:.1f} MB")
+            paginas_stats = extraction_cache.stats(group="page")
+            st.caption(f"Cache de páginas: {paginas_stats['hits']} aciertos / {paginas_stats['misses']} fallos "
+                       f"({paginas_stats['hit_rate']:.0%})")
+            ia_stats = response_cache.stats()
+            st.caption(f"Cache respuestas IA: {ia_stats['hits']} aciertos / {ia_stats['misses']} fallos "
+                       f"({ia_stats['hit_rate']:.0%}), {ia_stats['entries']} respuestas, {ia_stats['expired']} caducadas")
+            chat_stats = chat_cache.stats()
+            st.caption(f"Cache semántico del chat: {chat_stats['hits']} aciertos / {chat_stats['misses']} fallos "
+                       f"({chat_stats['hit_rate']:.0%}), umbral {chat_cache.threshold:.2f}")
+            analyzer = st.session_state.get('ai_analyzer')
+            for tarea, paquete in getattr(analyzer, 'packing_reports', {}).items():
+                st.caption(f"Prompt {tarea}: {paquete.summary()}")
+            interruptor = gemini_breaker.stats()
+            st.caption(f"Interruptor Gemini: {interruptor['state']}, {interruptor['opened']} aperturas, "
+                       f"{interruptor['probes']} sondas, {interruptor['short_circuited']} llamadas locales")
+            limite = rate_limiter.stats()
+            st.caption(f"Límite Gemini: {limite['rpm_available']}/{limite['rpm']} solicitudes disponibles, "
+                       f"{limite['queued']} en cola, {limite['retries']} reintentos, {limite['rejections']} rechazadas")
+            context_cache = getattr(analyzer, 'context_cache', None)
+            if context_cache is not None and context_cache.enabled:
+                contexto_stats = context_cache.stats()
+                st.caption(f"Cache de contexto ({contexto_stats['mode']}): {contexto_stats['entries']} activas, "
+                           f"{contexto_stats['reused']} reutilizadas, {contexto_stats['failures']} rechazadas")
+            sesion_chat = getattr(analyzer, 'chat_session', None)
+            if sesion_chat is not None:
+                sesion_stats = sesion_chat.stats()
+                st.caption(f"Sesión de chat: {sesion_stats['turnos']} turnos ({sesion_stats['resumidos']} resumidos), "
+                           f"~{sesion_stats['tokens_entrada']} tokens de entrada")
+            especulacion = st.session_state.speculative
+            st.caption(f"Pasos anticipados: {especulacion.hits} aprovechados / {especulacion.misses} sin anticipar, "
+                       f"{especulacion.running} en curso, {especulacion.skipped} no lanzados por el máximo de la sesión")
+            documento = st.session_state.get('document')
+            if documento is not None and documento.pages_reused:
+                st.caption(f"Páginas reutilizadas: {documento.pages_reused}/{documento.pages_processed}")
         
         # Configuración de API Key discreta
         if not ia_connected():
@@ -346,7 +484,10 @@ def step_1_upload_document():
     
     st.divider()
     
-
+    # Modo lote para la mesa de radicación (varias peticiones y anexos a la vez)
+    if st.toggle("📚 Modo lote (varios archivos)", key="batch_mode"):
+        step_1_batch_upload()
+        return
     
     # Área de carga de archivos mejorada
     st.markdown("### 📄 Cargar Documento")
@@ -358,20 +499,38 @@ def step_1_upload_document():
     )
     
     if uploaded_file is not None:
-        st.session_state.uploaded_file = uploaded_file
         st.success(f"✅ Documento cargado: {uploaded_file.name}")
         
-        # Procesar documento usando cache
+        # En sesión solo se guarda un handle (los archivos grandes quedan en disco);
+        # la extracción bajo demanda se reutiliza mientras el archivo no cambie
+        documento = st.session_state.document
+        if documento is None or st.session_state.get('document_id') != uploaded_file.file_id:
+            forget_document()
+            st.session_state.uploaded_file = spool_upload(uploaded_file)
+            documento = process_document_lazy(st.session_state.uploaded_file)
+            st.session_state.document = documento
+            st.session_state.document_id = uploaded_file.file_id
+        
+        # Basta con el texto de la vista previa para poder continuar
         with st.spinner("Procesando documento..."):
-            document_text = process_document_cached(uploaded_file)
-            if document_text:
-                st.session_state.document_text = document_text
+            preview = documento.prefix(PREVIEW_CHARS) if documento else ""
+            if preview:
+                st.session_state.document_text = documento.text()
                 st.success("✅ Texto extraído correctamente")
+                if not documento.done:
+                    st.caption(f"📄 Páginas extraídas: {documento.pages_processed}/{documento.total_pages} "
+                               "(el resto se extrae cuando se necesita)")
+                if documento.pages_reused:
+                    st.caption(f"♻️ {documento.pages_reused} páginas sin cambios respecto a una versión anterior "
+                               "(recuperadas del cache)")
                 
                 # Mostrar preview del texto
                 with st.expander("📄 Vista previa del documento"):
-                    st.text_area("Texto extraído:", document_text[:500] + "..." if len(document_text) > 500 else document_text, height=200)
+                    completo = documento.done and len(st.session_state.document_text) <= len(preview)
+                    st.text_area("Texto extraído:", preview if completo else preview + "...", height=200)
             else:
+                if documento and documento.error:
+                    st.error(f"Error leyendo PDF: {documento.error}")
                 st.error("❌ Error al procesar el documento")
                 return
         
@@ -389,6 +548,63 @@ def step_1_upload_document():
             st.session_state.progress = 20
             st.rerun()
 
+def step_1_batch_upload():
+    """Ingesta de varios archivos con tabla de estado que se actualiza al terminar cada uno."""
+    st.markdown("### 📚 Cargar Lote de Documentos")
+    uploaded_files = st.file_uploader(
+        "Selecciona los documentos (PDF o DOCX)",
+        type=['pdf', 'docx'],
+        accept_multiple_files=True,
+        help="Sube las peticiones y anexos del caso",
+        label_visibility="collapsed"
+    )
+    
+    if uploaded_files and st.button("📥 Procesar Lote", type="primary"):
+        resultados = []
+        tabla = st.empty()
+        progreso = st.progress(0)
+        # Los resultados llegan en orden de finalización, no de subida
+        for resultado in iter_batch_results(uploaded_files):
+            resultados.append(resultado)
+            tabla.dataframe(
+                pd.DataFrame(resultados)[["archivo", "estado", "caracteres", "reutilizadas", "segundos", "error"]],
+                use_container_width=True,
+                hide_index=True
+            )
+            progreso.progress(len(resultados) / len(uploaded_files))
+        st.session_state.batch_results = resultados
+        st.rerun()
+    
+    resultados = st.session_state.get('batch_results', [])
+    if not resultados:
+        return
+    
+    st.dataframe(
+        pd.DataFrame(resultados)[["archivo", "estado", "caracteres", "reutilizadas", "segundos", "error"]],
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    # Elegir uno de los documentos procesados para continuar con el análisis
+    listos = [r for r in resultados if r["texto"]]
+    if not listos:
+        st.error("❌ Ningún documento del lote tiene texto extraíble")
+        return
+    nombre = st.selectbox("Documento a analizar:", [r["archivo"] for r in listos])
+    seleccionado = next(r for r in listos if r["archivo"] == nombre)
+    
+    with st.expander("📄 Vista previa del documento"):
+        st.text_area("Texto extraído:", seleccionado["texto"][:PREVIEW_CHARS], height=200)
+    
+    if st.button("🔍 Continuar al Análisis", type="primary"):
+        st.session_state.document = LazyDocument.from_text(seleccionado["texto"])
+        st.session_state.document_id = None
+        forget_document()
+        st.session_state.document_text = seleccionado["texto"]
+        st.session_state.current_step = 2
+        st.session_state.progress = 20
+        st.rerun()
+
 def step_2_analyze_document():
     # Si el análisis no está completo, mostrar botón para iniciar
     if not st.session_state.get('analysis_complete', False):
@@ -412,7 +628,9 @@ def step_2_analyze_document():
                 # Análisis con IA usando cache
                 if initialize_ai() and st.session_state.document_text:
                     try:
-                        analysis = st.session_state.ai_analyzer.analyze_document(st.session_state.document_text)
+                        # Termina de extraer las páginas que falten (en paralelo)
+                        texto = get_document_text()
+                        analysis = st.session_state.ai_analyzer.analyze_document(texto)
                         if analysis:
                             st.session_state.analysis = analysis
                         else:
@@ -432,7 +650,32 @@ def step_2_analyze_document():
                 
                 st.success("✅ Análisis completado")
                 st.session_state.analysis_complete = True
+                # El paso 3 empieza ya, mientras el usuario revisa el análisis
+                prefetch_problems()
                 st.rerun()
+        
+        # Pasos 2-4 de una vez: una sola llamada a la IA, o una por paso en paralelo
+        calidad_maxima = st.toggle("🎯 Máxima calidad (una llamada a la IA por paso)", key="pipeline_separate",
+                                   value=PIPELINE_MODE == "separate",
+                                   help="Más detallado pero más lento y con más consumo de cuota")
+        if st.button("⚡ Análisis Completo (análisis, problemas y recomendaciones)", key="start_pipeline", use_container_width=True):
+            with st.spinner("Ejecutando análisis completo con IA..."):
+                if initialize_ai() and st.session_state.document_text:
+                    try:
+                        # El texto que necesita el paso 2 cubre también los pasos 3 y 4
+                        texto = get_document_text()
+                        resultado = st.session_state.ai_analyzer.run_pipeline(texto, fusionado=not calidad_maxima)
+                    except Exception as e:
+                        st.error(f"❌ Error en análisis IA: {str(e)}")
+                        return
+                    st.session_state.analysis = resultado["analisis"]
+                    st.session_state.problems = resultado["problemas"]
+                    st.session_state.recommendations = resultado["recomendaciones"]
+                    st.session_state.analysis_complete = True
+                    st.session_state.problems_detected = True
+                    st.session_state.recommendations_generated = True
+                    st.success("✅ Análisis completo terminado")
+                    st.rerun()
     
     # Si el análisis está completo, mostrar resultados y botón para continuar
     if st.session_state.get('analysis_complete', False):
@@ -490,6 +733,85 @@ def step_2_analyze_document():
             st.session_state.progress = 40
             st.rerun()
 
+def render_problem_card(i, problem):
+    """Tarjeta de un problema detectado (paso 3)."""
+    # Validar que problem sea un diccionario
+    if not isinstance(problem, dict):
+        st.warning(f"⚠️ Problema {i} tiene formato inválido: {type(problem)}")
+        return
+    
+    # Obtener valores con validación
+    tipo = problem.get('tipo', f'Problema {i}')
+    descripcion = problem.get('descripcion', 'Sin descripción')
+    severidad = problem.get('severidad', 'N/A')
+    
+    # Color según severidad
+    if severidad == "Alta":
+        st.error(f"**{tipo}** - {descripcion}")
+    elif severidad == "Media":
+        st.warning(f"**{tipo}** - {descripcion}")
+    else:
+        st.info(f"**{tipo}** - {descripcion}")
+    
+    # Información detallada
+    col1, col2 = st.columns(2)
+    with col1:
+        st.caption(f"**Tipo:** {tipo}")
+        st.caption(f"**Severidad:** {severidad}")
+        if 'fundamento_legal' in problem:
+            st.caption(f"**Fundamento:** {problem['fundamento_legal']}")
+    with col2:
+        st.caption(f"**Línea:** {problem.get('linea', 'N/A')}")
+        if 'impacto' in problem:
+            st.caption(f"**Impacto:** {problem['impacto']}")
+    
+    st.divider()
+
+def render_recommendation_card(i, rec):
+    """Tarjeta de una recomendación (paso 4)."""
+    # Validar que rec sea un diccionario
+    if not isinstance(rec, dict):
+        st.warning(f"⚠️ Recomendación {i} tiene formato inválido: {type(rec)}")
+        return
+    
+    # Obtener valores con validación
+    titulo = rec.get('titulo', f'Recomendación {i}')
+    descripcion = rec.get('descripcion', 'Sin descripción')
+    prioridad = rec.get('prioridad', 'N/A')
+    accion = rec.get('accion', 'N/A')
+    
+    # Color según prioridad
+    if prioridad == "Alta":
+        st.success(f"**{titulo}** - {descripcion}")
+    else:
+        st.info(f"**{titulo}** - {descripcion}")
+    
+    # Información detallada
+    col1, col2 = st.columns(2)
+    with col1:
+        st.caption(f"**Prioridad:** {prioridad}")
+        st.caption(f"**Acción:** {accion}")
+        if 'fundamento_legal' in rec:
+            st.caption(f"**Fundamento:** {rec['fundamento_legal']}")
+    with col2:
+        if 'tiempo_estimado' in rec:
+            st.caption(f"**Tiempo:** {rec['tiempo_estimado']}")
+        if 'beneficio' in rec:
+            st.caption(f"**Beneficio:** {rec['beneficio']}")
+    
+    st.divider()
+
+def stream_cards(elementos, render_card):
+    """Muestra cada elemento apenas llega y devuelve la lista completa (las tarjetas provisionales se limpian)."""
+    marcador = st.empty()
+    lista = []
+    with marcador.container():
+        for elemento in elementos:
+            lista.append(elemento)
+            render_card(len(lista), elemento)
+    marcador.empty()
+    return lista
+
 def step_3_detect_problems():
     # Si los problemas no están detectados, mostrar botón para iniciar
     if not st.session_state.get('problems_detected', False):
@@ -507,17 +829,23 @@ def step_3_detect_problems():
             st.info(f"🔄 Estado actual: problems_detected = {st.session_state.get('problems_detected', False)}")
             
             with st.spinner("Detectando problemas con IA..."):
-                time.sleep(1.5)
-                
-                # Detección con IA usando cache
+                # Detección con IA usando cache (normalmente ya especulada en el paso 2)
                 if initialize_ai() and st.session_state.document_text and 'analysis' in st.session_state:
                     try:
-                        problems = st.session_state.ai_analyzer.detect_problems(
-                            st.session_state.document_text, 
-                            st.session_state.analysis
-                        )
+                        texto = get_document_text()
+                        especulado = st.session_state.speculative.take("problems", texto, st.session_state.analysis)
+                        if especulado is not None:
+                            problems = wait_result(especulado)
+                        else:
+                            # Sin especulación: cada problema aparece apenas el modelo cierra su objeto
+                            problems = stream_cards(
+                                st.session_state.ai_analyzer.detect_problems_stream(texto, st.session_state.analysis),
+                                render_problem_card
+                            )
                         if problems:
                             st.session_state.problems = problems
+                            # El paso 4 empieza ya, mientras el usuario revisa los problemas
+                            prefetch_recommendations()
                         else:
                             raise Exception("No se pudieron detectar problemas")
                     except Exception as e:
@@ -587,37 +915,7 @@ def step_3_detect_problems():
         # Mostrar problemas con información detallada
         st.markdown("### 📋 Problemas Identificados")
         for i, problem in enumerate(st.session_state.problems, 1):
-            # Validar que problem sea un diccionario
-            if not isinstance(problem, dict):
-                st.warning(f"⚠️ Problema {i} tiene formato inválido: {type(problem)}")
-                continue
-            
-            # Obtener valores con validación
-            tipo = problem.get('tipo', f'Problema {i}')
-            descripcion = problem.get('descripcion', 'Sin descripción')
-            severidad = problem.get('severidad', 'N/A')
-            
-            # Color según severidad
-            if severidad == "Alta":
-                st.error(f"**{tipo}** - {descripcion}")
-            elif severidad == "Media":
-                st.warning(f"**{tipo}** - {descripcion}")
-            else:
-                st.info(f"**{tipo}** - {descripcion}")
-            
-            # Información detallada
-            col1, col2 = st.columns(2)
-            with col1:
-                st.caption(f"**Tipo:** {tipo}")
-                st.caption(f"**Severidad:** {severidad}")
-                if 'fundamento_legal' in problem:
-                    st.caption(f"**Fundamento:** {problem['fundamento_legal']}")
-            with col2:
-                st.caption(f"**Línea:** {problem.get('linea', 'N/A')}")
-                if 'impacto' in problem:
-                    st.caption(f"**Impacto:** {problem['impacto']}")
-            
-            st.divider()
+            render_problem_card(i, problem)
         
         st.divider()
         
@@ -644,15 +942,19 @@ def step_4_generate_recommendations():
             st.info(f"🔄 Estado actual: recommendations_generated = {st.session_state.get('recommendations_generated', False)}")
             
             with st.spinner("Generando recomendaciones con IA..."):
-                time.sleep(1.5)
-                
-                # Generación con IA usando cache
+                # Generación con IA usando cache (normalmente ya especulada en el paso 3)
                 if initialize_ai() and st.session_state.document_text and 'problems' in st.session_state:
                     try:
-                        recommendations = st.session_state.ai_analyzer.generate_recommendations(
-                            st.session_state.document_text,
-                            st.session_state.problems
-                        )
+                        texto = get_document_text()
+                        especulado = st.session_state.speculative.take("recommendations", texto, st.session_state.problems)
+                        if especulado is not None:
+                            recommendations = wait_result(especulado)
+                        else:
+                            # Sin especulación: cada recomendación aparece apenas el modelo cierra su objeto
+                            recommendations = stream_cards(
+                                st.session_state.ai_analyzer.generate_recommendations_stream(texto, st.session_state.problems),
+                                render_recommendation_card
+                            )
                         if recommendations:
                             st.session_state.recommendations = recommendations
                         else:
@@ -713,37 +1015,7 @@ def step_4_generate_recommendations():
                 # Mostrar las recomendaciones inmediatamente después de generarlas
                 st.markdown("### 📋 Recomendaciones Generadas")
                 for i, rec in enumerate(st.session_state.recommendations, 1):
-                    # Validar que rec sea un diccionario
-                    if not isinstance(rec, dict):
-                        st.warning(f"⚠️ Recomendación {i} tiene formato inválido: {type(rec)}")
-                        continue
-                    
-                    # Obtener valores con validación
-                    titulo = rec.get('titulo', f'Recomendación {i}')
-                    descripcion = rec.get('descripcion', 'Sin descripción')
-                    prioridad = rec.get('prioridad', 'N/A')
-                    accion = rec.get('accion', 'N/A')
-                    
-                    # Color según prioridad
-                    if prioridad == "Alta":
-                        st.success(f"**{titulo}** - {descripcion}")
-                    else:
-                        st.info(f"**{titulo}** - {descripcion}")
-                    
-                    # Información detallada
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.caption(f"**Prioridad:** {prioridad}")
-                        st.caption(f"**Acción:** {accion}")
-                        if 'fundamento_legal' in rec:
-                            st.caption(f"**Fundamento:** {rec['fundamento_legal']}")
-                    with col2:
-                        if 'tiempo_estimado' in rec:
-                            st.caption(f"**Tiempo:** {rec['tiempo_estimado']}")
-                        if 'beneficio' in rec:
-                            st.caption(f"**Beneficio:** {rec['beneficio']}")
-                    
-                    st.divider()
+                    render_recommendation_card(i, rec)
                 
                 st.divider()
                 
@@ -768,37 +1040,7 @@ def step_4_generate_recommendations():
         # Mostrar recomendaciones con información detallada
         st.markdown("### 📋 Recomendaciones Generadas")
         for i, rec in enumerate(st.session_state.recommendations, 1):
-            # Validar que rec sea un diccionario
-            if not isinstance(rec, dict):
-                st.warning(f"⚠️ Recomendación {i} tiene formato inválido: {type(rec)}")
-                continue
-            
-            # Obtener valores con validación
-            titulo = rec.get('titulo', f'Recomendación {i}')
-            descripcion = rec.get('descripcion', 'Sin descripción')
-            prioridad = rec.get('prioridad', 'N/A')
-            accion = rec.get('accion', 'N/A')
-            
-            # Color según prioridad
-            if prioridad == "Alta":
-                st.success(f"**{titulo}** - {descripcion}")
-            else:
-                st.info(f"**{titulo}** - {descripcion}")
-            
-            # Información detallada
-            col1, col2 = st.columns(2)
-            with col1:
-                st.caption(f"**Prioridad:** {prioridad}")
-                st.caption(f"**Acción:** {accion}")
-                if 'fundamento_legal' in rec:
-                    st.caption(f"**Fundamento:** {rec['fundamento_legal']}")
-            with col2:
-                if 'tiempo_estimado' in rec:
-                    st.caption(f"**Tiempo:** {rec['tiempo_estimado']}")
-                if 'beneficio' in rec:
-                    st.caption(f"**Beneficio:** {rec['beneficio']}")
-            
-            st.divider()
+            render_recommendation_card(i, rec)
         
         st.divider()
         
@@ -864,50 +1106,56 @@ def step_5_chat_system():
     
     # Procesar pregunta cuando se envía
     if send_button and user_question and user_question.strip():
-            with st.spinner("Procesando tu pregunta con IA..."):
-                time.sleep(1)
-                
-                # Respuesta con IA
-                if st.session_state.get('ai_analyzer'):
-                    try:
-                        # Crear contexto con la información disponible
-                        context = {}
-                        if 'analysis' in st.session_state:
-                            context["analisis"] = st.session_state.analysis
-                        if 'problems' in st.session_state:
-                            context["problemas"] = st.session_state.problems
-                        if 'recommendations' in st.session_state:
-                            context["recomendaciones"] = st.session_state.recommendations
-                        
-                        # Si no hay contexto, crear uno básico
-                        if not context:
-                            context = {
-                                "analisis": {"tipo": "Documento legal"},
-                                "problemas": [{"tipo": "GENERAL", "descripcion": "Análisis pendiente"}],
-                                "recomendaciones": [{"titulo": "Procesar documento primero"}]
-                            }
-                        
-                        response = st.session_state.ai_analyzer.chat_response(user_question, context)
-                        
-                        if not response or response.strip() == "":
-                            response = "Lo siento, no pude generar una respuesta. Intenta reformular tu pregunta."
-                            
-                    except Exception as e:
-                        error_msg = str(e)
-                        response = f"Lo siento, hubo un error al procesar tu pregunta: {error_msg}"
-                else:
-                    st.error("❌ No se pudo procesar tu pregunta. Verifica que la IA esté conectada correctamente.")
-                    return
-                
-                # Agregar al historial
-                st.session_state.chat_history.append({
-                    "user": user_question,
-                    "system": response,
-                    "timestamp": datetime.now().strftime("%H:%M:%S")
-                })
+            if not st.session_state.get('ai_analyzer'):
+                st.error("❌ No se pudo procesar tu pregunta. Verifica que la IA esté conectada correctamente.")
+                return
+            
+            # Crear contexto con la información disponible
+            context = {}
+            if 'analysis' in st.session_state:
+                context["analisis"] = st.session_state.analysis
+            if 'problems' in st.session_state:
+                context["problemas"] = st.session_state.problems
+            if 'recommendations' in st.session_state:
+                context["recomendaciones"] = st.session_state.recommendations
+            
+            # Si no hay contexto, crear uno básico
+            if not context:
+                context = {
+                    "analisis": {"tipo": "Documento legal"},
+                    "problemas": [{"tipo": "GENERAL", "descripcion": "Análisis pendiente"}],
+                    "recomendaciones": [{"titulo": "Procesar documento primero"}]
+                }
+            
+            st.markdown(f"**👤 Usuario:** {user_question}")
+            st.markdown("**🤖 IA:**")
+            try:
+                fragmentos = st.session_state.ai_analyzer.chat_response(
+                    user_question, context, stream=True, documento=get_document_text())
+                if isinstance(fragmentos, str):
+                    fragmentos = [fragmentos]
+                # La respuesta se muestra a medida que llega: el usuario ve el primer fragmento
+                # en lugar de esperar la generación completa
+                response = st.write_stream(fragmentos)
+                if isinstance(response, list):
+                    response = "".join(str(parte) for parte in response)
                 
-                # Limpiar el input después de enviar
-                st.rerun()
+                if not response or response.strip() == "":
+                    response = "Lo siento, no pude generar una respuesta. Intenta reformular tu pregunta."
+                    
+            except Exception as e:
+                error_msg = str(e)
+                response = f"Lo siento, hubo un error al procesar tu pregunta: {error_msg}"
+            
+            # Agregar al historial
+            st.session_state.chat_history.append({
+                "user": user_question,
+                "system": response,
+                "timestamp": datetime.now().strftime("%H:%M:%S")
+            })
+            
+            # Limpiar el input después de enviar
+            st.rerun()
     
     # Mostrar historial de chat mejorado
     if st.session_state.chat_history:
@@ -915,7 +1163,7 @@ def step_5_chat_system():
         
         # Mostrar la conversación más reciente primero
         for i, chat in enumerate(reversed(st.session_state.chat_history), 1):
-            with st.expander(f"💬 Conversación {len(st.session_state.chat_history) - i + 1} - {chat.get('timestamp', '')}"):
+            with st.expander(f"💬 Conversación {len(st.session_state.chat_history) - i + 1} - {chat.get('timestamp', '')}", expanded=(i == 1)):
                 st.markdown(f"**👤 Usuario:** {chat['user']}")
                 st.markdown(f"**🤖 IA:** {chat['system']}")
     
@@ -940,15 +1188,14 @@ def step_5_chat_system():
     # Botón para reiniciar
     st.divider()
     if st.button("🔄 Reiniciar Proceso", type="secondary"):
-        # Limpiar cache
-        process_document_cached.clear()
-        
         # Resetear estado
         st.session_state.current_step = 1
         st.session_state.progress = 0
         st.session_state.chat_history = []
-        st.session_state.uploaded_file = None
+        forget_document()
         st.session_state.document_text = None
+        st.session_state.document = None
+        st.session_state.batch_results = []
         st.session_state.analysis_complete = False
         st.session_state.problems_detected = False
         st.session_state.recommendations_generated = False
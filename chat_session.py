@@ -0,0 +1,113 @@
+# chat_session.py
+"""
+Sesión de chat sobre un documento, montada sobre `model.start_chat`.
+Las instrucciones y el contexto del documento (análisis, problemas y
+recomendaciones) se arman una sola vez, como primer turno de la sesión. Cada
+pregunta agrega solo su turno; cuando el historial pasa de la ventana de tokens,
+los turnos más viejos se condensan en un resumen. Así los tokens de entrada por
+pregunta no crecen con la conversación. Si las instrucciones y el contexto ya
+están en una cache de contexto del modelo, no se repiten en el historial.
+"""
+
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+from prompt_budget import estimate_tokens
+
+# Respuesta del modelo que cierra el turno de contexto (y el del resumen)
+_ACUSE = "Entendido. Responderé las preguntas con base en este documento y su análisis."
+
+# Turnos recientes que nunca se resumen, para que las preguntas de seguimiento tengan a qué referirse
+MIN_RECENT_TURNS = 2
+
+# Tope del resumen: si crece más se recorta, para que no reemplace a la ventana como fuente de crecimiento
+MAX_SUMMARY_CHARS = 1500
+
+Turno = Tuple[str, str]  # (pregunta, respuesta)
+
+class DocumentChatSession:
+    """
+    Conversación sobre un documento. `resumir(resumen_anterior, turnos)` condensa
+    los turnos que salen de la ventana; si falla, se guardan solo sus preguntas.
+    """
+
+    def __init__(self, model: Any, instrucciones: str, contexto: str, ventana_tokens: int,
+                 resumir: Callable[[str, List[Turno]], str], contexto_en_cache: bool = False):
+        self.instrucciones = instrucciones
+        self.contexto = contexto
+        self.contexto_en_cache = contexto_en_cache
+        self.ventana_tokens = ventana_tokens
+        self.resumir = resumir
+        self.modelo = getattr(model, "model_name", None)
+        self.turnos: List[Turno] = []
+        self.resumen = ""
+        self.resumidos = 0  # Turnos que ya solo viven en el resumen
+        self._lock = threading.Lock()
+        self.chat = model.start_chat(history=self._history())
+
+    def _history(self) -> List[Dict[str, Any]]:
+        """Historial que se envía con la próxima pregunta: contexto, resumen y ventana reciente."""
+        historial = [] if self.contexto_en_cache else [
+            {"role": "user", "parts": [f"{self.instrucciones}\n\nCONTEXTO DEL DOCUMENTO:\n{self.contexto}"]},
+            {"role": "model", "parts": [_ACUSE]},
+        ]
+        if self.resumen:
+            historial += [
+                {"role": "user", "parts": [f"RESUMEN DE LA CONVERSACIÓN ANTERIOR:\n{self.resumen}"]},
+                {"role": "model", "parts": ["Entendido."]},
+            ]
+        for pregunta, respuesta in self.turnos:
+            historial += [{"role": "user", "parts": [pregunta]}, {"role": "model", "parts": [respuesta]}]
+        return historial
+
+    def window_tokens(self) -> int:
+        """Tokens estimados de los turnos que se reenvían completos."""
+        return sum(estimate_tokens(pregunta + respuesta, self.modelo) for pregunta, respuesta in self.turnos)
+
+    def prompt_tokens(self, pregunta: str = "") -> int:
+        """Tokens estimados de entrada de la próxima llamada (contexto, resumen, ventana y pregunta)."""
+        preambulo = "" if self.contexto_en_cache else self.instrucciones + self.contexto
+        fijo = estimate_tokens(preambulo + self.resumen + pregunta, self.modelo)
+        return fijo + self.window_tokens()
+
+    def _fold(self) -> None:
+        """Pasa al resumen los turnos más viejos hasta que la ventana vuelva a la mitad de su tamaño."""
+        if self.window_tokens() <= self.ventana_tokens or len(self.turnos) <= MIN_RECENT_TURNS:
+            return
+        viejos: List[Turno] = []
+        # Se baja a la mitad para no resumir en cada pregunta una vez llena la ventana
+        while len(self.turnos) > MIN_RECENT_TURNS and self.window_tokens() > self.ventana_tokens // 2:
+            viejos.append(self.turnos.pop(0))
+        try:
+            resumen = self.resumir(self.resumen, viejos).strip()
+        except Exception:
+            resumen = ""
+        if not resumen:
+            preguntas = "; ".join(pregunta for pregunta, _ in viejos)
+            resumen = f"{self.resumen}\nTemas ya consultados: {preguntas}".strip()
+        self.resumen = resumen[-MAX_SUMMARY_CHARS:]
+        self.resumidos += len(viejos)
+
+    def prepare(self) -> Any:
+        """Ajusta la ventana y deja el historial listo; devuelve la sesión de Gemini para `send_message`."""
+        with self._lock:
+            self._fold()
+            self.chat.history = self._history()
+            return self.chat
+
+    def record(self, pregunta: str, respuesta: str) -> None:
+        """Agrega un turno completo (también las respuestas servidas desde cache)."""
+        with self._lock:
+            self.turnos.append((pregunta, respuesta))
+
+    @property
+    def started(self) -> bool:
+        """True si ya hay conversación: las preguntas siguientes pueden depender de ella."""
+        return bool(self.turnos or self.resumen)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "turnos": len(self.turnos) + self.resumidos,
+            "en_ventana": len(self.turnos),
+            "resumidos": self.resumidos,
+            "tokens_entrada": self.prompt_tokens(),
+        }
@@ -0,0 +1,114 @@
+# circuit_breaker.py
+"""
+Interruptor (circuit breaker) del backend de IA. Tras N fallas seguidas, o N
+respuestas más lentas que el objetivo de latencia, se abre: las llamadas dejan de
+ir a Gemini y se atienden de inmediato con el analizador local, sin pagar el
+timeout de cada paso. Pasado un tiempo, una sonda en segundo plano prueba el
+backend (semiabierto); si responde a tiempo el interruptor se cierra, si no
+vuelve a abrirse.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """El interruptor se abrió durante la operación: debe terminarla el analizador local."""
+
+class CircuitBreaker:
+    """Estado del backend compartido por todas las sesiones; `probe()` devuelve True si el backend responde."""
+
+    def __init__(self, max_failures: int = 3, latency_slo: float = 20.0, reset_timeout: float = 30.0,
+                 probe: Optional[Callable[[], bool]] = None):
+        self.max_failures = max(max_failures, 1)
+        self.latency_slo = latency_slo
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+        self._estado = CLOSED
+        self._fallas = 0  # Fallas (o respuestas lentas) seguidas
+        self._abierto_desde = 0.0
+        self._ultima_causa = ""
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.probes = 0
+        self.short_circuited = 0
+
+    @property
+    def state(self) -> str:
+        """Estado actual; si ya pasó el tiempo de espera, lanza la sonda en segundo plano."""
+        with self._lock:
+            if (self._estado == OPEN and self.probe is not None
+                    and time.monotonic() - self._abierto_desde >= self.reset_timeout):
+                self._estado = HALF_OPEN
+                self.probes += 1
+                threading.Thread(target=self._run_probe, daemon=True).start()
+            return self._estado
+
+    def allow(self) -> bool:
+        """True si la llamada puede ir al backend; mientras no esté cerrado se atiende localmente."""
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            self.short_circuited += 1
+        return False
+
+    def record_success(self, latency: float, margin: float = 0.0) -> None:
+        """Respuesta recibida; si tardó más que el objetivo (más `margin` s por su tamaño) cuenta como falla."""
+        if latency > self.latency_slo + margin:
+            self.record_failure(f"respuesta lenta ({latency:.1f} s)")
+            return
+        with self._lock:
+            if self._estado == CLOSED:
+                self._fallas = 0
+
+    def record_failure(self, causa: str = "error") -> None:
+        with self._lock:
+            if self._estado != CLOSED:
+                return
+            self._fallas += 1
+            self._ultima_causa = causa
+            if self._fallas >= self.max_failures:
+                self._open_locked()
+
+    def _open_locked(self) -> None:
+        self._estado = OPEN
+        self._abierto_desde = time.monotonic()
+        self.opened += 1
+
+    def _run_probe(self) -> None:
+        """Sonda del estado semiabierto: una llamada mínima que debe responder dentro del objetivo."""
+        inicio = time.monotonic()
+        try:
+            ok = bool(self.probe()) and time.monotonic() - inicio <= self.latency_slo
+        except Exception as e:
+            ok = False
+            self._ultima_causa = f"sonda: {e}"
+        with self._lock:
+            if ok:
+                self._estado = CLOSED
+                self._fallas = 0
+            else:
+                self._open_locked()
+
+    def retry_in(self) -> float:
+        """Segundos hasta la próxima sonda (0 si no está abierto)."""
+        with self._lock:
+            if self._estado != OPEN:
+                return 0.0
+            return max(self.reset_timeout - (time.monotonic() - self._abierto_desde), 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        estado = self.state
+        return {
+            "state": estado,
+            "failures": self._fallas,
+            "last_cause": self._ultima_causa,
+            "retry_in": round(self.retry_in(), 1),
+            "opened": self.opened,
+            "probes": self.probes,
+            "short_circuited": self.short_circuited,
+        }
@@ -0,0 +1,212 @@
+# context_cache.py
+"""
+Cache de contexto para las llamadas a Gemini. Las instrucciones de cada tarea (con
+la especialización de `build_specialized_prompt`) y el documento del caso se
+registran una vez como contenido en cache; las llamadas siguientes solo envían la
+solicitud y hacen referencia a él.
+- modo "gemini": `genai.caching.CachedContent` (el modelo debe soportarlo y el
+  contenido debe superar el mínimo de tokens de la API; si no, se envía todo como antes)
+- modo "local": sustituto en memoria con el mismo comportamiento, para pruebas y
+  para modelos sin cache de contexto (no ahorra tokens)
+La cache pertenece a la sesión de Streamlit: vence con su TTL, la app la libera al
+cambiar de documento y se borra al descartarse el analizador de la sesión. Las
+llamadas a la API (crear y borrar contenido) se hacen fuera del lock.
+"""
+
+import datetime
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from persistent_cache import content_digest
+from rate_limiter import is_quota_error
+
+MODES = ("off", "gemini", "local")
+
+# Entradas por sesión (una por tarea y documento); al superarlas se borra la más vieja
+MAX_ENTRIES = 8
+
+# Margen antes del vencimiento a partir del cual ya no se usa una entrada (la llamada podría llegar tarde)
+_MARGEN_SEGUNDOS = 60
+
+class LocalCachedContent:
+    """Sustituto local de `CachedContent`: guarda las instrucciones y el contenido en memoria."""
+
+    def __init__(self, model: str, system_instruction: str, contents: List[str], ttl: float):
+        self.name = f"cachedContents/local-{uuid.uuid4().hex[:12]}"
+        self.model = model
+        self.system_instruction = system_instruction
+        self.contents = contents
+        self.expire_time = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=ttl)
+        self.deleted = False
+
+    def delete(self) -> None:
+        self.deleted = True
+
+class LocalCachedModel:
+    """
+    Modelo ligado a una `LocalCachedContent`: antepone las instrucciones y el
+    contenido a cada prompt, que es lo que hace Gemini con la cache en el servidor.
+    """
+
+    def __init__(self, model: Any, cached: LocalCachedContent):
+        self._model = model
+        self.cached_content = cached
+        self.model_name = model.model_name
+
+    def _preamble(self) -> str:
+        return "\n\n".join([f"INSTRUCCIONES DEL SISTEMA:\n{self.cached_content.system_instruction}",
+                            *self.cached_content.contents])
+
+    def _contents(self, contents: Any) -> str:
+        return f"{self._preamble()}\n\n{contents}"
+
+    def generate_content(self, contents: Any, **kwargs) -> Any:
+        return self._model.generate_content(self._contents(contents), **kwargs)
+
+    async def generate_content_async(self, contents: Any, **kwargs) -> Any:
+        return await self._model.generate_content_async(self._contents(contents), **kwargs)
+
+    def start_chat(self, history: Optional[Iterable[Any]] = None) -> Any:
+        inicio = [{"role": "user", "parts": [self._preamble()]}, {"role": "model", "parts": ["Entendido."]}]
+        return self._model.start_chat(history=inicio + list(history or []))
+
+class CachedContext:
+    """Entrada de la cache de contexto: huella del contenido y contenido registrado."""
+
+    def __init__(self, clave: str, contenido: Any, vence: float):
+        self.clave = clave
+        self.contenido = contenido
+        self.vence = vence
+
+class ContextCache:
+    """Contenido en cache por (modelo, instrucciones, documento) para la sesión actual."""
+
+    def __init__(self, modo: str = "off", ttl: float = 3600):
+        self.modo = modo if modo in MODES else "off"
+        self.ttl = ttl
+        self._entradas: Dict[str, CachedContext] = {}
+        self._fallidas: set = set()  # Claves que la API rechazó: no se reintenta en la sesión
+        self._creando: Dict[str, threading.Event] = {}  # Claves que otro hilo está registrando
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.modo != "off"
+
+    def key_for(self, model: Any, instrucciones: str, documento: str) -> Optional[str]:
+        """Huella del contexto (sin llamar a la API); None si la cache está desactivada o la API lo rechazó."""
+        if not self.enabled:
+            return None
+        clave = content_digest(f"{model.model_name}\n{instrucciones}\n{documento}".encode("utf-8"))
+        with self._lock:
+            return None if clave in self._fallidas else clave
+
+    def get(self, model: Any, instrucciones: str, documento: str,
+            via: Optional[Callable[[Callable[[], Any]], Any]] = None) -> Optional[CachedContext]:
+        """
+        Contexto en cache para estas instrucciones y documento; lo crea la primera vez
+        (None si no se pudo). `via(crear)` ejecuta la creación en la API, por ejemplo
+        dentro del límite de solicitudes; un error de cuota se propaga sin marcar la clave.
+        """
+        clave = self.key_for(model, instrucciones, documento)
+        if clave is None:
+            return None
+        viejas: List[CachedContext] = []
+        try:
+            while True:
+                with self._lock:
+                    entrada = self._entradas.get(clave)
+                    if entrada is not None:
+                        if entrada.vence - _MARGEN_SEGUNDOS > time.time():
+                            self.reused += 1
+                            return entrada
+                        viejas.append(self._entradas.pop(clave))
+                    if clave in self._fallidas:
+                        return None
+                    en_curso = self._creando.get(clave)
+                    if en_curso is None:
+                        en_curso = self._creando[clave] = threading.Event()
+                        break
+                # Otro hilo lo está registrando: se espera su resultado
+                en_curso.wait()
+
+            try:
+                crear = lambda: self._create(model.model_name, instrucciones, documento)
+                contenido = crear() if via is None or self.modo == "local" else via(crear)
+            except Exception as e:
+                with self._lock:
+                    if not is_quota_error(e):
+                        self._fallidas.add(clave)
+                        self.failures += 1
+                    self._creando.pop(clave).set()
+                if is_quota_error(e):
+                    raise
+                return None
+            entrada = CachedContext(clave, contenido, time.time() + self.ttl)
+            with self._lock:
+                self._entradas[clave] = entrada
+                if len(self._entradas) > MAX_ENTRIES:
+                    viejas.append(self._entradas.pop(next(iter(self._entradas))))
+                self.created += 1
+                self._creando.pop(clave).set()
+            return entrada
+        finally:
+            for vieja in viejas:
+                self._delete(vieja)
+
+    def _create(self, modelo: str, instrucciones: str, documento: str) -> Any:
+        if self.modo == "local":
+            return LocalCachedContent(modelo, instrucciones, [documento], self.ttl)
+        import google.generativeai as genai
+        return genai.caching.CachedContent.create(
+            model=modelo,
+            display_name="derecho-peticion",
+            system_instruction=instrucciones,
+            contents=[documento],
+            ttl=datetime.timedelta(seconds=self.ttl),
+        )
+
+    def model_for(self, model: Any, entrada: CachedContext) -> Any:
+        """Modelo que responde con el contexto en cache."""
+        if self.modo == "local":
+            return LocalCachedModel(model, entrada.contenido)
+        import google.generativeai as genai
+        return genai.GenerativeModel.from_cached_content(cached_content=entrada.contenido)
+
+    def discard(self, entrada: CachedContext) -> None:
+        """Deja de usar una entrada (por ejemplo, si la API ya no la reconoce)."""
+        with self._lock:
+            if self._entradas.get(entrada.clave) is not entrada:
+                return
+            del self._entradas[entrada.clave]
+        self._delete(entrada)
+
+    def release(self) -> None:
+        """Borra todo el contenido registrado por la sesión."""
+        with self._lock:
+            entradas = list(self._entradas.values())
+            self._entradas.clear()
+            self._fallidas.clear()
+        for entrada in entradas:
+            self._delete(entrada)
+
+    @staticmethod
+    def _delete(entrada: CachedContext) -> None:
+        try:
+            entrada.contenido.delete()
+        except Exception:
+            # Si ya venció en el servidor no hay nada que borrar
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.modo,
+            "entries": len(self._entradas),
+            "created": self.created,
+            "reused": self.reused,
+            "failures": self.failures,
+        }
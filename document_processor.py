@@ -1,46 +1,582 @@
 # document_processor.py
 import PyPDF2
-import docx2txt
-import tempfile
+import hashlib
+import mmap
 import os
+import re
+import tempfile
+from bisect import bisect_right
+import threading
+import time
+import weakref
+import zipfile
+import xml.etree.ElementTree as ET
 import streamlit as st
-from typing import Optional
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+from concurrent.futures import as_completed
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 import io
+from extraction_sandbox import ExtractionError, SandboxPool
+from persistent_cache import PersistentCache, content_digest
+
+PDF_MIME = "application/pdf"
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# Caracteres necesarios para mostrar la vista previa y permitir continuar
+PREVIEW_CHARS = 500
+
+# Extracción paralela: PDFs con al menos este número de páginas se reparten
+# entre procesos; los pequeños se extraen en serie (no compensa el arranque)
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", "0")) or max(1, (os.cpu_count() or 2) - 1)
+# Páginas por trabajo cuando solo se extrae lo necesario (vista previa, análisis)
+PDF_ON_DEMAND_PAGES = 4
+
+# Toda extracción corre en procesos aislados: un documento que excede el tiempo
+# o la memoria se aborta sin afectar al servidor ni a las demás sesiones
+PDF_EXTRACTION_TIMEOUT = float(os.getenv("PDF_EXTRACTION_TIMEOUT", "60"))
+PDF_EXTRACTION_MAX_MEMORY_MB = int(os.getenv("PDF_EXTRACTION_MAX_MEMORY_MB", "1024"))
+
+# Subidas mayores a este tamaño se vuelcan a disco y se leen con mmap
+SPOOL_MAX_MEMORY_MB = int(os.getenv("SPOOL_MAX_MEMORY_MB", "8"))
 
-@st.cache_data
-def _read_pdf_cached(file_content: bytes) -> str:
-    """Extrae texto de un PDF con cache para mejor rendimiento."""
+# Cache de extracción en disco, compartido entre sesiones, procesos y reinicios
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", ".cache")
+EXTRACTION_CACHE_MAX_MB = int(os.getenv("EXTRACTION_CACHE_MAX_MB", "256"))
+# Cambiar la versión invalida las entradas si cambia el resultado de la extracción
+EXTRACTOR_VERSION = "1"
+
+extraction_cache = PersistentCache(
+    os.path.join(EXTRACTION_CACHE_DIR, "extraction.sqlite3"),
+    max_bytes=EXTRACTION_CACHE_MAX_MB * 1024 * 1024,
+)
+
+def _remove_spool_file(path: str) -> None:
     try:
-        file_stream = io.BytesIO(file_content)
-        reader = PyPDF2.PdfReader(file_stream)
+        os.unlink(path)
+    except OSError:
+        pass  # En Windows puede seguir mapeado; el sistema lo limpiará
+
+def _map_file(path: str) -> mmap.mmap:
+    """Mapea un archivo en memoria de solo lectura (las páginas se cargan bajo demanda)."""
+    with open(path, "rb") as fh:
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+class UploadHandle:
+    """
+    Referencia liviana a un archivo subido; es lo único que se guarda en la sesión.
+    Los archivos grandes viven en un temporal en disco y se leen con mmap,
+    los pequeños quedan en memoria sin copiarse.
+    """
+
+    def __init__(self, name: str, type: str, size: int, digest: str,
+                 data: Optional[bytes] = None, path: Optional[str] = None):
+        self.name = name
+        self.type = type
+        self.size = size
+        self.digest = digest
+        self.data = data
+        self.path = path
+        if path is not None:
+            self._finalizer = weakref.finalize(self, _remove_spool_file, path)
+
+    @property
+    def ref(self) -> Union[bytes, str]:
+        """Lo que se envía a otros procesos: la ruta si está en disco, los bytes si no."""
+        return self.path if self.path is not None else self.data
+
+    def open_stream(self):
+        """Stream de lectura independiente (cada lector tiene su propia posición)."""
+        if self.path is not None:
+            return open(self.path, "rb")
+        return io.BytesIO(self.data)  # BytesIO sobre bytes no copia el contenido
+
+    def close(self) -> None:
+        """Elimina el temporal en disco, si lo hay."""
+        if self.path is not None:
+            self._finalizer()
+
+    def __enter__(self) -> "UploadHandle":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def _open_pdf_source(ref: Union[bytes, str]):
+    """Abre un UploadHandle.ref para PyPDF2 (también dentro de los procesos del pool)."""
+    if isinstance(ref, str):
+        return _map_file(ref)
+    return io.BytesIO(ref)
+
+def spool_upload(file) -> UploadHandle:
+    """
+    Convierte un UploadedFile en un UploadHandle sin duplicar el contenido en memoria:
+    se recorre como memoryview y, si es grande, se vuelca a disco.
+    """
+    if isinstance(file, UploadHandle):
+        return file
+    # getvalue() devuelve los mismos bytes recibidos por Streamlit (sin copia);
+    # getbuffer() en cambio forzaría a BytesIO a duplicarlos
+    data = file.getvalue()
+    view = memoryview(data)
+    digest = content_digest(view)
+    if len(view) <= SPOOL_MAX_MEMORY_MB * 1024 * 1024:
+        return UploadHandle(file.name, file.type, len(view), digest, data=data)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.name)[1]) as tmp:
+        for offset in range(0, len(view), 1024 * 1024):
+            tmp.write(view[offset:offset + 1024 * 1024])  # slices de memoryview: sin copia
+    return UploadHandle(file.name, file.type, len(view), digest, path=tmp.name)
+
+def _cache_key(kind: str, source: UploadHandle) -> str:
+    """Clave direccionada por contenido: tipo, versión del extractor y huella."""
+    return f"{kind}:{EXTRACTOR_VERSION}:{source.digest}"
+
+_process_pool: Optional[SandboxPool] = None
+_process_pool_lock = threading.Lock()
+
+def _get_process_pool() -> SandboxPool:
+    """Pool de procesos aislados compartido por todas las sesiones (se crea una sola vez)."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = SandboxPool(
+                PDF_EXTRACTION_WORKERS,
+                timeout=PDF_EXTRACTION_TIMEOUT,
+                max_memory_mb=PDF_EXTRACTION_MAX_MEMORY_MB,
+            )
+        return _process_pool
+
+@lru_cache(maxsize=1)
+def _worker_reader(ref: Union[bytes, str]) -> PyPDF2.PdfReader:
+    """Lector reutilizado dentro de un proceso mientras siga pidiendo el mismo PDF."""
+    return PyPDF2.PdfReader(_open_pdf_source(ref))
+
+def _count_pdf_pages(ref: Union[bytes, str]) -> int:
+    """Trabajo de un proceso: número de páginas del PDF."""
+    return len(_worker_reader(ref).pages)
+
+# Claves que no afectan al texto extraído: /Parent recorrería todo el árbol de
+# páginas y los programas de fuente pesan mucho (el texto sale de /ToUnicode)
+_PAGE_DIGEST_SKIP = {"/Parent", "/FontFile", "/FontFile2", "/FontFile3"}
+
+def _pdf_object_digest(obj, memo: Dict[Tuple[int, int], bytes]) -> bytes:
+    """Huella de un objeto PDF; los objetos indirectos se calculan una sola vez."""
+    if isinstance(obj, IndirectObject):
+        ref = (obj.idnum, obj.generation)
+        if ref not in memo:
+            memo[ref] = b"ciclo"  # Referencias circulares entre recursos
+            memo[ref] = _pdf_object_digest(obj.get_object(), memo)
+        return memo[ref]
+    h = hashlib.blake2b(digest_size=16)
+    if isinstance(obj, DictionaryObject):
+        if obj.get("/Subtype") == "/Image":
+            return b"imagen"  # Las imágenes no aportan texto
+        for key in sorted(obj):
+            if key not in _PAGE_DIGEST_SKIP:
+                h.update(key.encode())
+                h.update(_pdf_object_digest(obj.raw_get(key), memo))
+        if isinstance(obj, StreamObject):
+            h.update(obj._data)  # Bytes tal como están en el archivo, sin descomprimir
+    elif isinstance(obj, ArrayObject):
+        for item in obj:
+            h.update(_pdf_object_digest(item, memo))
+    else:
+        h.update(repr(obj).encode())
+    return h.digest()
+
+def _page_digest(page: PyPDF2.PageObject, memo: Dict[Tuple[int, int], bytes]) -> str:
+    """Huella de una página: su flujo de contenido más las fuentes y formularios que usa."""
+    h = hashlib.blake2b(digest_size=16)
+    for key in ("/Contents", "/Resources", "/Rotate"):
+        if key in page:
+            h.update(_pdf_object_digest(page.raw_get(key), memo))
+    return h.hexdigest()
+
+def _extract_page_range(ref: Union[bytes, str], start: int, stop: int,
+                        desde: float = float("inf")) -> List[Tuple[str, bool]]:
+    """
+    Trabajo de un proceso: extrae el texto de las páginas [start, stop).
+    Cada página se busca antes en el cache por su huella, así que al subir una
+    versión corregida del documento solo se extraen las páginas que cambiaron.
+    Devuelve (texto, reutilizada) por página; solo cuenta como reutilizada una
+    página guardada antes de `desde` (no las que guardó este mismo documento).
+    """
+    reader = _worker_reader(ref)
+    memo: Dict[Tuple[int, int], bytes] = {}
+    paginas = []
+    for i in range(start, stop):
+        page = reader.pages[i]
+        cache_key = f"page:{EXTRACTOR_VERSION}:{_page_digest(page, memo)}"
+        guardada = extraction_cache.get_entry(cache_key, group="page")
+        if guardada is not None:
+            texto, creada = guardada
+            reutilizada = creada < desde
+        else:
+            texto, reutilizada = page.extract_text() or "", False
+            extraction_cache.set(cache_key, texto)
+        paginas.append((texto, reutilizada))
+    return paginas
+
+def _page_ranges(start: int, stop: int, workers: int) -> List[Tuple[int, int]]:
+    """Divide las páginas en rangos contiguos (dos por proceso para equilibrar carga)."""
+    chunk = max(1, -(-(stop - start) // (workers * 2)))
+    return [(first, min(first + chunk, stop)) for first in range(start, stop, chunk)]
+
+def _iter_page_ranges(source: UploadHandle, ranges: List[Tuple[int, int]],
+                      desde: float = float("inf")) -> Iterator[Tuple[str, bool]]:
+    """Extrae rangos de páginas en el pool de procesos y los entrega en orden."""
+    # Los archivos volcados a disco viajan como ruta: cada proceso los mapea
+    futures = [_get_process_pool().submit(_extract_page_range, source.ref, first, last, desde, grupo=source)
+               for first, last in ranges]
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+def _iter_pages_on_demand(source: UploadHandle, start: int, stop: int,
+                          desde: float = float("inf")) -> Iterator[Tuple[str, bool]]:
+    """Extrae unas pocas páginas por trabajo, solo cuando se piden las siguientes."""
+    for first in range(start, stop, PDF_ON_DEMAND_PAGES):
+        yield from _iter_page_ranges(source, [(first, min(first + PDF_ON_DEMAND_PAGES, stop))], desde)
+
+def _iter_pages(source: UploadHandle, total_pages: int, start: int = 0,
+                bulk: bool = True, desde: float = float("inf")) -> Iterator[Tuple[str, bool]]:
+    """
+    Elige extracción bajo demanda, en un solo trabajo o repartida entre procesos.
+    `desde` es el inicio de la extracción del documento: las páginas que guardaron
+    sus propios trabajos anteriores no cuentan como reutilizadas.
+    """
+    if not bulk:
+        return _iter_pages_on_demand(source, start, total_pages, desde)
+    if PDF_EXTRACTION_WORKERS > 1 and total_pages - start >= PDF_PARALLEL_MIN_PAGES:
+        return _iter_page_ranges(source, _page_ranges(start, total_pages, PDF_EXTRACTION_WORKERS), desde)
+    return _iter_page_ranges(source, [(start, total_pages)], desde)
+
+def _pdf_page_count(source: UploadHandle) -> int:
+    """Cuenta las páginas en un proceso aislado (el árbol de páginas puede ser hostil)."""
+    return _get_process_pool().submit(_count_pdf_pages, source.ref, grupo=source).result()
+
+def iter_pdf_pages(source: UploadHandle) -> Iterator[str]:
+    """Genera el texto de las páginas con contenido a medida que se extrae."""
+    for content, _ in _iter_pages(source, _pdf_page_count(source)):
+        if content.strip():  # Solo páginas con contenido
+            yield content
+
+# Etiquetas de WordprocessingML que aportan texto (mismas reglas que docx2txt)
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_T, _W_TAB, _W_P = f"{_W_NS}t", f"{_W_NS}tab", f"{_W_NS}p"
+_W_BREAKS = (f"{_W_NS}br", f"{_W_NS}cr")
+_DOCX_HEADER = re.compile(r"word/header[0-9]*.xml")
+_DOCX_FOOTER = re.compile(r"word/footer[0-9]*.xml")
+
+def _docx_xml_to_text(stream) -> str:
+    """Recorre un XML de Word en streaming, liberando cada nodo ya procesado."""
+    partes = []
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if elem.tag == _W_P:
+                partes.append("\n\n")
+            elif elem.tag == _W_TAB:
+                partes.append("\t")
+            elif elem.tag in _W_BREAKS:
+                partes.append("\n")
+        else:
+            # El texto de <w:t> solo está completo en el evento "end"
+            if elem.tag == _W_T:
+                partes.append(elem.text or "")
+            elem.clear()
+    return "".join(partes)
+
+def _read_docx_in_memory(stream) -> str:
+    """Extrae el texto de un DOCX desde memoria: encabezados, cuerpo y pies de página."""
+    with zipfile.ZipFile(stream) as zipf:
+        nombres = zipf.namelist()
+        partes = ([n for n in nombres if _DOCX_HEADER.match(n)]
+                  + ["word/document.xml"]
+                  + [n for n in nombres if _DOCX_FOOTER.match(n)])
         texto = []
-        for page in reader.pages:
-            content = page.extract_text() or ""
-            if content.strip():  # Solo agregar páginas con contenido
-                texto.append(content)
-        return "\n".join(texto).strip()
-    except Exception as e:
+        for nombre in partes:
+            with zipf.open(nombre) as xml_stream:
+                texto.append(_docx_xml_to_text(xml_stream))
+    return "".join(texto).strip()
+
+def _read_pdf_cached(source: UploadHandle) -> str:
+    """Extrae texto de un PDF con cache persistente para mejor rendimiento."""
+    cache_key = _cache_key("pdf", source)
+    texto = extraction_cache.get(cache_key)
+    if texto is not None:
+        return texto
+    try:
+        texto = "\n".join(iter_pdf_pages(source)).strip()
+    except ExtractionError as e:
+        # Los documentos abortados no se guardan en cache: se reintentan la próxima vez
         st.error(f"Error leyendo PDF: {e}")
         return ""
+    extraction_cache.set(cache_key, texto)
+    return texto
 
-@st.cache_data
-def _read_docx_cached(file_content: bytes) -> str:
-    """Extrae texto de un DOCX con cache para mejor rendimiento."""
+def _read_docx_cached(source: UploadHandle) -> str:
+    """Extrae texto de un DOCX con cache persistente para mejor rendimiento."""
+    cache_key = _cache_key("docx", source)
+    texto = extraction_cache.get(cache_key)
+    if texto is not None:
+        return texto
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
-            tmp.write(file_content)
-            tmp_path = tmp.name
-        
-        texto = docx2txt.process(tmp_path) or ""
-        os.unlink(tmp_path)  # Limpiar archivo temporal
-        return texto.strip()
-    except Exception as e:
+        # También aislado: un DOCX es un ZIP y puede ser una bomba de descompresión
+        texto, _ = _get_process_pool().submit(_extract_text_job, source.ref, DOCX_MIME, grupo=source).result()
+    except ExtractionError as e:
         st.error(f"Error leyendo DOCX: {e}")
         return ""
+    extraction_cache.set(cache_key, texto)
+    return texto
+
+def _extract_text_job(ref: Union[bytes, str], mime: str) -> Tuple[str, int]:
+    """Trabajo de un proceso: texto completo de un documento y páginas reutilizadas del cache."""
+    if mime == PDF_MIME:
+        paginas = _extract_page_range(ref, 0, _count_pdf_pages(ref), time.time())
+        texto = "\n".join(c for c, _ in paginas if c.strip()).strip()
+        return texto, sum(reutilizada for _, reutilizada in paginas)
+    with (open(ref, "rb") if isinstance(ref, str) else io.BytesIO(ref)) as stream:
+        return _read_docx_in_memory(stream), 0
+
+def _batch_result(source: UploadHandle, inicio: float, texto: str = "", error: str = "",
+                  desde_cache: bool = False, reutilizadas: int = 0) -> Dict[str, Any]:
+    if error:
+        estado = "❌ Error"
+    elif not texto:
+        estado = "⚠️ Sin texto"
+    else:
+        estado = "♻️ Cache" if desde_cache else "✅ Listo"
+    return {
+        "archivo": source.name,
+        "estado": estado,
+        "caracteres": len(texto),
+        "reutilizadas": reutilizadas,
+        "segundos": round(time.time() - inicio, 2),
+        "error": error,
+        "texto": texto,
+    }
+
+def iter_batch_results(files: Iterable) -> Iterator[Dict[str, Any]]:
+    """
+    Ingesta por lotes: extrae varios documentos a la vez en el pool de procesos
+    (acotado por PDF_EXTRACTION_WORKERS) y entrega el resultado de cada uno en
+    cuanto termina, no en el orden de subida. Todo el lote comparte una cola del
+    pool, que se atiende por turnos con los documentos de las demás sesiones. No usa st.*.
+    """
+    lote = object()
+    pendientes = {}
+    for file in files:
+        inicio = time.time()
+        source = spool_upload(file)
+        kind = {PDF_MIME: "pdf", DOCX_MIME: "docx"}.get(source.type)
+        if kind is None:
+            yield _batch_result(source, inicio, error=f"Tipo de archivo no soportado: {source.type}")
+            continue
+        cache_key = _cache_key(kind, source)
+        texto = extraction_cache.get(cache_key)
+        if texto is not None:
+            yield _batch_result(source, inicio, texto=texto, desde_cache=True)
+            continue
+        future = _get_process_pool().submit(_extract_text_job, source.ref, source.type, grupo=lote)
+        pendientes[future] = (source, cache_key, inicio)
+
+    for future in as_completed(pendientes):
+        source, cache_key, inicio = pendientes[future]
+        try:
+            texto, reutilizadas = future.result()
+        except Exception as e:
+            yield _batch_result(source, inicio, error=str(e))
+            continue
+        extraction_cache.set(cache_key, texto)
+        yield _batch_result(source, inicio, texto=texto, reutilizadas=reutilizadas)
+
+class LazyDocument:
+    """
+    Documento cuyas páginas se extraen bajo demanda: pedir los primeros N
+    caracteres (la vista previa) solo extrae las páginas que los cubren. El resto
+    se extrae en paralelo cuando un paso pide el texto completo.
+    """
+
+    def __init__(self, total_pages: int, read_pages: Callable[[int, bool], Iterator[Tuple[str, bool]]],
+                 on_complete: Optional[Callable[[str], None]] = None):
+        # read_pages(inicio, masivo) genera (texto, reutilizada) de las páginas desde
+        # `inicio`; con masivo=True puede repartirlas en paralelo
+        self.total_pages = total_pages
+        self.pages_processed = 0
+        self.pages_reused = 0  # Páginas recuperadas del cache de una versión anterior
+        self.error: Optional[Exception] = None
+        self._read_pages = read_pages
+        self._on_complete = on_complete
+        self._source: Optional[Iterator[Tuple[str, bool]]] = None
+        self._bulk = False
+        self._pages: List[str] = []
+        self._chars = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_text(cls, texto: str) -> "LazyDocument":
+        """Documento ya extraído (por ejemplo, recuperado del cache)."""
+        return cls(1, lambda start, bulk: iter([(texto, False)][start:]))
+
+    @property
+    def done(self) -> bool:
+        return self.pages_processed >= self.total_pages or self.error is not None
+
+    def _pull(self, needed_chars: Optional[int], bulk: bool) -> None:
+        """Extrae páginas hasta cubrir `needed_chars` (None = todas)."""
+        while True:
+            with self._lock:
+                if self.done or (needed_chars is not None and self._chars >= needed_chars):
+                    return
+                if self._source is None or (bulk and not self._bulk):
+                    # Al pasar a extracción masiva se continúa desde la página actual
+                    self._source = self._read_pages(self.pages_processed, bulk)
+                    self._bulk = bulk
+                try:
+                    content, reutilizada = next(self._source)
+                except StopIteration:
+                    content, reutilizada = "", False
+                except Exception as e:
+                    self.error = e
+                    return
+                self.pages_processed += 1
+                self.pages_reused += reutilizada
+                if content.strip():
+                    self._pages.append(content)
+                    self._chars += len(content) + 1
+                completo = self.done and self.error is None
+            if completo and self._on_complete is not None:
+                self._on_complete(self.text())
+
+    def text(self) -> str:
+        """Texto extraído hasta el momento (sin extraer más páginas)."""
+        return "\n".join(self._pages).strip()
+
+    def prefix(self, max_chars: int) -> str:
+        """Primeros `max_chars` caracteres; solo extrae las páginas que los cubren."""
+        self._pull(max_chars, bulk=False)
+        return self.text()[:max_chars]
+
+    def full_text(self) -> str:
+        """Texto completo; extrae en paralelo las páginas que falten."""
+        self._pull(None, bulk=True)
+        return self.text()
+
+# Saltos de párrafo, de línea y fin de oración: todo en una sola pasada
+_INDEX_BOUNDARIES = re.compile(r"\n\n|\n|[.!?]")
+
+# Encabezados de las secciones habituales de un derecho de petición (sobre texto en
+# minúsculas); el encabezado es lo que precede a la primera sección encontrada
+_SECTION_HEADINGS = {
+    "hechos": re.compile(r"\s*(hechos|antecedentes|situaci[oó]n f[aá]ctica)\b"),
+    "fundamentos": re.compile(r"\s*(fundamentos?|consideraciones|normas? (aplicables|violadas)|razones)\b"),
+    "petición": re.compile(r"\s*(peticion(es)?|petición|pretensiones|solicitud(es)?|solicito|lo que se solicita)\b"),
+    "firma": re.compile(r"\s*(atentamente|cordialmente|respetuosamente|firma)\b"),
+}
+_SECTION_HEADING_MAX_CHARS = 80  # Las líneas más largas son cuerpo de texto, no títulos
+
+class DocumentIndex:
+    """
+    Estructura del documento calculada una sola vez y compartida por todos los
+    analizadores: texto en minúsculas, inicio de cada línea, límites de oración y
+    párrafo, y secciones detectadas (encabezado, hechos, fundamentos, petición, firma).
+    Se obtiene con `build_document_index(texto)`, que la memoriza.
+    """
+
+    def __init__(self, texto: str):
+        self.texto = texto
+        self.lower = texto.lower()
+        self.line_offsets = [0]  # Posición donde empieza cada línea
+        self.sentence_ends: List[int] = []  # Posición justo después de cada . ! ?
+        self.paragraph_breaks: List[int] = []  # Posición de cada "\n\n"
+        for match in _INDEX_BOUNDARIES.finditer(texto):
+            token, pos = match.group(), match.start()
+            if token == "\n\n":
+                self.paragraph_breaks.append(pos)
+                self.line_offsets.extend((pos + 1, pos + 2))
+            elif token == "\n":
+                self.line_offsets.append(pos + 1)
+            else:
+                self.sentence_ends.append(pos + 1)
+        self.word_count = len(texto.split())
+        self.sections = self._detect_sections()
+
+    def _detect_sections(self) -> Dict[str, Tuple[int, int]]:
+        """Rangos [inicio, fin) de cada sección; solo cuenta la primera aparición."""
+        inicios = {}
+        for numero, inicio in enumerate(self.line_offsets):
+            fin = self.line_offsets[numero + 1] if numero + 1 < len(self.line_offsets) else len(self.texto)
+            if fin - inicio > _SECTION_HEADING_MAX_CHARS:
+                continue
+            for nombre, patron in _SECTION_HEADINGS.items():
+                if nombre not in inicios and patron.match(self.lower, inicio, fin):
+                    inicios[nombre] = inicio
+                    break
+        ordenadas = sorted(inicios.items(), key=lambda item: item[1])
+        sections = {"encabezado": (0, ordenadas[0][1] if ordenadas else len(self.texto))}
+        for i, (nombre, inicio) in enumerate(ordenadas):
+            fin = ordenadas[i + 1][1] if i + 1 < len(ordenadas) else len(self.texto)
+            sections[nombre] = (inicio, fin)
+        return sections
+
+    @property
+    def paragraph_count(self) -> int:
+        return len(self.paragraph_breaks) + 1
+
+    @property
+    def sentence_count(self) -> int:
+        return len(self.sentence_ends)
+
+    def contains(self, *terminos: str) -> bool:
+        """True si aparece alguno de los términos (en minúsculas)."""
+        return any(termino in self.lower for termino in terminos)
+
+    def line_number(self, offset: int) -> int:
+        """Número de línea (desde 1) de una posición del texto."""
+        return bisect_right(self.line_offsets, offset)
+
+    def sentences(self) -> Iterator[str]:
+        """Oraciones del texto, delimitadas por . ! ? (incluye el resto final)."""
+        inicio = 0
+        for fin in self.sentence_ends:
+            yield self.texto[inicio:fin - 1]
+            inicio = fin
+        yield self.texto[inicio:]
+
+    def section(self, nombre: str) -> str:
+        """Texto de una sección detectada ("" si el documento no la tiene)."""
+        if nombre not in self.sections:
+            return ""
+        inicio, fin = self.sections[nombre]
+        return self.texto[inicio:fin].strip()
+
+    def cut(self, inicio: int, limite: int) -> int:
+        """Posición del último fin de oración entre `inicio` y `limite` para cortar sin partir oraciones."""
+        if limite >= len(self.texto):
+            return len(self.texto)
+        i = bisect_right(self.sentence_ends, limite) - 1
+        corte = self.sentence_ends[i] if i >= 0 else 0
+        # Si no hay un fin de oración razonablemente cerca se corta en el límite
+        return corte if corte > inicio + (limite - inicio) // 2 else limite
+
+    def head(self, max_chars: Optional[int]) -> str:
+        """Primeros `max_chars` caracteres, cortando en el último fin de oración."""
+        if max_chars is None or len(self.texto) <= max_chars:
+            return self.texto
+        return self.texto[:self.cut(0, max_chars)]
+
+@lru_cache(maxsize=8)
+def build_document_index(texto: str) -> DocumentIndex:
+    """Índice del documento; llamadas repetidas con el mismo texto lo reutilizan."""
+    return DocumentIndex(texto)
 
 def process_document(file) -> Optional[str]:
     """
-    Procesa un archivo subido (Streamlit UploadedFile) y devuelve texto.
+    Procesa un archivo subido (Streamlit UploadedFile o UploadHandle) y devuelve texto.
     Soporta PDF y DOCX. Devuelve None si no se pudo extraer texto.
     Optimizado con cache para mejor rendimiento.
     """
@@ -48,26 +584,68 @@ def process_document(file) -> Optional[str]:
         return None
 
     try:
-        # Leer el contenido del archivo una sola vez
-        file.seek(0)
-        file_content = file.read()
-        
-        if file.type == "application/pdf":
-            texto = _read_pdf_cached(file_content)
-        elif file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            texto = _read_docx_cached(file_content)
-        else:
-            st.warning(f"Tipo de archivo no soportado: {file.type}")
-            return None
+        # Recorrer el contenido sin copiarlo (los archivos grandes van a disco)
+        source = spool_upload(file)
+
+        try:
+            if source.type == PDF_MIME:
+                texto = _read_pdf_cached(source)
+            elif source.type == DOCX_MIME:
+                texto = _read_docx_cached(source)
+            else:
+                st.warning(f"Tipo de archivo no soportado: {source.type}")
+                return None
+        finally:
+            if source is not file:
+                source.close()
 
         # Validar que se extrajo texto
         texto = (texto or "").strip()
         if not texto:
             st.warning("No se pudo extraer texto del documento. Verifica que el archivo contenga texto legible.")
             return None
-            
+
         return texto
-        
+
+    except Exception as e:
+        st.error(f"Error procesando documento: {e}")
+        return None
+
+def process_document_lazy(file) -> Optional[LazyDocument]:
+    """
+    Variante bajo demanda de `process_document`: devuelve un LazyDocument que
+    extrae las páginas del PDF a medida que se piden. Los DOCX se entregan completos.
+    Recibe un UploadHandle, que se mantiene vivo mientras viva el documento.
+    """
+    if not file:
+        return None
+
+    try:
+        source = spool_upload(file)
+
+        if source.type == PDF_MIME:
+            # Documento ya visto: se entrega completo desde el cache persistente
+            cache_key = _cache_key("pdf", source)
+            texto = extraction_cache.get(cache_key)
+            if texto is not None:
+                return LazyDocument.from_text(texto)
+            total_pages = _pdf_page_count(source)
+            desde = time.time()
+            return LazyDocument(
+                total_pages,
+                lambda start, bulk: _iter_pages(source, total_pages, start, bulk, desde),
+                on_complete=lambda texto: extraction_cache.set(cache_key, texto),
+            )
+        elif source.type == DOCX_MIME:
+            texto = _read_docx_cached(source)
+            if not texto:
+                st.warning("No se pudo extraer texto del documento. Verifica que el archivo contenga texto legible.")
+                return None
+            return LazyDocument.from_text(texto)
+        else:
+            st.warning(f"Tipo de archivo no soportado: {source.type}")
+            return None
+
     except Exception as e:
         st.error(f"Error procesando documento: {e}")
-        return None 
\ No newline at end of file
+        return None
@@ -0,0 +1,162 @@
+# extraction_sandbox.py
+"""
+Procesos aislados para extraer texto de documentos no confiables.
+Cada trabajo tiene un tiempo máximo y un tope de memoria: si un PDF malformado
+se queda en un ciclo o dispara el consumo, se mata solo su proceso y el servidor
+de Streamlit (y las demás sesiones) siguen atendiendo. Los procesos sanos se
+reutilizan entre documentos para no pagar el arranque en cada uno.
+"""
+
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+try:
+    import resource  # No existe en Windows: allí no se aplica el tope de memoria
+except ImportError:
+    resource = None
+
+class ExtractionError(Exception):
+    """Fallo de extracción con motivo estructurado: timeout, memory, crash o invalid."""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+def _address_space_limit(max_bytes: int) -> int:
+    """Tope de espacio de direcciones: lo que el proceso ya tiene mapeado más `max_bytes`."""
+    # El proceso hijo ya tiene mapeado el intérprete y lo que importa al recibir el
+    # trabajo (PyPDF2, Streamlit...), así que un tope absoluto lo dejaría sin memoria
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[0]) * os.sysconf("SC_PAGE_SIZE") + max_bytes
+    except (OSError, ValueError, AttributeError):
+        return max_bytes
+
+def _worker_main(conn, max_bytes: int) -> None:
+    """Bucle de un proceso aislado: recibe (función, argumentos) y devuelve el resultado."""
+    if resource is not None and max_bytes > 0:
+        limite = _address_space_limit(max_bytes)
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (limite, limite))
+        except (ValueError, OSError):
+            pass
+    while True:
+        try:
+            fn, args = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            conn.send(("ok", fn(*args)))
+        except MemoryError:
+            # El montículo puede quedar fragmentado: se informa y el proceso termina
+            conn.send(("memory", "El documento superó el límite de memoria de extracción"))
+            return
+        except Exception as e:
+            conn.send(("invalid", str(e) or type(e).__name__))
+
+class _Worker:
+    """Proceso aislado con su extremo de la tubería y cuántos trabajos lleva."""
+
+    def __init__(self, ctx, max_bytes: int):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, max_bytes), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+class SandboxPool:
+    """
+    Pool de procesos aislados con tiempo máximo y tope de memoria por trabajo.
+    `submit` devuelve un Future como ProcessPoolExecutor; los fallos llegan como
+    ExtractionError. Un proceso que excede el tiempo se mata y se reemplaza.
+    Cada `grupo` (un lote, un documento) tiene su propia cola y los procesos libres
+    las atienden por turnos: un lote grande no deja esperando a las demás sesiones.
+    """
+
+    def __init__(self, workers: int, timeout: float, max_memory_mb: int, max_tasks_per_worker: int = 100):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_bytes = max_memory_mb * 1024 * 1024
+        self.max_tasks_per_worker = max_tasks_per_worker
+        # Los procesos se crean desde hilos despachadores dentro del servidor multihilo:
+        # con fork heredarían locks tomados por otros hilos y podrían quedar bloqueados.
+        # El servidor de forkserver importa el módulo principal (app.py) una vez: su
+        # trabajo debe seguir dentro de `if __name__ == "__main__"`
+        metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._ctx = multiprocessing.get_context(metodo)
+        self._colas: "OrderedDict[Any, deque]" = OrderedDict()  # Grupo → trabajos pendientes, en orden de turno
+        self._threads = []
+        self._lock = threading.Lock()
+        self._hay_trabajo = threading.Condition(self._lock)
+
+    def submit(self, fn: Callable, *args: Any, grupo: Any = None) -> Future:
+        """Encola un trabajo en la cola de su grupo; un hilo despachador lo envía al primer proceso libre."""
+        future: Future = Future()
+        with self._lock:
+            self._colas.setdefault(grupo, deque()).append((future, fn, args))
+            self._hay_trabajo.notify()
+            # Un despachador por proceso; se crean a medida que hacen falta
+            if len(self._threads) < self.workers:
+                hilo = threading.Thread(target=self._dispatch, daemon=True)
+                hilo.start()
+                self._threads.append(hilo)
+        return future
+
+    def _next_task(self) -> tuple:
+        """Primer trabajo del grupo al que le toca; ese grupo pasa al final del turno."""
+        with self._hay_trabajo:
+            while not self._colas:
+                self._hay_trabajo.wait()
+            grupo, cola = self._colas.popitem(last=False)
+            tarea = cola.popleft()
+            if cola:
+                self._colas[grupo] = cola
+            return tarea
+
+    def _dispatch(self) -> None:
+        """Hilo dueño de un proceso: le pasa trabajos y lo reemplaza si falla."""
+        worker: Optional[_Worker] = None
+        while True:
+            future, fn, args = self._next_task()
+            if not future.set_running_or_notify_cancel():
+                continue
+            if worker is None or not worker.process.is_alive():
+                try:
+                    worker = _Worker(self._ctx, self.max_bytes)
+                except Exception as e:
+                    # Sin proceso (límite de procesos o descriptores): falla este trabajo y el
+                    # despachador sigue atendiendo; el próximo trabajo vuelve a intentarlo
+                    worker = None
+                    future.set_exception(ExtractionError("crash", f"No se pudo iniciar el proceso de extracción: {e}"))
+                    continue
+            status, payload = self._run(worker, fn, args)
+            worker.tasks += 1
+            if status in ("timeout", "memory", "crash") or worker.tasks >= self.max_tasks_per_worker:
+                # Un proceso colgado, sin memoria o con muchos usos se descarta y se crea otro
+                worker.kill()
+                worker = None
+            if status == "ok":
+                future.set_result(payload)
+            else:
+                future.set_exception(ExtractionError(status, payload))
+
+    def _run(self, worker: _Worker, fn: Callable, args: tuple) -> tuple:
+        try:
+            worker.conn.send((fn, args))
+            if not worker.conn.poll(self.timeout):
+                return "timeout", f"La extracción superó el tiempo máximo de {self.timeout:g} s"
+            return worker.conn.recv()
+        except (EOFError, OSError):
+            worker.process.join(1)
+            return "crash", f"El proceso de extracción terminó inesperadamente (código {worker.process.exitcode})"
+        except Exception as e:  # Argumentos que no se pueden enviar al proceso
+            return "invalid", str(e)
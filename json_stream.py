@@ -0,0 +1,233 @@
+# json_stream.py
+"""
+Lectura de respuestas JSON del modelo en una sola pasada.
+- JSONArrayStreamParser: mientras la respuesta llega por fragmentos, entrega cada
+  elemento de la lista de problemas o recomendaciones apenas se cierra su llave.
+- extract_json_block: en respuestas de texto libre ubica el primer bloque JSON
+  balanceado y, si la respuesta se cortó por `max_output_tokens`, lo repara.
+"""
+
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+_ESPACIOS = " \t\r\n"
+
+class JSONArrayStreamParser:
+    """
+    Recibe fragmentos de texto con `feed` y devuelve los elementos completos del
+    primer array JSON que aparezca. Se ignora lo que venga antes del `[` (texto
+    libre o cercas de markdown) y lo que venga después del `]` que lo cierra.
+    Cada carácter se revisa una sola vez, sin importar cuántos fragmentos lleguen.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._started = False
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._item_start: Optional[int] = None
+        self.items: List[Any] = []
+
+    def feed(self, fragmento: str) -> List[Any]:
+        """Agrega un fragmento y devuelve los elementos que quedaron completos con él."""
+        nuevos: List[Any] = []
+        if self.done or not fragmento:
+            return nuevos
+        self._buffer += fragmento
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer) and not self.done:
+            c = buffer[i]
+            if not self._started:
+                if c == "[":
+                    self._started = True
+                    self._depth = 1
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._emit(self._item_start, i + 1, nuevos)
+            elif c == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    self._item_start = i
+            elif c in "{[":
+                if self._depth == 1 and self._item_start is None:
+                    self._item_start = i
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._item_start is not None:
+                    self._emit(self._item_start, i + 1, nuevos)
+                elif self._depth == 0:
+                    # Fin del array: un escalar pendiente (número, true...) termina aquí
+                    self._emit(self._item_start, i, nuevos)
+                    self.done = True
+            elif self._depth == 1:
+                if c == ",":
+                    self._emit(self._item_start, i, nuevos)
+                elif c not in _ESPACIOS and self._item_start is None:
+                    self._item_start = i
+            i += 1
+        self._pos = i
+        # Lo ya consumido fuera de un elemento no se vuelve a necesitar
+        if self._item_start is None and not self._in_string:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        return nuevos
+
+    def _emit(self, inicio: Optional[int], fin: int, nuevos: List[Any]) -> None:
+        """Decodifica buffer[inicio:fin]; un elemento mal formado se descarta."""
+        self._item_start = None
+        if inicio is None:
+            return
+        texto = self._buffer[inicio:fin].strip()
+        if not texto:
+            return
+        try:
+            valor = json.loads(texto)
+        except ValueError:
+            return
+        nuevos.append(valor)
+        self.items.append(valor)
+
+_CIERRES = {"{": "}", "[": "]"}
+# Caracteres que mueven el estado del lector; el resto del texto se salta de una vez
+_ESPECIALES = re.compile(r'[{}\[\]",]')
+# Resto de una cadena JSON desde su comilla de apertura (respeta los escapes)
+_RESTO_CADENA = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+_DECODER = json.JSONDecoder()
+
+class _Apertura:
+    """Llave o corchete abierto. La pila es una lista enlazada: un corte guarda la cima sin copiarla."""
+    __slots__ = ("posicion", "llave", "padre", "corte")
+
+    def __init__(self, posicion: int, llave: str, padre: Optional["_Apertura"]):
+        self.posicion = posicion
+        self.llave = llave
+        self.padre = padre
+        # Último corte con esta apertura (un objeto) en la cima: (posición, cima)
+        self.corte: Optional[Tuple[int, "_Apertura"]] = None
+
+def extract_json_block(text: str, reparar: bool = True) -> str:
+    """
+    Primer bloque JSON válido ({...} o [...]) del texto, en una sola pasada. Se
+    lleva una pila de aperturas con el estado de cadenas y escapes, así que las
+    llaves dentro de textos no confunden el balance y nunca se vuelve atrás: de
+    los bloques balanceados gana el que empieza primero y se puede leer. Si el
+    texto termina con el bloque abierto (respuesta truncada), se corta en el
+    último elemento completo y se cierran los corchetes pendientes: se pierde el
+    elemento a medias, no toda la respuesta. Con `reparar=False` los bloques
+    abiertos hasta el final se saltan y solo cuentan los bloques completos.
+    """
+    if not text:
+        return ""
+    cima: Optional[_Apertura] = None
+    # Bloques balanceados desde la última vez que la pila quedó vacía: (inicio, fin)
+    cerrados: List[Tuple[int, int]] = []
+    # Último corte con una lista en la cima: vale para todas las aperturas que tiene debajo
+    corte_lista: Optional[Tuple[int, _Apertura]] = None
+    i = 0
+    while True:
+        encontrado = _ESPECIALES.search(text, i)
+        if encontrado is None:
+            break
+        i = encontrado.start()
+        c = text[i]
+        if c in _CIERRES:
+            cima = _Apertura(i, c, cima)
+        elif cima is None:
+            pass  # Fuera de un bloque solo cuentan las aperturas
+        elif c == '"':
+            cadena = _RESTO_CADENA.match(text, i + 1)
+            if cadena is None:
+                break  # Cadena abierta hasta el final: respuesta truncada
+            i = cadena.end()
+            continue
+        elif c == ",":
+            if cima.llave == "[":
+                corte_lista = (i, cima)
+            else:
+                cima.corte = (i, cima)
+        else:
+            # Un cierre que no corresponde descarta las aperturas que deja sin cerrar
+            while cima is not None and _CIERRES[cima.llave] != c:
+                cima = cima.padre
+            if cima is not None:
+                cerrados.append((cima.posicion, i + 1))
+                cima = cima.padre
+                if cima is not None and cima.llave == "[":
+                    corte_lista = (i + 1, cima)
+                elif cima is not None:
+                    cima.corte = (i + 1, cima)
+            if cima is None:
+                bloque = _first_valid(text, cerrados)
+                if bloque:
+                    return bloque
+                cerrados = []
+        i += 1
+
+    # Texto terminado con aperturas sin cerrar: compiten con los bloques cerrados dentro de ellas
+    candidatos: List[Tuple[int, int, Optional[_Apertura]]] = [(a, b, None) for a, b in cerrados]
+    while cima is not None:
+        candidatos.append((cima.posicion, 0, cima))
+        cima = cima.padre
+    for inicio, fin, apertura in sorted(candidatos, key=lambda candidato: candidato[0]):
+        if apertura is None:
+            if _valid_span(text, inicio, fin):
+                return text[inicio:fin]
+        elif reparar:
+            reparado = _repair(text, apertura, corte_lista)
+            if reparado:
+                return reparado
+    return ""
+
+def _first_valid(text: str, bloques: List[Tuple[int, int]]) -> str:
+    """El bloque que empieza primero y se puede leer (los bloques llegan en orden de cierre)."""
+    for inicio, fin in sorted(bloques):
+        if _valid_span(text, inicio, fin):
+            return text[inicio:fin]
+    return ""
+
+def _valid_span(text: str, inicio: int, fin: int) -> bool:
+    """True si text[inicio:fin] es JSON; se lee en el lugar, sin copiar el texto."""
+    try:
+        return _DECODER.raw_decode(text, inicio)[1] == fin
+    except ValueError:
+        return False
+
+def _repair(text: str, apertura: _Apertura, corte_lista: Optional[Tuple[int, _Apertura]]) -> str:
+    """
+    Bloque truncado desde `apertura` cortado en su último elemento completo: entre
+    elementos de una lista o entre claves del objeto exterior, nunca dentro de un
+    objeto anidado. "" si no hay corte o el resultado no es JSON.
+    """
+    cortes = [apertura.corte]
+    if corte_lista is not None and corte_lista[0] > apertura.posicion:
+        cortes.append(corte_lista)
+    cortes = [corte for corte in cortes if corte is not None]
+    if not cortes:
+        return ""
+    posicion, nodo = max(cortes, key=lambda corte: corte[0])
+    cierres = []
+    while nodo is not apertura:
+        cierres.append(_CIERRES[nodo.llave])
+        nodo = nodo.padre
+    cierres.append(_CIERRES[apertura.llave])
+    reparado = text[apertura.posicion:posicion] + "".join(cierres)
+    return reparado if _loads_ok(reparado) else ""
+
+def _loads_ok(texto: str) -> bool:
+    try:
+        json.loads(texto)
+        return True
+    except ValueError:
+        return False
@@ -0,0 +1,140 @@
+# persistent_cache.py
+"""
+Cache persistente en disco (SQLite) compartido entre sesiones, procesos y reinicios.
+Cuando supera el tamaño máximo expulsa las entradas usadas hace más tiempo (LRU);
+opcionalmente las entradas caducan un tiempo después de guardadas (TTL). Los
+contadores de aciertos se pueden separar por grupo (por ejemplo, páginas sueltas).
+"""
+
+import hashlib
+import itertools
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+# Escrituras entre revisiones del tamaño total y de la caducidad (cada revisión recorre
+# la tabla); entre una y otra el cache puede pasarse del máximo en esas pocas entradas
+EVICT_EVERY = 32
+
+def content_digest(data) -> str:
+    """Huella rápida del contenido (BLAKE2b de 128 bits) para usar como clave."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+class PersistentCache:
+    """Cache clave → texto con expulsión LRU por tamaño, caducidad opcional y contadores de aciertos."""
+
+    def __init__(self, path: str, max_bytes: int, ttl: Optional[float] = None, evict_every: int = EVICT_EVERY):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl  # Segundos de vida de cada entrada; None = no caduca
+        self.evict_every = max(evict_every, 1)
+        self._writes = itertools.count()  # La primera escritura de cada proceso también revisa
+        self._local = threading.local()  # sqlite3 no comparte conexiones entre hilos
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # Un proceso hijo (fork) no puede reutilizar la conexión del padre
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_access REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(last_access)")
+            try:
+                # Bases creadas antes de la caducidad no tienen la columna
+                conn.execute("ALTER TABLE entries ADD COLUMN created REAL")
+            except sqlite3.OperationalError:
+                pass
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, conn: sqlite3.Connection, name: str, group: str = "") -> None:
+        if group:
+            name = f"{group}:{name}"
+        conn.execute("INSERT INTO counters (name, value) VALUES (?, 1) "
+                     "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+
+    def get(self, key: str, group: str = "") -> Optional[str]:
+        """Devuelve el texto guardado o None; un error de disco cuenta como fallo."""
+        entry = self.get_entry(key, group)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, key: str, group: str = "") -> Optional[Tuple[str, float]]:
+        """Como `get`, pero devuelve también cuándo se guardó la entrada (epoch; 0 si no se sabe)."""
+        try:
+            conn = self._connect()
+            row = conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            ahora = time.time()
+            if row is not None and self.ttl is not None and (row[1] or 0) < ahora - self.ttl:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._count(conn, "expired", group)
+                row = None
+            if row is None:
+                self._count(conn, "misses", group)
+                return None
+            conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (ahora, key))
+            self._count(conn, "hits", group)
+            return zlib.decompress(row[0]).decode("utf-8"), row[1] or 0.0
+        except (sqlite3.Error, zlib.error):
+            return None
+
+    def set(self, key: str, value: str) -> None:
+        """Guarda el texto; cada `evict_every` escrituras expulsa entradas antiguas si se supera el tamaño máximo."""
+        blob = zlib.compress(value.encode("utf-8"), 1)
+        ahora = time.time()
+        try:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO entries (key, value, size, last_access, created) VALUES (?, ?, ?, ?, ?)",
+                         (key, blob, len(blob), ahora, ahora))
+            if next(self._writes) % self.evict_every == 0:
+                self._evict(conn)
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        if self.ttl is not None:
+            conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,))
+        excess = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0] - self.max_bytes
+        if excess <= 0:
+            return
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            if excess <= 0:
+                break
+            doomed.append((key,))
+            excess -= size
+        conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+
+    def stats(self, group: str = "") -> Dict[str, Any]:
+        """Aciertos, fallos y ocupación acumulados por todos los procesos (contadores del grupo)."""
+        try:
+            conn = self._connect()
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        except sqlite3.Error:
+            counters, entries, size = {}, 0, 0
+        prefijo = f"{group}:" if group else ""
+        hits, misses = counters.get(f"{prefijo}hits", 0), counters.get(f"{prefijo}misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "expired": counters.get(f"{prefijo}expired", 0),
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def clear(self) -> None:
+        """Elimina todas las entradas y reinicia los contadores."""
+        try:
+            conn = self._connect()
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM counters")
+        except sqlite3.Error:
+            pass
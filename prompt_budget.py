@@ -0,0 +1,202 @@
+# prompt_budget.py
+"""
+Empaquetado del documento en el prompt según un presupuesto de tokens por tarea.
+En lugar de enviar los primeros N caracteres (que cortan oraciones y dejan fuera
+las peticiones, casi siempre al final), se eligen las secciones del documento que
+más valen para la tarea hasta llenar el presupuesto, se recorta en fin de oración
+y se informa qué quedó por fuera.
+"""
+
+import math
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from document_processor import DocumentIndex, build_document_index
+
+# Caracteres por token en español cuando el modelo aún no se ha calibrado
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+# Por debajo de este presupuesto restante no vale la pena enviar un trozo de sección
+MIN_FRAGMENT_TOKENS = 40
+
+# Marca entre partes no contiguas del documento
+_OMISION = "\n[...]\n"
+
+# Parte del presupuesto para el inicio cuando el documento no tiene secciones; el resto va al final
+_SIN_SECCIONES_INICIO = 0.7
+
+_chars_per_token: Dict[str, float] = {}
+_calibration_lock = threading.Lock()
+
+def chars_per_token(modelo: Optional[str]) -> float:
+    """Relación caracteres/token calibrada para el modelo (o la de referencia)."""
+    return _chars_per_token.get(modelo or "", DEFAULT_CHARS_PER_TOKEN)
+
+def is_calibrated(modelo: Optional[str]) -> bool:
+    return (modelo or "") in _chars_per_token
+
+def calibrate(modelo: str, muestra: str, contar: Callable[[str], int]) -> None:
+    """
+    Ajusta la relación caracteres/token del modelo con un conteo real (por ejemplo
+    `model.count_tokens`) sobre una muestra; si el conteo falla se deja la de referencia.
+    """
+    with _calibration_lock:
+        if modelo in _chars_per_token or not muestra:
+            return
+        try:
+            tokens = contar(muestra)
+        except Exception:
+            tokens = 0
+        # Si el conteo falla se fija la relación de referencia para no reintentar en cada prompt
+        _chars_per_token[modelo] = len(muestra) / tokens if tokens > 0 else DEFAULT_CHARS_PER_TOKEN
+
+def estimate_tokens(texto: str, modelo: Optional[str] = None) -> int:
+    """Tokens estimados del texto con la relación calibrada del modelo."""
+    return math.ceil(len(texto) / chars_per_token(modelo)) if texto else 0
+
+class PackedDocument:
+    """Texto empaquetado para un prompt y el informe de lo que se envió y lo que se cortó."""
+
+    def __init__(self, texto: str, tokens: int, presupuesto: int, incluidas: List[str],
+                 recortadas: Dict[str, int], omitidas: List[str]):
+        self.texto = texto
+        self.tokens = tokens
+        self.presupuesto = presupuesto
+        self.incluidas = incluidas  # Secciones enviadas completas
+        self.recortadas = recortadas  # Sección → tokens que se dejaron por fuera
+        self.omitidas = omitidas  # Secciones que no cupieron
+
+    @property
+    def complete(self) -> bool:
+        return not self.recortadas and not self.omitidas
+
+    def summary(self) -> str:
+        """Resumen corto para mostrar en la interfaz."""
+        partes = [f"{self.tokens}/{self.presupuesto} tokens"]
+        if self.recortadas:
+            partes.append("recortado: " + ", ".join(f"{nombre} (-{tokens})" for nombre, tokens in self.recortadas.items()))
+        if self.omitidas:
+            partes.append("omitido: " + ", ".join(self.omitidas))
+        if self.complete:
+            partes.append("documento completo")
+        return "; ".join(partes)
+
+def pack_document(texto: str, presupuesto: int, prioridades: Sequence[str],
+                  modelo: Optional[str] = None) -> PackedDocument:
+    """
+    Llena `presupuesto` tokens con las secciones del documento en el orden de
+    `prioridades` (las no listadas van al final). Una sección que no cabe entera
+    se recorta en fin de oración; el resultado conserva el orden del documento.
+    """
+    indice = build_document_index(texto)
+    total = estimate_tokens(texto, modelo)
+    if total <= presupuesto:
+        return PackedDocument(texto, total, presupuesto, list(indice.sections), {}, [])
+
+    ratio = chars_per_token(modelo)
+    if len(indice.sections) == 1:
+        # Sin secciones reconocibles: inicio y final del texto, donde suelen estar
+        # el destinatario y las peticiones
+        limite_inicio = int(presupuesto * _SIN_SECCIONES_INICIO * ratio)
+        fin_inicio = indice.cut(0, limite_inicio)
+        inicio_final = len(texto) - int(presupuesto * ratio) + fin_inicio
+        # El final arranca en el siguiente inicio de oración
+        i = bisect_left(indice.sentence_ends, inicio_final)
+        if i < len(indice.sentence_ends):
+            inicio_final = indice.sentence_ends[i]
+        rangos = [(0, fin_inicio), (max(inicio_final, fin_inicio), len(texto))]
+        empaquetado = _join(texto, rangos)
+        nombre = next(iter(indice.sections))
+        cortados = total - estimate_tokens(empaquetado, modelo)
+        return PackedDocument(empaquetado, estimate_tokens(empaquetado, modelo), presupuesto,
+                              [], {nombre: max(cortados, 0)}, [])
+
+    orden = [nombre for nombre in prioridades if nombre in indice.sections]
+    orden += [nombre for nombre in indice.sections if nombre not in orden]
+    restante = presupuesto
+    rangos: List[Tuple[int, int]] = []
+    incluidas: List[str] = []
+    recortadas: Dict[str, int] = {}
+    omitidas: List[str] = []
+    for nombre in orden:
+        inicio, fin = indice.sections[nombre]
+        tokens = estimate_tokens(texto[inicio:fin], modelo)
+        if tokens <= restante:
+            rangos.append((inicio, fin))
+            incluidas.append(nombre)
+            restante -= tokens
+        elif restante >= MIN_FRAGMENT_TOKENS:
+            corte = indice.cut(inicio, inicio + int(restante * ratio))
+            usados = estimate_tokens(texto[inicio:corte], modelo)
+            rangos.append((inicio, corte))
+            recortadas[nombre] = tokens - usados
+            restante -= usados
+        else:
+            omitidas.append(nombre)
+    empaquetado = _join(texto, sorted(rangos))
+    return PackedDocument(empaquetado, presupuesto - restante, presupuesto, incluidas, recortadas, omitidas)
+
+class DocumentChunk:
+    """Fragmento contiguo del documento para el análisis por partes (map-reduce)."""
+
+    def __init__(self, texto: str, inicio: int, secciones: List[str], linea_inicial: int):
+        self.texto = texto
+        self.inicio = inicio  # Posición en el documento
+        self.secciones = secciones  # Secciones que abarca, en orden
+        self.linea_inicial = linea_inicial  # Línea del documento donde empieza (desde 1)
+
+def split_document(texto: str, presupuesto: int, modelo: Optional[str] = None,
+                   max_fragmentos: Optional[int] = None) -> List[DocumentChunk]:
+    """
+    Parte el documento en fragmentos de hasta `presupuesto` tokens siguiendo los
+    límites de sección: las secciones contiguas se agrupan mientras quepan y una
+    sección más grande se divide en fin de oración. Un documento que cabe entero
+    da un solo fragmento. Con `max_fragmentos` el presupuesto crece lo necesario
+    para no pasar de ese número.
+    """
+    indice = build_document_index(texto)
+    while True:
+        fragmentos = _split(texto, indice, max(int(presupuesto * chars_per_token(modelo)), 1))
+        if not max_fragmentos or len(fragmentos) <= max_fragmentos:
+            return fragmentos
+        presupuesto = math.ceil(presupuesto * len(fragmentos) / max_fragmentos)
+
+def _split(texto: str, indice: DocumentIndex, limite: int) -> List[DocumentChunk]:
+    """Fragmentos de a lo sumo `limite` caracteres (ver `split_document`)."""
+    # Rangos de a lo sumo `limite` caracteres, cada uno con su sección
+    piezas: List[Tuple[int, int, str]] = []
+    for nombre, (inicio, fin) in sorted(indice.sections.items(), key=lambda item: item[1]):
+        while fin - inicio > limite:
+            corte = indice.cut(inicio, inicio + limite)
+            piezas.append((inicio, corte, nombre))
+            inicio = corte
+        if fin > inicio:
+            piezas.append((inicio, fin, nombre))
+    if not piezas:
+        return []
+
+    fragmentos: List[DocumentChunk] = []
+    actual: List[Tuple[int, int, str]] = []
+    for pieza in piezas + [None]:
+        if pieza is not None and (not actual or pieza[1] - actual[0][0] <= limite):
+            actual.append(pieza)
+            continue
+        inicio, fin = actual[0][0], actual[-1][1]
+        secciones = list(dict.fromkeys(nombre for _, _, nombre in actual))
+        if texto[inicio:fin].strip():
+            fragmentos.append(DocumentChunk(texto[inicio:fin], inicio, secciones, indice.line_number(inicio)))
+        actual = [pieza] if pieza is not None else []
+    return fragmentos
+
+def _join(texto: str, rangos: List[Tuple[int, int]]) -> str:
+    """Une los rangos en orden; entre partes no contiguas se marca la omisión."""
+    partes = []
+    anterior = 0
+    for inicio, fin in rangos:
+        if fin <= inicio:
+            continue
+        if partes and inicio > anterior:
+            partes.append(_OMISION)
+        partes.append(texto[inicio:fin])
+        anterior = fin
+    return "".join(partes).strip()
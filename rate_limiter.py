@@ -0,0 +1,227 @@
+# rate_limiter.py
+"""
+Límite de solicitudes y tokens por minuto para las llamadas a Gemini, compartido por
+todas las sesiones del proceso. Cada llamada reserva una solicitud y sus tokens
+estimados en dos cubetas (token bucket) que se recargan de forma continua; si no
+alcanza, espera y avisa cuánto falta. Ante un error de cuota (429) se reintenta con
+espera exponencial con jitter, respetando el tiempo que indique la API, y la espera
+se aplica a todos los que están en cola. Si la espera supera el máximo o se agotan
+los reintentos se lanza `QuotaExceededError` en lugar de responder con el fallback.
+Cada llamada puede indicar su grupo (la sesión que la hizo), para que cada sesión
+vea solo la espera de sus propias llamadas.
+"""
+
+import asyncio
+import itertools
+import random
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+try:
+    # Errores 429 de la API de Google (ResourceExhausted es la subclase de cuota de gRPC)
+    from google.api_core.exceptions import ResourceExhausted, TooManyRequests
+except ImportError:  # Sin google-api-core solo se reconoce QuotaExceededError
+    ResourceExhausted = TooManyRequests = None
+
+T = TypeVar("T")
+
+# Pistas de espera que trae el mensaje de error de la API
+_RETRY_PATTERNS = (
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)"),
+    re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE),
+    re.compile(r"retry-after:?\s*([\d.]+)", re.IGNORECASE),
+)
+
+class QuotaExceededError(Exception):
+    """Cuota de Gemini agotada más allá de lo que vale la pena esperar."""
+
+    def __init__(self, mensaje: str, retry_after: Optional[float] = None):
+        super().__init__(f"Cuota de Google Gemini excedida: {mensaje}")
+        self.retry_after = retry_after
+
+def is_quota_error(error: BaseException) -> bool:
+    """
+    True si el error es un 429 de la API (TooManyRequests / ResourceExhausted). Se decide
+    por el tipo, no por el mensaje: un error cualquiera que mencione "quota" no se reintenta.
+    """
+    if isinstance(error, QuotaExceededError):
+        return True
+    return TooManyRequests is not None and isinstance(error, (ResourceExhausted, TooManyRequests))
+
+def retry_after_hint(error: BaseException) -> Optional[float]:
+    """Segundos de espera que sugiere la API en el error, si los indica."""
+    for atributo in ("retry_after", "retry_delay"):
+        valor = getattr(error, atributo, None)
+        if isinstance(valor, (int, float)) and valor > 0:
+            return float(valor)
+    mensaje = str(error)
+    for patron in _RETRY_PATTERNS:
+        encontrado = patron.search(mensaje)
+        if encontrado:
+            return float(encontrado.group(1))
+    return None
+
+class TokenBucket:
+    """Cubeta con `capacidad` unidades que se recarga a `por_minuto` unidades por minuto."""
+
+    def __init__(self, por_minuto: float):
+        self.capacidad = float(por_minuto)
+        self.tasa = por_minuto / 60.0
+        self.disponible = float(por_minuto)
+        self._ultima = time.monotonic()
+
+    def _refill(self, ahora: float) -> None:
+        self.disponible = min(self.capacidad, self.disponible + (ahora - self._ultima) * self.tasa)
+        self._ultima = ahora
+
+    def wait_for(self, unidades: float, ahora: float) -> float:
+        """Segundos hasta que haya `unidades` (0 si ya las hay). Un pedido mayor que la cubeta espera a llenarla."""
+        self._refill(ahora)
+        faltan = min(unidades, self.capacidad) - self.disponible
+        return max(faltan, 0.0) / self.tasa
+
+    def take(self, unidades: float) -> None:
+        self.disponible -= min(unidades, self.capacidad)
+
+class RateLimiter:
+    """Solicitudes y tokens por minuto con reintentos ante errores de cuota."""
+
+    def __init__(self, rpm: int, tpm: int, max_wait: float = 60.0, max_retries: int = 4,
+                 base_backoff: float = 2.0):
+        self.solicitudes = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self._pausa_hasta = 0.0  # Espera impuesta por la API tras un 429, para todos
+        # Llamada en espera → (grupo, momento en que podrá salir)
+        self._en_cola: Dict[int, Tuple[Optional[Hashable], float]] = {}
+        self._turnos = itertools.count()
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.waited_seconds = 0.0
+        self.retries = 0
+        self.rejections = 0
+
+    def _reserve(self, tokens: int, espera_total: float) -> float:
+        """Reserva si hay cupo (devuelve 0) o devuelve cuántos segundos esperar."""
+        with self._lock:
+            ahora = time.monotonic()
+            espera = max(self._pausa_hasta - ahora,
+                         self.solicitudes.wait_for(1, ahora),
+                         self.tokens.wait_for(tokens, ahora))
+            if espera <= 0:
+                self.solicitudes.take(1)
+                self.tokens.take(tokens)
+                return 0.0
+            if espera_total + espera > self.max_wait:
+                self.rejections += 1
+                raise QuotaExceededError(f"límite de solicitudes alcanzado, habría que esperar {espera:.0f} s más",
+                                         retry_after=espera)
+            return espera
+
+    def _backoff(self, intento: int, error: BaseException) -> float:
+        """Espera antes del reintento: la que indique la API o exponencial con jitter; pausa a toda la cola."""
+        sugerida = retry_after_hint(error)
+        espera = sugerida if sugerida is not None else self.base_backoff * (2 ** intento)
+        espera += random.uniform(0, espera * 0.25)
+        with self._lock:
+            self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + espera)
+            self.retries += 1
+        return espera
+
+    def _queue(self, clave: int, espera: float, esperado: float, grupo: Optional[Hashable] = None) -> float:
+        """Anota la llamada en la cola (o la saca si `espera` es 0); devuelve cuánto dormir ahora."""
+        with self._lock:
+            if espera <= 0:
+                self._en_cola.pop(clave, None)
+                return 0.0
+            if clave not in self._en_cola and not esperado:
+                self.waits += 1
+            self._en_cola[clave] = (grupo, time.monotonic() + espera)
+            # Esperas cortas para volver a avisar y ver si otro liberó cupo
+            paso = min(espera, 1.0)
+            self.waited_seconds += paso
+            return paso
+
+    def pending_wait(self, grupo: Optional[Hashable] = None) -> float:
+        """Mayor espera restante de las llamadas en cola del grupo, o de todas (0 si no hay ninguna esperando)."""
+        with self._lock:
+            ahora = time.monotonic()
+            return max((hasta - ahora for propio, hasta in self._en_cola.values()
+                        if grupo is None or propio == grupo), default=0.0)
+
+    def _give_up(self, intento: int, error: BaseException) -> None:
+        if intento >= self.max_retries:
+            with self._lock:
+                self.rejections += 1
+            raise QuotaExceededError(f"se agotaron los {self.max_retries} reintentos ({error})",
+                                     retry_after=retry_after_hint(error)) from error
+
+    def call(self, llamada: Callable[[], T], tokens: int,
+             on_wait: Optional[Callable[[float], None]] = None, grupo: Optional[Hashable] = None) -> T:
+        """Ejecuta `llamada` dentro del límite; `on_wait(segundos)` recibe la espera restante."""
+        clave = next(self._turnos)
+        espera_total = 0.0
+        intento = 0
+        try:
+            while True:
+                espera = self._reserve(tokens, espera_total)
+                paso = self._queue(clave, espera, espera_total, grupo)
+                if paso:
+                    if on_wait is not None:
+                        on_wait(espera)
+                    time.sleep(paso)
+                    espera_total += paso
+                    continue
+                try:
+                    return llamada()
+                except Exception as e:
+                    if not is_quota_error(e) or isinstance(e, QuotaExceededError):
+                        raise
+                    self._give_up(intento, e)
+                    self._backoff(intento, e)
+                    intento += 1
+        finally:
+            self._queue(clave, 0, espera_total)
+
+    async def call_async(self, llamada: Callable[[], Awaitable[T]], tokens: int,
+                         grupo: Optional[Hashable] = None) -> T:
+        """Como `call`, sin bloquear el bucle de eventos mientras espera."""
+        clave = next(self._turnos)
+        espera_total = 0.0
+        intento = 0
+        try:
+            while True:
+                espera = self._reserve(tokens, espera_total)
+                paso = self._queue(clave, espera, espera_total, grupo)
+                if paso:
+                    await asyncio.sleep(paso)
+                    espera_total += paso
+                    continue
+                try:
+                    return await llamada()
+                except Exception as e:
+                    if not is_quota_error(e) or isinstance(e, QuotaExceededError):
+                        raise
+                    self._give_up(intento, e)
+                    self._backoff(intento, e)
+                    intento += 1
+        finally:
+            self._queue(clave, 0, espera_total)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ahora = time.monotonic()
+            self.solicitudes._refill(ahora)
+            return {
+                "rpm_available": int(self.solicitudes.disponible),
+                "rpm": int(self.solicitudes.capacidad),
+                "queued": len(self._en_cola),
+                "waits": self.waits,
+                "waited_seconds": round(self.waited_seconds, 1),
+                "retries": self.retries,
+                "rejections": self.rejections,
+            }
@@ -0,0 +1,164 @@
+# semantic_cache.py
+"""
+Cache semántico de preguntas del chat. Los usuarios repiten las mismas preguntas
+con otras palabras ("¿qué normativa debo citar?", "¿qué leyes cito?"): la pregunta
+se normaliza, se vectoriza con TF-IDF (raíces y trigramas de caracteres) y, si se
+parece lo suficiente a una ya respondida para el mismo documento, se reutiliza la
+respuesta sin llamar a la IA. Los números (plazos, leyes, artículos) y las negaciones
+cambian la respuesta legal aunque la pregunta se parezca: deben coincidir exactamente.
+"""
+
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+_STOPWORDS = {
+    "a", "al", "como", "con", "cual", "cuales", "de", "debo", "del", "el", "en", "es", "esta",
+    "este", "hay", "la", "las", "lo", "los", "me", "mi", "mas", "para", "por", "puedo", "que",
+    "se", "ser", "si", "sobre", "son", "su", "sus", "un", "una", "y", "yo", "tengo", "deberia",
+}
+
+# Términos equivalentes en las preguntas sobre derechos de petición
+_SINONIMOS = {
+    "ley": "normativa", "leyes": "normativa", "norma": "normativa", "normas": "normativa",
+    "decreto": "normativa", "decretos": "normativa", "legislacion": "normativa",
+    "contestacion": "respuesta", "contestar": "respuesta", "responder": "respuesta",
+    "termino": "plazo", "terminos": "plazo", "plazos": "plazo",
+    "fallas": "problema", "errores": "problema", "error": "problema", "falencias": "problema",
+    "graves": "critico", "importantes": "critico", "urgentes": "critico",
+}
+
+# Palabras que invierten el sentido de la pregunta
+_NEGACIONES = {"no", "sin", "nunca", "ni", "tampoco", "jamas", "ningun", "ninguna", "ninguno"}
+
+_SUFIJOS = ("aciones", "acion", "mente", "ando", "iendo", "ar", "er", "ir", "as", "es", "os", "o", "a", "e", "s")
+
+def _words(pregunta: str) -> List[str]:
+    """Palabras en minúscula y sin tildes ni signos."""
+    texto = unicodedata.normalize("NFKD", pregunta.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return re.findall(r"[a-z0-9]+", texto)
+
+def exact_terms(pregunta: str) -> frozenset:
+    """Números y negaciones de la pregunta: dos preguntas solo comparten respuesta si coinciden."""
+    return frozenset(palabra for palabra in _words(pregunta) if palabra.isdigit() or palabra in _NEGACIONES)
+
+def normalize_question(pregunta: str) -> List[str]:
+    """Raíces de las palabras con contenido: sin tildes, signos, palabras vacías ni sinónimos."""
+    raices = []
+    for palabra in _words(pregunta):
+        if palabra in _STOPWORDS:
+            continue
+        palabra = _SINONIMOS.get(palabra, palabra)
+        for sufijo in _SUFIJOS:
+            if len(palabra) - len(sufijo) >= 3 and palabra.endswith(sufijo):
+                palabra = palabra[:-len(sufijo)]
+                break
+        raices.append(palabra)
+    return raices
+
+# Palabras que remiten a turnos anteriores del chat ("explica eso", "¿y lo que dijiste antes?")
+_REFERENCIAS = {
+    "eso", "esto", "ese", "esa", "esos", "esas", "aquello", "aquel", "aquella", "anterior", "anteriores",
+    "anteriormente", "antes", "previo", "previa", "dijiste", "mencionaste", "mencionado", "mencionada",
+    "comentaste", "explicaste", "indicaste", "respondiste", "sugeriste", "ultimo", "ultima", "ello",
+    "amplia", "ampliar", "profundiza", "profundizar", "continua", "continuar",
+    "tambien", "entonces", "otro", "otra", "otros", "otras",
+}
+
+def refers_to_history(pregunta: str) -> bool:
+    """
+    True si la respuesta depende de la conversación y no solo del documento: la pregunta
+    remite a turnos anteriores, empieza continuando otra ("¿y el plazo?") o es tan corta
+    que no se entiende sola. Esas preguntas no usan el cache semántico.
+    """
+    palabras = _words(pregunta)
+    if not palabras or palabras[0] == "y" or any(palabra in _REFERENCIAS for palabra in palabras):
+        return True
+    return len(normalize_question(pregunta)) < 2
+
+def _features(raices: List[str]) -> Counter:
+    """Términos del vector: cada raíz y sus trigramas de caracteres (tolera variantes y erratas)."""
+    terminos = Counter(raices)
+    for raiz in raices:
+        marcada = f"#{raiz}#"
+        terminos.update(marcada[i:i + 3] for i in range(len(marcada) - 2))
+    return terminos
+
+class SemanticCache:
+    """
+    Respuestas del chat agrupadas por documento. Compartido por todas las sesiones;
+    `threshold` es la similitud coseno mínima (0-1) para servir una respuesta guardada.
+    El vector de cada pregunta se calcula al guardarla (con la frecuencia de términos
+    de ese momento); la consulta solo vectoriza la pregunta nueva.
+    """
+
+    def __init__(self, threshold: float, max_entries_per_scope: int = 200):
+        self.threshold = threshold
+        self.max_entries_per_scope = max_entries_per_scope
+        # Alcance → [(pregunta, vector, norma, términos exactos, respuesta)]
+        self._scopes: Dict[str, List[Tuple[str, Dict[str, float], float, frozenset, str]]] = {}
+        self._df: Dict[str, Counter] = {}  # Alcance → en cuántas preguntas guardadas aparece cada término
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _vector(terminos: Counter, df: Counter, total: int) -> Tuple[Dict[str, float], float]:
+        """Pesos TF-IDF con la frecuencia de documentos de las preguntas del mismo documento, y su norma."""
+        vector = {termino: tf * (math.log((1 + total) / (1 + df[termino] + 1)) + 1)
+                  for termino, tf in terminos.items()}
+        return vector, math.sqrt(sum(peso * peso for peso in vector.values()))
+
+    def lookup(self, scope: str, pregunta: str) -> Optional[Tuple[str, float]]:
+        """Respuesta guardada más parecida y su similitud, o None si ninguna alcanza el umbral."""
+        terminos = _features(normalize_question(pregunta))
+        exactos = exact_terms(pregunta)
+        with self._lock:
+            entradas = list(self._scopes.get(scope, []))
+            consulta, norma = self._vector(terminos, self._df.get(scope, Counter()), len(entradas) + 1)
+        mejor: Optional[Tuple[str, float]] = None
+        if norma:
+            for _, otro, otra_norma, otros_exactos, respuesta in entradas:
+                if otros_exactos != exactos or not otra_norma:
+                    continue
+                producto = sum(peso * otro[termino] for termino, peso in consulta.items() if termino in otro)
+                similitud = producto / (norma * otra_norma)
+                if similitud >= self.threshold and (mejor is None or similitud > mejor[1]):
+                    mejor = (respuesta, similitud)
+        with self._lock:
+            if mejor is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return mejor
+
+    def store(self, scope: str, pregunta: str, respuesta: str) -> None:
+        """Guarda la respuesta con su vector; si el documento ya tiene muchas, sale la más antigua."""
+        terminos = _features(normalize_question(pregunta))
+        if not terminos or not respuesta:
+            return
+        with self._lock:
+            entradas = self._scopes.setdefault(scope, [])
+            df = self._df.setdefault(scope, Counter())
+            df.update(terminos.keys())
+            vector, norma = self._vector(terminos, df, len(entradas) + 1)
+            entradas.append((pregunta, vector, norma, exact_terms(pregunta), respuesta))
+            for _, viejo, _, _, _ in entradas[:-self.max_entries_per_scope]:
+                df.subtract(viejo.keys())
+            del entradas[:-self.max_entries_per_scope]
+
+    def stats(self) -> Dict[str, Any]:
+        """Aciertos, fallos y preguntas guardadas."""
+        with self._lock:
+            guardadas = sum(len(entradas) for entradas in self._scopes.values())
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": guardadas,
+        }
@@ -0,0 +1,92 @@
+# speculative_executor.py
+"""
+Ejecución especulativa del siguiente paso del flujo. Cuando termina un paso se
+lanza el siguiente en segundo plano; si el usuario pulsa el botón con las mismas
+entradas, el resultado ya está listo (o en camino) y no se paga la espera completa.
+Los hilos se comparten entre sesiones, así que cada sesión tiene un máximo de
+tareas en curso: una sesión no puede acaparar los hilos de las demás.
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+from persistent_cache import content_digest
+
+SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", "4"))
+SPECULATIVE_MAX_PER_SESSION = int(os.getenv("SPECULATIVE_MAX_PER_SESSION", "1"))
+
+# Hilos compartidos por todas las sesiones; las tareas solo llaman al analizador,
+# nunca a st.* (no tienen contexto de script de Streamlit)
+_prefetch_pool = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="prefetch")
+
+def speculation_key(*entradas: Any) -> str:
+    """Huella de las entradas de un paso: si cambian, la especulación no sirve."""
+    return content_digest(json.dumps(entradas, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+
+class SpeculativeExecutor:
+    """Futuros especulativos de una sesión, uno por paso, guardado en session_state."""
+
+    def __init__(self, max_running: int = SPECULATIVE_MAX_PER_SESSION):
+        self.max_running = max_running
+        self._futures: Dict[str, Tuple[str, Future]] = {}
+        # Tareas de la sesión en el pool (también las reemplazadas que ya no se pueden cancelar)
+        self._running: Set[Future] = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0  # Especulaciones no lanzadas por el máximo de la sesión
+
+    @property
+    def running(self) -> int:
+        with self._lock:
+            return len(self._running)
+
+    def _finished(self, future: Future) -> None:
+        with self._lock:
+            self._running.discard(future)
+
+    def prefetch(self, paso: str, fn: Callable, *args: Any) -> None:
+        """
+        Lanza `fn(*args)` en segundo plano; reemplaza una especulación anterior del paso.
+        Si la sesión ya tiene `max_running` tareas en curso no se lanza (el paso se
+        calculará al pulsar el botón).
+        """
+        clave = speculation_key(*args)
+        anterior = self._futures.get(paso)
+        if anterior is not None:
+            if anterior[0] == clave:
+                return
+            anterior[1].cancel()
+            del self._futures[paso]
+        with self._lock:
+            if len(self._running) >= self.max_running:
+                self.skipped += 1
+                return
+            future = _prefetch_pool.submit(fn, *args)
+            self._running.add(future)
+        future.add_done_callback(self._finished)
+        self._futures[paso] = (clave, future)
+
+    def take(self, paso: str, *args: Any) -> Optional[Future]:
+        """Futuro especulado del paso si las entradas coinciden; si no, None (cuenta como fallo)."""
+        clave, future = self._futures.pop(paso, (None, None))
+        if future is not None and clave == speculation_key(*args) and not future.cancelled():
+            self.hits += 1
+            return future
+        self.misses += 1
+        return None
+
+    def result(self, paso: str, fn: Callable, *args: Any) -> Any:
+        """Resultado del paso: el especulado si las entradas coinciden, si no se calcula ahora."""
+        future = self.take(paso, *args)
+        if future is not None:
+            return future.result()
+        return fn(*args)
+
+    def discard(self) -> None:
+        """Descarta todas las especulaciones (por ejemplo, al cambiar de documento)."""
+        for _, future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
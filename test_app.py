@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar el flujo de la aplicación con Streamlit AppTest
+(sin red: el analizador local o un modelo falso responden)
+"""
+
+import io
+import json
+import os
+import tempfile
+
+# Caches aparte y subidas siempre volcadas a disco
+os.environ["EXTRACTION_CACHE_DIR"] = tempfile.mkdtemp()
+os.environ["LLM_CACHE_DIR"] = tempfile.mkdtemp()
+os.environ["SPOOL_MAX_MEMORY_MB"] = "0"
+os.environ["GEMINI_TOKEN_CALIBRATION"] = "false"
+
+import docx
+from streamlit.testing.v1 import AppTest
+from ai_analyzer import ANALYSIS_SCHEMA, PROBLEMS_SCHEMA, RECOMMENDATIONS_SCHEMA, AIAnalyzer
+from ai_analyzer_simple import SimpleAIAnalyzer
+from document_processor import DOCX_MIME, process_document_lazy, spool_upload
+
+class ArchivoSubido:
+    """Lo que usa el procesador de un UploadedFile de Streamlit: nombre, tipo y contenido."""
+    def __init__(self, contenido: bytes, name: str, type: str):
+        self.contenido = contenido
+        self.name = name
+        self.type = type
+
+    def getvalue(self) -> bytes:
+        return self.contenido
+
+def _crear_docx(texto: str) -> bytes:
+    documento = docx.Document()
+    documento.add_paragraph(texto)
+    salida = io.BytesIO()
+    documento.save(salida)
+    return salida.getvalue()
+
+PROBLEMAS = [{"tipo": "FORMAL", "descripcion": "Falta número de radicado", "severidad": "ALTA", "linea": "1"}]
+RECOMENDACIONES = [{"titulo": "Agregar radicado", "descripcion": "Incluir el número de radicado",
+                    "prioridad": "ALTA", "accion": "Editar encabezado"}]
+
+class Respuesta:
+    def __init__(self, text):
+        self.text = text
+
+class ModeloFalso:
+    """Responde según el esquema de salida pedido y cuenta las llamadas de cada tarea."""
+    model_name = "modelo-prueba-app"
+
+    def __init__(self):
+        self.llamadas = []
+
+    def generate_content(self, prompt, stream=False, generation_config=None, **kwargs):
+        esquema = getattr(generation_config, "response_schema", None)
+        tarea, datos = {id(ANALYSIS_SCHEMA): ("analisis", {"tipo_documento": "Derecho de Petición"}),
+                        id(PROBLEMS_SCHEMA): ("problemas", PROBLEMAS),
+                        id(RECOMMENDATIONS_SCHEMA): ("recomendaciones", RECOMENDACIONES)}[id(esquema)]
+        self.llamadas.append((tarea, stream))
+        texto = json.dumps(datos, ensure_ascii=False)
+        return iter([Respuesta(texto[:10]), Respuesta(texto[10:])]) if stream else Respuesta(texto)
+
+    def start_chat(self, history=None):
+        return ChatFalso(self)
+
+class ChatFalso:
+    """Sesión de chat que responde en tres fragmentos."""
+    FRAGMENTOS = ["Cite el artículo 23 ", "de la Constitución ", "y la Ley 1755 de 2015."]
+
+    def __init__(self, modelo):
+        self.modelo = modelo
+        self.history = []
+
+    def send_message(self, pregunta, stream=False, **kwargs):
+        self.modelo.llamadas.append(("chat", stream))
+        partes = [Respuesta(fragmento) for fragmento in self.FRAGMENTOS]
+        return iter(partes) if stream else Respuesta("".join(self.FRAGMENTOS))
+
+def _analizador() -> AIAnalyzer:
+    analizador = AIAnalyzer(api_key="clave-de-prueba")
+    analizador.model = ModeloFalso()
+    return analizador
+
+def _app(**estado) -> AppTest:
+    """App ya inicializada con el estado de sesión indicado."""
+    app = AppTest.from_file("app.py", default_timeout=60)
+    app.run()
+    for clave, valor in estado.items():
+        app.session_state[clave] = valor
+    app.run()
+    assert not app.exception, [e.value for e in app.exception]
+    return app
+
+def _boton(app: AppTest, etiqueta: str):
+    return app.button[[boton.label for boton in app.button].index(etiqueta)]
+
+def test_forget_document_removes_spool():
+    """Prueba que reiniciar el proceso elimine el temporal en disco de la subida"""
+    print("🧪 Probando limpieza del archivo subido volcado a disco...")
+    source = spool_upload(ArchivoSubido(_crear_docx("Solicito copia del expediente 123."), "peticion.docx", DOCX_MIME))
+    assert source.path is not None and os.path.exists(source.path)
+    documento = process_document_lazy(source)
+    assert documento.full_text() == "Solicito copia del expediente 123."
+
+    app = _app(uploaded_file=source, document=documento, current_step=5,
+               ai_analyzer=SimpleAIAnalyzer(), ai_connected=True)
+    _boton(app, "🔄 Reiniciar Proceso").click().run()
+    assert not app.exception, [e.value for e in app.exception]
+    assert app.session_state.uploaded_file is None and app.session_state.current_step == 1
+    assert not os.path.exists(source.path)
+    print("✅ forget_document cierra la subida y borra el temporal")
+
+def test_prefetch_accounting():
+    """Prueba que el paso anticipado se aproveche (acierto) y que sin él se calcule al pulsar (fallo)"""
+    print("🧪 Probando pasos anticipados de la aplicación...")
+    analizador = _analizador()
+    texto = "Señores Alcaldía. Solicito copia del expediente 456 sobre el contrato de obra."
+    app = _app(ai_analyzer=analizador, ai_connected=True, document_text=texto, current_step=2)
+    app.button(key="start_analysis").click().run()
+    especulativo = app.session_state.speculative
+    assert app.session_state.analysis_complete and "problems" in especulativo._futures
+
+    app.session_state.current_step = 3
+    app.run()
+    app.button(key="detect_problems").click().run()
+    assert not app.exception, [e.value for e in app.exception]
+    assert app.session_state.problems == PROBLEMAS and "recommendations" in especulativo._futures
+    app.session_state.current_step = 4
+    app.run()
+    app.button(key="generate_recommendations").click().run()
+    assert not app.exception, [e.value for e in app.exception]
+    assert app.session_state.recommendations[0]["titulo"] == "Agregar radicado"
+    assert (especulativo.hits, especulativo.misses) == (2, 0)
+    assert analizador.model.llamadas == [("analisis", False), ("problemas", False), ("recomendaciones", False)]
+    print(f"✅ Problemas y recomendaciones anticipados: {especulativo.hits} aciertos, una llamada por paso")
+
+    # Con otro análisis en la sesión la especulación no sirve: se detecta al pulsar, en streaming
+    analizador = _analizador()
+    app = _app(ai_analyzer=analizador, ai_connected=True, document_text=texto + " Anexo 2.",
+               analysis={"tipo_documento": "Derecho de Petición"}, analysis_complete=True, current_step=3)
+    app.button(key="detect_problems").click().run()
+    assert not app.exception, [e.value for e in app.exception]
+    assert (app.session_state.speculative.hits, app.session_state.speculative.misses) == (0, 1)
+    assert app.session_state.problems == PROBLEMAS and analizador.model.llamadas[0] == ("problemas", True)
+    print("✅ Sin paso anticipado cuenta como fallo y los problemas llegan en streaming")
+
+def test_chat_streaming():
+    """Prueba que el chat pida la respuesta en streaming y la muestre con st.write_stream"""
+    print("🧪 Probando chat en streaming...")
+    analizador = _analizador()
+    app = _app(ai_analyzer=analizador, ai_connected=True, current_step=5,
+               document_text="Señores Alcaldía. Solicito información sobre el impuesto predial.")
+    app.text_input(key="chat_input").input("¿Qué normativa debo citar en la respuesta?")
+    _boton(app, "💬 Enviar").click().run()
+    assert not app.exception, [e.value for e in app.exception]
+    assert analizador.model.llamadas == [("chat", True)]
+    respuesta = "".join(ChatFalso.FRAGMENTOS)
+    assert app.session_state.chat_history[-1]["system"] == respuesta
+    assert any(respuesta in m.value for m in app.markdown)
+    print("✅ Los fragmentos llegan por st.write_stream y la respuesta completa queda en el historial")
+
+if __name__ == "__main__":
+    test_forget_document_removes_spool()
+    test_prefetch_accounting()
+    test_chat_streaming()
+    print("\n🎉 ¡El flujo de la aplicación funciona correctamente!")
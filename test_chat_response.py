@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar el chat del documento con el cache semántico
+(modelo falso, sin red)
+"""
+
+import os
+import tempfile
+
+# Cache de respuestas aparte y sin llamadas a count_tokens
+os.environ["LLM_CACHE_DIR"] = tempfile.mkdtemp()
+os.environ["GEMINI_TOKEN_CALIBRATION"] = "false"
+
+from ai_analyzer import AIAnalyzer, chat_cache
+
+class Respuesta:
+    def __init__(self, text):
+        self.text = text
+
+class ChatFalso:
+    def __init__(self, modelo, history):
+        self.modelo = modelo
+        self.history = list(history or [])
+
+    def send_message(self, pregunta, stream=False, **kwargs):
+        self.modelo.preguntas.append(pregunta)
+        texto = f"Respuesta {len(self.modelo.preguntas)}"
+        return iter([Respuesta(texto[:9]), Respuesta(texto[9:])]) if stream else Respuesta(texto)
+
+class ModeloFalso:
+    """Responde cada pregunta con un texto numerado y anota qué preguntas llegaron."""
+    model_name = "modelo-prueba-chat"
+
+    def __init__(self):
+        self.preguntas = []
+
+    def start_chat(self, history=None):
+        return ChatFalso(self, history)
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        return iter([Respuesta("Resumen")]) if stream else Respuesta("Resumen")
+
+def test_chat_response():
+    """Prueba que las preguntas independientes usen el cache en cualquier turno y las de seguimiento no"""
+    print("🧪 Probando chat del documento con cache semántico...")
+    analizador = AIAnalyzer(api_key="clave-de-prueba")
+    analizador.model = ModeloFalso()
+    contexto = {"analisis": {"tipo": "Petición", "fecha_analisis": "01/03/2025"}, "problemas": []}
+    documento = "Señores Alcaldía. Solicito copia del expediente 123."
+
+    assert analizador.chat_response("¿Qué normativa debo citar?", contexto, documento=documento) == "Respuesta 1"
+    assert "".join(analizador.chat_response("Explica eso mejor", contexto, stream=True,
+                                            documento=documento)) == "Respuesta 2"
+    assert analizador.chat_response("¿Qué leyes cito?", contexto, documento=documento) == "Respuesta 1"
+    assert analizador.model.preguntas == ["¿Qué normativa debo citar?", "Explica eso mejor"]
+    assert analizador.chat_session.turnos[-1] == ("¿Qué leyes cito?", "Respuesta 1")
+    print("✅ Pregunta independiente en el tercer turno servida desde el cache")
+
+    analizador.chat_response("Explica eso mejor", contexto, documento=documento)
+    assert len(analizador.model.preguntas) == 3
+    print("✅ Las preguntas de seguimiento siempre van a la IA")
+
+    # Otro análisis del mismo texto (otra fecha) abre otra sesión pero conserva las respuestas
+    otro_dia = {**contexto, "analisis": {**contexto["analisis"], "fecha_analisis": "02/03/2025"}}
+    assert analizador.chat_response("¿Qué normativa debo citar?", otro_dia, documento=documento) == "Respuesta 1"
+    assert len(analizador.model.preguntas) == 3
+    print(f"✅ Reanalizar el documento conserva el cache: {chat_cache.stats()}")
+
+if __name__ == "__main__":
+    test_chat_response()
+    print("\n🎉 ¡El chat del documento usa el cache semántico correctamente!")
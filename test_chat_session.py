@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar la ventana de historial de la sesión de chat
+"""
+
+from chat_session import MIN_RECENT_TURNS, DocumentChatSession
+
+class SesionGemini:
+    """Lo mínimo de la sesión de Gemini que usa DocumentChatSession: el historial."""
+    def __init__(self, history):
+        self.history = history
+
+class Modelo:
+    model_name = "modelo-prueba-chat"
+    def start_chat(self, history=None):
+        return SesionGemini(history)
+
+def test_chat_session():
+    """Prueba que el contexto vaya una vez, que la ventana no crezca y que los turnos viejos se resuman"""
+    print("🧪 Probando sesión de chat con ventana de historial...")
+
+    resumenes = []
+    def resumir(anterior, turnos):
+        resumenes.append(len(turnos))
+        return f"Se consultaron {len(turnos)} temas"
+
+    sesion = DocumentChatSession(Modelo(), "Eres un asistente legal.", "Problemas: falta radicado", 300, resumir)
+    assert not sesion.started
+    entradas = []
+    for i in range(20):
+        chat = sesion.prepare()
+        assert chat.history[0]["parts"][0].count("Problemas: falta radicado") == 1
+        assert sum("falta radicado" in turno["parts"][0] for turno in chat.history) == 1
+        entradas.append(sesion.prompt_tokens())
+        sesion.record(f"Pregunta {i} sobre el plazo de respuesta", "El plazo es de quince días hábiles. " * 5)
+    print("✅ Contexto del documento enviado una sola vez por sesión")
+
+    assert resumenes and sesion.resumen.startswith("Se consultaron")
+    assert sesion.started
+    assert max(entradas[10:]) <= max(entradas[:10]) + 10
+    assert len(sesion.turnos) >= MIN_RECENT_TURNS
+    print(f"✅ Tokens de entrada acotados: {entradas[:3]} ... {entradas[-3:]} ({len(resumenes)} resúmenes)")
+
+    stats = sesion.stats()
+    assert stats["turnos"] == 20 and stats["resumidos"] + stats["en_ventana"] == 20
+    print(f"✅ Métricas: {stats}")
+
+    # Si el resumen falla se conservan las preguntas resumidas
+    sesion = DocumentChatSession(Modelo(), "Eres un asistente legal.", "Contexto", 50, lambda anterior, turnos: 1 / 0)
+    for i in range(4):
+        sesion.record(f"Pregunta {i}", "Respuesta larga " * 10)
+    sesion.prepare()
+    assert "Pregunta 0" in sesion.resumen and "Pregunta 3" not in sesion.resumen
+    print("✅ Resumen de respaldo con las preguntas anteriores")
+
+if __name__ == "__main__":
+    test_chat_session()
+    print("\n🎉 ¡La sesión de chat funciona correctamente!")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar el interruptor del backend de IA
+"""
+
+import os
+import tempfile
+import time
+
+# Cache de respuestas aparte y sin llamadas a count_tokens
+os.environ["LLM_CACHE_DIR"] = tempfile.mkdtemp()
+os.environ["GEMINI_TOKEN_CALIBRATION"] = "false"
+
+import ai_analyzer
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+def wait_state(interruptor, estado, limite=2.0):
+    """Espera a que la sonda en segundo plano deje el interruptor en `estado`."""
+    fin = time.monotonic() + limite
+    while interruptor.state != estado and time.monotonic() < fin:
+        time.sleep(0.01)
+    return interruptor.state
+
+def test_circuit_breaker():
+    """Prueba la apertura por fallas y por latencia, el corte inmediato y la sonda semiabierta"""
+    print("🧪 Probando interruptor del backend...")
+
+    interruptor = CircuitBreaker(max_failures=3, latency_slo=1.0, reset_timeout=60)
+    interruptor.record_failure("timeout")
+    interruptor.record_failure("timeout")
+    interruptor.record_success(0.2)
+    interruptor.record_failure("timeout")
+    assert interruptor.state == CLOSED and interruptor.allow()
+    print("✅ Una respuesta correcta reinicia la cuenta de fallas")
+
+    interruptor.record_failure("timeout")
+    interruptor.record_failure("error 500")
+    assert interruptor.state == OPEN and interruptor.stats()["last_cause"] == "error 500"
+    assert not interruptor.allow() and interruptor.stats()["short_circuited"] == 1
+    assert 0 < interruptor.retry_in() <= 60
+    print(f"✅ Se abre tras 3 fallas seguidas y atiende localmente: {interruptor.stats()}")
+
+    lento = CircuitBreaker(max_failures=2, latency_slo=1.0, reset_timeout=60)
+    lento.record_success(1.5)
+    lento.record_success(3.0)
+    assert lento.state == OPEN and "lenta" in lento.stats()["last_cause"]
+    largo = CircuitBreaker(max_failures=1, latency_slo=1.0, reset_timeout=60)
+    largo.record_success(3.0, margin=2.5)
+    assert largo.state == CLOSED
+    print("✅ Las respuestas por encima del objetivo de latencia cuentan como fallas (con margen por tamaño)")
+
+    # Sonda que responde: semiabierto mientras prueba y cerrado al terminar
+    probando = []
+    def sonda_ok():
+        probando.append(interruptor_ok.state)
+        time.sleep(0.05)
+        return True
+    interruptor_ok = CircuitBreaker(max_failures=1, latency_slo=1.0, reset_timeout=0.2, probe=sonda_ok)
+    interruptor_ok.record_failure("timeout")
+    assert not interruptor_ok.allow()
+    time.sleep(0.25)
+    assert not interruptor_ok.allow()  # Lanza la sonda; la llamada sigue siendo local
+    assert wait_state(interruptor_ok, CLOSED) == CLOSED and probando == [HALF_OPEN]
+    assert interruptor_ok.allow() and interruptor_ok.stats()["probes"] == 1
+    print("✅ La sonda semiabierta cierra el interruptor cuando Gemini responde")
+
+    def sonda_falla():
+        raise ConnectionError("sin conexión")
+    interruptor_falla = CircuitBreaker(max_failures=1, latency_slo=1.0, reset_timeout=0.2, probe=sonda_falla)
+    interruptor_falla.record_failure("timeout")
+    time.sleep(0.25)
+    interruptor_falla.allow()
+    assert wait_state(interruptor_falla, OPEN) == OPEN and interruptor_falla.stats()["opened"] == 2
+    assert "sin conexión" in interruptor_falla.stats()["last_cause"]
+    print("✅ Si la sonda falla vuelve a abrirse y espera otro intervalo")
+
+class ModeloCaido:
+    """Modelo que falla en cada llamada, como Gemini durante una caída."""
+    model_name = "modelo-prueba-caido"
+
+    def __init__(self):
+        self.llamadas = 0
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        self.llamadas += 1
+        raise ConnectionError("503 servicio no disponible")
+
+    async def generate_content_async(self, prompt, **kwargs):
+        self.generate_content(prompt)
+
+def test_open_mid_call():
+    """Prueba que si el interruptor se abre durante un paso responda el analizador local, no el texto fijo"""
+    print("🧪 Probando apertura del interruptor a mitad de un paso...")
+    texto = ("Señores Alcaldía Municipal. En ejercicio del derecho de petición del artículo 23 "
+             "de la Constitución solicito copia del expediente. Atentamente, Juan Pérez")
+    analizador = ai_analyzer.AIAnalyzer(api_key="clave-de-prueba")
+    analizador.model = ModeloCaido()
+    compartido = ai_analyzer.gemini_breaker
+    try:
+        # La primera falla abre el interruptor: el paso lo termina el analizador local
+        ai_analyzer.gemini_breaker = CircuitBreaker(max_failures=1, latency_slo=60, reset_timeout=60)
+        analisis = analizador.analyze_document(texto)
+        assert analizador.model.llamadas == 1 and ai_analyzer.gemini_breaker.state == OPEN
+        assert analisis["estructura"] == analizador.local.analyze_document(texto)["estructura"]
+        print("✅ Análisis: responde el analizador local tras la falla que abrió el interruptor")
+
+        ai_analyzer.gemini_breaker = CircuitBreaker(max_failures=1, latency_slo=60, reset_timeout=60)
+        problemas = list(analizador.detect_problems_stream(texto, {}))
+        assert problemas == list(analizador.local.detect_problems_stream(texto, {}))
+        print(f"✅ Problemas en streaming: {len(problemas)} del analizador local")
+
+        # En el pipeline las dos ramas fallan; la que falla segunda ya encuentra el interruptor abierto
+        ai_analyzer.gemini_breaker = CircuitBreaker(max_failures=2, latency_slo=60, reset_timeout=60)
+        resultado = analizador.run_pipeline(texto, fusionado=False)
+        local = analizador.local.run_pipeline(texto)
+        assert resultado["problemas"] == local["problemas"] and "estructura" in resultado["analisis"]
+        print("✅ Pipeline: el resultado completo viene del analizador local")
+    finally:
+        ai_analyzer.gemini_breaker = compartido
+
+if __name__ == "__main__":
+    test_circuit_breaker()
+    test_open_mid_call()
+    print("\n🎉 ¡El interruptor funciona correctamente!")
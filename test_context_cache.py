@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar la cache de contexto (modo local)
+"""
+
+import threading
+from context_cache import MAX_ENTRIES, ContextCache
+
+class Respuesta:
+    def __init__(self, text):
+        self.text = text
+
+class Modelo:
+    """Modelo local que devuelve el prompt recibido, para ver qué le llega."""
+    model_name = "modelo-prueba-contexto"
+    def generate_content(self, contents, **kwargs):
+        return Respuesta(contents)
+
+def test_context_cache():
+    """Prueba el registro único por documento, la reutilización, el vencimiento y la liberación"""
+    print("🧪 Probando cache de contexto local...")
+
+    assert not ContextCache("off").enabled and ContextCache("otro").modo == "off"
+    assert ContextCache("off").get(Modelo(), "Instrucciones", "Documento") is None
+    print("✅ Desactivada por defecto")
+
+    cache = ContextCache("local", ttl=3600)
+    clave = cache.key_for(Modelo(), "Eres un abogado revisor.", "DOCUMENTO DEL CASO")
+    assert clave and cache.stats()["created"] == 0
+    print("✅ La clave del contexto se calcula sin registrarlo")
+
+    primera = cache.get(Modelo(), "Eres un abogado revisor.", "DOCUMENTO DEL CASO")
+    segunda = cache.get(Modelo(), "Eres un abogado revisor.", "DOCUMENTO DEL CASO")
+    otra = cache.get(Modelo(), "Eres un abogado revisor.", "OTRO DOCUMENTO")
+    assert primera is segunda and otra is not primera and primera.clave == clave
+    assert cache.stats()["created"] == 2 and cache.stats()["reused"] == 1
+    print(f"✅ Un registro por instrucciones y documento: {cache.stats()}")
+
+    modelo = cache.model_for(Modelo(), primera)
+    enviado = modelo.generate_content("SOLICITUD: detecta problemas").text
+    assert enviado.startswith("INSTRUCCIONES DEL SISTEMA:\nEres un abogado revisor.")
+    assert "DOCUMENTO DEL CASO" in enviado and enviado.endswith("SOLICITUD: detecta problemas")
+    print("✅ El modelo responde con las instrucciones y el documento en cache")
+
+    # Una entrada a punto de vencer se vuelve a crear
+    corta = ContextCache("local", ttl=30)
+    vieja = corta.get(Modelo(), "Instrucciones", "Documento")
+    nueva = corta.get(Modelo(), "Instrucciones", "Documento")
+    assert nueva is not vieja and vieja.contenido.deleted
+    print("✅ Las entradas vencidas se renuevan")
+
+    # Varios hilos con el mismo documento esperan un único registro
+    concurrente = ContextCache("local", ttl=3600)
+    entradas = []
+    hilos = [threading.Thread(target=lambda: entradas.append(concurrente.get(Modelo(), "Instrucciones", "Compartido")))
+             for _ in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert len({id(e) for e in entradas}) == 1 and concurrente.stats()["created"] == 1
+    print("✅ Un solo registro con llamadas concurrentes")
+
+    for i in range(MAX_ENTRIES + 2):
+        cache.get(Modelo(), "Instrucciones", f"Documento {i}")
+    assert cache.stats()["entries"] == MAX_ENTRIES and primera.contenido.deleted
+    print(f"✅ Máximo de {MAX_ENTRIES} entradas por sesión")
+
+    cache.release()
+    assert cache.stats()["entries"] == 0 and otra.contenido.deleted
+    print("✅ Liberación al cambiar de documento o cerrar la sesión")
+
+if __name__ == "__main__":
+    test_context_cache()
+    print("\n🎉 ¡La cache de contexto funciona correctamente!")
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar el índice de estructura del documento
+"""
+
+from document_processor import build_document_index
+
+def test_document_index():
+    """Prueba conteos, secciones, líneas y corte por oración con el ejemplo del repositorio"""
+    print("🧪 Probando índice del documento...")
+
+    with open("ejemplo_derecho_peticion.txt", encoding="utf-8") as fh:
+        texto = fh.read()
+    indice = build_document_index(texto)
+    assert build_document_index(texto) is indice
+    print("✅ El índice se construye una sola vez por texto")
+
+    # Mismos conteos que calculaba el analizador simple recorriendo el texto
+    assert indice.paragraph_count == texto.count('\n\n') + 1
+    assert indice.sentence_count == texto.count('.') + texto.count('!') + texto.count('?')
+    assert indice.word_count == len(texto.split())
+    assert indice.lower == texto.lower()
+    print(f"✅ Conteos: {indice.paragraph_count} párrafos, {indice.sentence_count} oraciones")
+
+    assert indice.section("encabezado").startswith("DERECHO DE PETICIÓN")
+    assert indice.section("petición").startswith("SOLICITUD:")
+    assert indice.section("firma").startswith("Atentamente")
+    assert indice.section("hechos") == ""
+    print(f"✅ Secciones detectadas: {list(indice.sections)}")
+
+    posicion = texto.index("SOLICITUD:")
+    assert indice.line_number(posicion) == texto[:posicion].count("\n") + 1
+    corte = indice.head(300)
+    assert len(corte) <= 300 and corte.endswith(".")
+    print(f"✅ Corte en fin de oración: {len(corte)} caracteres")
+
+if __name__ == "__main__":
+    test_document_index()
+    print("\n🎉 ¡El índice del documento funciona correctamente!")
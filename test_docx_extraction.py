@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar que la extracción de DOCX en memoria
+devuelve el mismo texto que docx2txt
+"""
+
+import io
+import os
+import tempfile
+import docx
+import docx2txt
+from document_processor import _read_docx_in_memory
+
+def _crear_docx() -> bytes:
+    """Crea un DOCX con encabezado, pie, tabla, tabulaciones y saltos de línea"""
+    documento = docx.Document()
+    documento.sections[0].header.paragraphs[0].text = "ALCALDÍA MUNICIPAL - Radicado 2025-001234"
+    documento.sections[0].footer.paragraphs[0].text = "Página 1"
+    documento.add_heading("DERECHO DE PETICIÓN", level=1)
+    parrafo = documento.add_paragraph("Señores:\tSecretaría de Hacienda")
+    parrafo.add_run().add_break()
+    parrafo.add_run("Referencia: Solicitud de información")
+    documento.add_paragraph("Fundamentos: Artículo 23 de la Constitución Política")
+    tabla = documento.add_table(rows=2, cols=2)
+    tabla.cell(0, 0).text = "Peticionario"
+    tabla.cell(0, 1).text = "Juan Pérez"
+    tabla.cell(1, 0).text = "Cédula"
+    tabla.cell(1, 1).text = "79.123.456"
+    salida = io.BytesIO()
+    documento.save(salida)
+    return salida.getvalue()
+
+def test_docx_extraction():
+    """Compara la extracción en memoria con docx2txt"""
+    print("🧪 Probando extracción de DOCX en memoria...")
+
+    contenido = _crear_docx()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
+        tmp.write(contenido)
+    try:
+        esperado = docx2txt.process(tmp.name).strip()
+    finally:
+        os.unlink(tmp.name)
+
+    obtenido = _read_docx_in_memory(io.BytesIO(contenido))
+    assert obtenido == esperado, f"{obtenido!r} != {esperado!r}"
+    print(f"✅ Texto idéntico a docx2txt ({len(obtenido)} caracteres)")
+
+if __name__ == "__main__":
+    test_docx_extraction()
+    print("\n🎉 ¡La extracción de DOCX en memoria funciona correctamente!")
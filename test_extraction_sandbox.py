@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar los procesos aislados de extracción
+(tiempo máximo, tope de memoria y reutilización de procesos)
+"""
+
+import os
+import time
+import extraction_sandbox
+from extraction_sandbox import ExtractionError, SandboxPool
+
+def _pid() -> int:
+    return os.getpid()
+
+def _colgarse() -> None:
+    time.sleep(60)
+
+def _pausa() -> None:
+    time.sleep(0.5)
+
+def _inflar_memoria() -> int:
+    return len(bytearray(512 * 1024 * 1024))
+
+def _fallar() -> None:
+    raise ValueError("PDF malformado")
+
+def _esperar_fallo(pool: SandboxPool, fn) -> ExtractionError:
+    try:
+        pool.submit(fn).result()
+    except ExtractionError as e:
+        return e
+    raise AssertionError(f"{fn.__name__} debió fallar")
+
+def test_extraction_sandbox():
+    """Prueba timeout, memoria, errores y reutilización de procesos sanos"""
+    print("🧪 Probando procesos aislados de extracción...")
+    pool = SandboxPool(1, timeout=2, max_memory_mb=256)
+
+    pid = pool.submit(_pid).result()
+    assert pool.submit(_pid).result() == pid
+    print("✅ El proceso sano se reutiliza")
+
+    error = _esperar_fallo(pool, _fallar)
+    assert error.reason == "invalid" and "malformado" in str(error)
+    assert pool.submit(_pid).result() == pid
+    print("✅ Un error de extracción no descarta el proceso")
+
+    inicio = time.time()
+    error = _esperar_fallo(pool, _colgarse)
+    assert error.reason == "timeout" and time.time() - inicio < 10
+    nuevo_pid = pool.submit(_pid).result()
+    assert nuevo_pid != pid
+    print(f"✅ Timeout: {error}")
+
+    if extraction_sandbox.resource is not None:  # RLIMIT_AS no existe en Windows
+        error = _esperar_fallo(pool, _inflar_memoria)
+        assert error.reason == "memory", error.reason
+        assert pool.submit(_pid).result() != nuevo_pid
+        print(f"✅ Memoria: {error}")
+
+def test_group_turns():
+    """Prueba que un lote grande no deje esperando a los trabajos de otros grupos"""
+    print("🧪 Probando turnos entre grupos del pool...")
+    pool = SandboxPool(1, timeout=10, max_memory_mb=256)
+    orden = []
+    def anotar(nombre, future):
+        future.add_done_callback(lambda _: orden.append(nombre))
+        return future
+
+    ocupado = anotar("ocupado", pool.submit(_pausa, grupo="sesion-1"))
+    while not ocupado.running() and not ocupado.done():
+        time.sleep(0.01)
+    futures = [anotar(f"lote-{i}", pool.submit(_pid, grupo="lote")) for i in range(3)]
+    futures.append(anotar("sesion-2", pool.submit(_pid, grupo="sesion-2")))
+    for future in futures:
+        future.result()
+    assert orden == ["ocupado", "lote-0", "sesion-2", "lote-1", "lote-2"], orden
+    print(f"✅ Orden de atención: {orden}")
+
+class _ContextoSinProcesos:
+    """Contexto de multiprocessing que no puede crear procesos (como al agotar descriptores)."""
+    def Pipe(self):
+        raise OSError("Demasiados archivos abiertos")
+
+def test_worker_start_failure():
+    """Prueba que un fallo al crear el proceso falle solo ese trabajo y el pool siga atendiendo"""
+    print("🧪 Probando fallo al iniciar un proceso de extracción...")
+    pool = SandboxPool(1, timeout=10, max_memory_mb=256)
+    contexto = pool._ctx
+    pool._ctx = _ContextoSinProcesos()
+    error = _esperar_fallo(pool, _pid)
+    assert error.reason == "crash" and "archivos abiertos" in str(error)
+    pool._ctx = contexto
+    assert pool.submit(_pid).result() != os.getpid()
+    print(f"✅ {error}; el siguiente trabajo se atiende con un proceso nuevo")
+
+if __name__ == "__main__":
+    test_extraction_sandbox()
+    test_group_turns()
+    test_worker_start_failure()
+    print("\n🎉 ¡Los procesos aislados de extracción funcionan correctamente!")
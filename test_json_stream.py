@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar la lectura de JSON (incremental y en texto libre)
+"""
+
+import json
+import time
+from json_stream import JSONArrayStreamParser, extract_json_block
+
+def test_json_stream():
+    """Prueba que cada elemento se entregue apenas se cierra, sin importar el corte de los fragmentos"""
+    print("🧪 Probando lectura incremental de JSON...")
+
+    problemas = [
+        {"tipo": "FORMAL", "descripcion": "Falta número de radicado", "severidad": "ALTA"},
+        {"tipo": "SUSTANCIAL", "descripcion": "Cita \"Art. 23\" con {llaves} y [corchetes], sin cerrar \\", "linea": 4},
+        {"tipo": "ADMINISTRATIVO", "descripcion": "Autoridad no identificada", "anexos": [1, [2, 3]]},
+    ]
+    respuesta = "```json\n" + json.dumps(problemas, ensure_ascii=False, indent=2) + "\n```\nNota final [ignorada]"
+
+    # Fragmentos de distintos tamaños, incluso de un carácter
+    for tamano in (1, 3, 7, 64, len(respuesta)):
+        parser = JSONArrayStreamParser()
+        recibidos = []
+        for i in range(0, len(respuesta), tamano):
+            recibidos.extend(parser.feed(respuesta[i:i + tamano]))
+        assert recibidos == problemas, f"tamaño {tamano}: {recibidos}"
+        assert parser.done
+    print("✅ Elementos idénticos con cualquier tamaño de fragmento")
+
+    # El primer problema está disponible antes de que llegue el segundo
+    parser = JSONArrayStreamParser()
+    primero = json.dumps(problemas[0], ensure_ascii=False)
+    assert parser.feed("[" + primero[:-1]) == []
+    assert parser.feed("}, {\"tipo\": ") == [problemas[0]]
+    print("✅ Cada objeto se entrega al llegar su llave de cierre")
+
+    # Escalares y elementos mal formados
+    parser = JSONArrayStreamParser()
+    assert parser.feed('[1, "dos", true, {"roto": tres}, null, {"ok": 1}]') == [1, "dos", True, None, {"ok": 1}]
+    print("✅ Escalares entregados y elementos inválidos descartados")
+
+def test_extract_json_block():
+    """Prueba la extracción del bloque JSON en texto libre y la reparación de respuestas truncadas"""
+    print("🧪 Probando extracción de bloques JSON...")
+
+    texto = 'Aquí está el análisis:\n```json\n[{"tipo": "FORMAL", "descripcion": "Usa {llaves} y ]"}, {"anexos": [1, {"n": 2}]}]\n```'
+    assert json.loads(extract_json_block(texto)) == [
+        {"tipo": "FORMAL", "descripcion": "Usa {llaves} y ]"}, {"anexos": [1, {"n": 2}]}]
+    print("✅ Objetos anidados y corchetes dentro de textos")
+
+    assert extract_json_block('Ejemplo {no es json} y luego {"ok": true}') == '{"ok": true}'
+    assert json.loads(extract_json_block('El documento {incompleto\n[{"a": 1}, {"b": 2}]')) == [{"a": 1}, {"b": 2}]
+    assert extract_json_block("sin json") == ""
+    print("✅ Bloques inválidos descartados")
+
+    # Respuesta cortada por max_output_tokens a mitad del tercer problema
+    truncado = '[{"tipo": "FORMAL", "severidad": "ALTA"}, {"tipo": "SUSTANCIAL", "severidad": "MEDIA"}, {"tipo": "CONST'
+    assert json.loads(extract_json_block(truncado)) == [
+        {"tipo": "FORMAL", "severidad": "ALTA"}, {"tipo": "SUSTANCIAL", "severidad": "MEDIA"}]
+    assert extract_json_block(truncado, reparar=False) == '{"tipo": "FORMAL", "severidad": "ALTA"}'
+    assert extract_json_block('Respuesta: {"a": [1, 2]} y más', reparar=False) == '{"a": [1, 2]}'
+    # Una llave suelta en el texto no oculta el bloque válido que viene después
+    nota = 'Nota {importante... Resultado: {"a": 1}'
+    assert extract_json_block(nota, reparar=False) == extract_json_block(nota) == '{"a": 1}'
+    assert extract_json_block('Nota {importante... sin bloque', reparar=False) == ""
+    fusionado = '{"analisis": {"tipo_documento": "DP"}, "problemas": [{"tipo": "FORMAL"}], "recomendaciones": [{"titulo": "A"}, {"titulo": "B", "desc'
+    assert json.loads(extract_json_block(fusionado)) == {
+        "analisis": {"tipo_documento": "DP"}, "problemas": [{"tipo": "FORMAL"}], "recomendaciones": [{"titulo": "A"}]}
+    print("✅ Respuestas truncadas reparadas conservando los elementos completos")
+
+    # Una sola pasada: muchas aperturas sueltas no hacen volver a leer el texto
+    inicio = time.monotonic()
+    assert extract_json_block("[" * 20000) == ""
+    assert extract_json_block("{x " * 20000 + '{"a": 1}') == '{"a": 1}'
+    assert time.monotonic() - inicio < 1.0
+    print(f"✅ Lectura lineal con aperturas sueltas ({time.monotonic() - inicio:.2f} s)")
+
+if __name__ == "__main__":
+    test_json_stream()
+    test_extract_json_block()
+    print("\n🎉 ¡La lectura de JSON funciona correctamente!")
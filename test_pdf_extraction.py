@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar la extracción de PDF por páginas: al subir una
+versión corregida solo se extraen las páginas que cambiaron, la extracción
+repartida entre procesos da el mismo texto que en serie y cada archivo de un
+lote informa su estado
+"""
+
+import io
+import os
+import tempfile
+
+# Cache de extracción aparte para que las páginas de otras ejecuciones no cuenten
+os.environ["EXTRACTION_CACHE_DIR"] = tempfile.mkdtemp()
+
+import PyPDF2
+import document_processor
+from document_processor import PDF_MIME, iter_batch_results, iter_pdf_pages, process_document_lazy, spool_upload
+
+def _crear_pdf(paginas) -> bytes:
+    """Crea un PDF mínimo con una página de texto (Helvetica) por elemento de `paginas`."""
+    objetos = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               f"<< /Type /Pages /Kids [{' '.join(f'{4 + 2 * i} 0 R' for i in range(len(paginas)))}] "
+               f"/Count {len(paginas)} >>".encode(),
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for i, texto in enumerate(paginas):
+        lineas = " ".join(f"({linea}) Tj T*" for linea in texto.split("\n"))
+        contenido = f"BT /F1 12 Tf 50 750 Td 14 TL {lineas} ET".encode("latin-1")
+        objetos.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode())
+        objetos.append(b"<< /Length %d >>\nstream\n" % len(contenido) + contenido + b"\nendstream")
+    salida = b"%PDF-1.4\n"
+    posiciones = []
+    for numero, objeto in enumerate(objetos, 1):
+        posiciones.append(len(salida))
+        salida += f"{numero} 0 obj\n".encode() + objeto + b"\nendobj\n"
+    inicio_xref = len(salida)
+    salida += f"xref\n0 {len(objetos) + 1}\n0000000000 65535 f \n".encode()
+    salida += b"".join(f"{posicion:010d} 00000 n \n".encode() for posicion in posiciones)
+    salida += f"trailer\n<< /Size {len(objetos) + 1} /Root 1 0 R >>\nstartxref\n{inicio_xref}\n%%EOF\n".encode()
+    return salida
+
+class ArchivoSubido(io.BytesIO):
+    """Lo que usa el procesador de un UploadedFile de Streamlit: nombre, tipo y contenido."""
+    def __init__(self, contenido: bytes, name: str, type: str = PDF_MIME):
+        super().__init__(contenido)
+        self.name = name
+        self.type = type
+
+def _texto_esperado(contenido: bytes) -> str:
+    """Texto de las páginas con contenido extraído directamente con PyPDF2."""
+    paginas = [pagina.extract_text() or "" for pagina in PyPDF2.PdfReader(io.BytesIO(contenido)).pages]
+    return "\n".join(pagina for pagina in paginas if pagina.strip()).strip()
+
+def test_page_reuse():
+    """Prueba que una versión con una página corregida reutilice las demás y arme el texto completo"""
+    print("🧪 Probando reutilización de páginas entre versiones de un PDF...")
+    paginas = [f"Hecho {i}: se radico el oficio {1000 + i}\nSin respuesta de fondo" for i in range(12)]
+
+    original = process_document_lazy(ArchivoSubido(_crear_pdf(paginas), "peticion.pdf"))
+    assert original.full_text() == _texto_esperado(_crear_pdf(paginas))
+    assert original.pages_processed == 12 and original.pages_reused == 0
+    print("✅ Primera versión: 12 páginas extraídas, ninguna reutilizada")
+
+    paginas[3] = "Hecho 3: corregido, se radico el oficio 2003\nCon respuesta parcial"
+    contenido = _crear_pdf(paginas)
+    corregida = process_document_lazy(ArchivoSubido(contenido, "peticion_v2.pdf"))
+    texto = corregida.full_text()
+    assert corregida.pages_processed == 12 and corregida.pages_reused == 11
+    assert texto == _texto_esperado(contenido)
+    assert "corregido" in texto and "oficio 1003" not in texto
+    print(f"✅ Versión corregida: {corregida.pages_reused} de 12 páginas reutilizadas y texto completo en orden")
+
+def test_parallel_extraction():
+    """Prueba que la extracción repartida entre procesos conserve el orden y el texto de las páginas"""
+    print("🧪 Probando extracción paralela de PDF...")
+    paginas = [f"Folio {i:02d} del expediente paralelo\nAnexo numero {500 + i}" for i in range(24)]
+    contenido = _crear_pdf(paginas)
+
+    # Umbral bajo y varios procesos para que 24 páginas se repartan
+    minimo, procesos = document_processor.PDF_PARALLEL_MIN_PAGES, document_processor.PDF_EXTRACTION_WORKERS
+    repartir = document_processor._iter_page_ranges
+    rangos = []
+    def contar_rangos(source, ranges, desde=float("inf")):
+        rangos.append(len(ranges))
+        return repartir(source, ranges, desde)
+    document_processor.PDF_PARALLEL_MIN_PAGES, document_processor.PDF_EXTRACTION_WORKERS = 4, 3
+    document_processor._iter_page_ranges = contar_rangos
+    try:
+        with spool_upload(ArchivoSubido(contenido, "expediente.pdf")) as source:
+            obtenidas = list(iter_pdf_pages(source))
+    finally:
+        document_processor.PDF_PARALLEL_MIN_PAGES, document_processor.PDF_EXTRACTION_WORKERS = minimo, procesos
+        document_processor._iter_page_ranges = repartir
+
+    secuenciales = [pagina.extract_text() for pagina in PyPDF2.PdfReader(io.BytesIO(contenido)).pages]
+    assert rangos == [6], rangos
+    assert obtenidas == secuenciales
+    assert [pagina.split()[1] for pagina in obtenidas] == [f"{i:02d}" for i in range(24)]
+    print(f"✅ {len(obtenidas)} páginas en {rangos[0]} trabajos: mismo orden y texto que la extracción en serie")
+
+def test_spooled_upload():
+    """Prueba que una subida volcada a disco se extraiga con mmap y que cerrarla borre el temporal"""
+    print("🧪 Probando subidas volcadas a disco...")
+    contenido = _crear_pdf([f"Folio {i} del expediente en disco\nRadicado {700 + i}" for i in range(6)])
+    limite = document_processor.SPOOL_MAX_MEMORY_MB
+    document_processor.SPOOL_MAX_MEMORY_MB = 0  # Todo archivo va a disco
+    try:
+        source = spool_upload(ArchivoSubido(contenido, "en_disco.pdf"))
+    finally:
+        document_processor.SPOOL_MAX_MEMORY_MB = limite
+    assert source.data is None and os.path.exists(source.path) and source.ref == source.path
+    documento = process_document_lazy(source)
+    assert documento.full_text() == _texto_esperado(contenido)
+    print(f"✅ {documento.total_pages} páginas leídas desde el temporal con mmap")
+
+    source.close()
+    assert not os.path.exists(source.path)
+    print("✅ Al cerrar la subida se elimina el temporal")
+
+def test_batch_results():
+    """Prueba el estado de cada archivo del lote: listo, desde cache, con error y no soportado"""
+    print("🧪 Probando ingesta por lotes...")
+    contenido = _crear_pdf(["Oficio del lote 1\nSolicitud de copias", "Oficio del lote 2\nAnexos"])
+    resultados = {r["archivo"]: r for r in iter_batch_results([
+        ArchivoSubido(contenido, "nuevo.pdf"),
+        ArchivoSubido(b"%PDF-1.4\nesto no es un PDF", "danado.pdf"),
+        ArchivoSubido(b"Solicitud en texto plano", "notas.txt", type="text/plain"),
+    ])}
+    assert resultados["nuevo.pdf"]["estado"] == "✅ Listo"
+    assert resultados["nuevo.pdf"]["texto"] == _texto_esperado(contenido)
+    assert resultados["danado.pdf"]["estado"] == "❌ Error" and resultados["danado.pdf"]["error"]
+    assert resultados["notas.txt"]["estado"] == "❌ Error"
+    assert "no soportado" in resultados["notas.txt"]["error"] and resultados["notas.txt"]["caracteres"] == 0
+    print("✅ Lote nuevo: listo, error de extracción y tipo no soportado")
+
+    repetido = list(iter_batch_results([ArchivoSubido(contenido, "copia.pdf")]))
+    assert [r["estado"] for r in repetido] == ["♻️ Cache"] and repetido[0]["texto"] == resultados["nuevo.pdf"]["texto"]
+    print("✅ El mismo archivo en otro lote se sirve desde el cache")
+
+if __name__ == "__main__":
+    test_page_reuse()
+    test_parallel_extraction()
+    test_spooled_upload()
+    test_batch_results()
+    print("\n🎉 ¡La extracción de PDF por páginas funciona correctamente!")
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar el cache persistente de extracción
+"""
+
+import os
+import tempfile
+import time
+from persistent_cache import PersistentCache, content_digest
+
+def test_persistent_cache():
+    """Prueba aciertos, persistencia entre instancias y expulsión LRU"""
+    print("🧪 Probando cache persistente...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "cache.sqlite3")
+        cache = PersistentCache(path, max_bytes=10 * 1024 * 1024)
+
+        clave = f"pdf:1:{content_digest(b'documento de prueba')}"
+        assert cache.get(clave) is None
+        cache.set(clave, "Texto extraído del derecho de petición")
+        assert cache.get(clave) == "Texto extraído del derecho de petición"
+        print("✅ Acierto después de guardar")
+
+        # Otra instancia (otro proceso o reinicio) ve las mismas entradas
+        otra = PersistentCache(path, max_bytes=10 * 1024 * 1024)
+        assert otra.get(clave) == "Texto extraído del derecho de petición"
+        stats = otra.stats()
+        assert stats["hits"] == 2 and stats["misses"] == 1
+        print(f"✅ Persistencia entre instancias: {stats}")
+
+        # Los contadores de un grupo (páginas sueltas) no se mezclan con los generales
+        assert otra.get("page:1:abc", group="page") is None
+        otra.set("page:1:abc", "Texto de una página")
+        texto, creada = otra.get_entry("page:1:abc", group="page")
+        assert texto == "Texto de una página" and creada <= time.time()
+        assert otra.stats()["hits"] == 2 and otra.stats()["misses"] == 1
+        assert otra.stats(group="page")["hits"] == 1 and otra.stats(group="page")["misses"] == 1
+        print("✅ Contadores separados por grupo")
+
+        # Expulsión LRU: la entrada menos usada recientemente sale primero
+        pequeno = PersistentCache(os.path.join(tmp_dir, "lru.sqlite3"), max_bytes=2500, evict_every=1)
+        for i in range(2):
+            pequeno.set(f"k{i}", os.urandom(1000).hex())  # ~1 KB comprimido cada una
+        pequeno.get("k0")
+        pequeno.set("k2", os.urandom(1000).hex())
+        assert pequeno.get("k0") is not None
+        assert pequeno.get("k2") is not None
+        assert pequeno.get("k1") is None
+        print(f"✅ Expulsión LRU por tamaño: {pequeno.stats()['entries']} entradas")
+
+        # El tamaño total se revisa cada `evict_every` escrituras, no en cada una
+        espaciado = PersistentCache(os.path.join(tmp_dir, "espaciado.sqlite3"), max_bytes=2500, evict_every=4)
+        for i in range(4):
+            espaciado.set(f"k{i}", os.urandom(1000).hex())
+        assert espaciado.stats()["entries"] == 4
+        espaciado.set("k4", os.urandom(1000).hex())
+        assert espaciado.stats()["bytes"] <= 2500
+        print("✅ Expulsión revisada cada pocas escrituras")
+
+        # Caducidad: una entrada más vieja que el TTL cuenta como fallo y se borra
+        con_ttl = PersistentCache(os.path.join(tmp_dir, "ttl.sqlite3"), max_bytes=1024 * 1024, ttl=0.2)
+        con_ttl.set("respuesta", "Análisis del documento")
+        assert con_ttl.get("respuesta") == "Análisis del documento"
+        time.sleep(0.3)
+        assert con_ttl.get("respuesta") is None
+        stats = con_ttl.stats()
+        assert stats["expired"] == 1 and stats["entries"] == 0
+        print(f"✅ Caducidad por TTL: {stats['expired']} entrada caducada")
+
+if __name__ == "__main__":
+    test_persistent_cache()
+    print("\n🎉 ¡El cache persistente funciona correctamente!")
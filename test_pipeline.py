@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar el pipeline de análisis, problemas y recomendaciones
+(modelo falso asíncrono, sin red)
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+# Cache de respuestas aparte y sin llamadas a count_tokens
+os.environ["LLM_CACHE_DIR"] = tempfile.mkdtemp()
+os.environ["GEMINI_TOKEN_CALIBRATION"] = "false"
+
+from streamlit.testing.v1 import AppTest
+from ai_analyzer import (ANALYSIS_SCHEMA, FUSED_SCHEMA, PIPELINE_MODE, PROBLEMS_SCHEMA, RECOMMENDATIONS_SCHEMA,
+                         AIAnalyzer)
+
+DEMORA = 0.4  # Segundos que tarda cada llamada del modelo falso
+
+ANALISIS = {"tipo_documento": "Derecho de Petición", "longitud": 120, "confianza": 0.9,
+            "palabras_clave": ["petición"], "analisis_markdown": "Solicitud de información"}
+PROBLEMAS = [{"tipo": "FORMAL", "descripcion": "Falta número de radicado", "severidad": "ALTA", "linea": "1"}]
+RECOMENDACIONES = [{"titulo": "Agregar radicado", "descripcion": "Incluir el número de radicado",
+                    "prioridad": "ALTA", "accion": "Editar encabezado"}]
+RESPUESTAS = {
+    "analisis": ANALISIS,
+    "problemas": PROBLEMAS,
+    "recomendaciones": RECOMENDACIONES,
+    "fusionado": {"analisis": ANALISIS, "problemas": PROBLEMAS, "recomendaciones": RECOMENDACIONES},
+}
+
+class Respuesta:
+    def __init__(self, text):
+        self.text = text
+
+class ModeloFalso:
+    """Reconoce la tarea por el esquema de salida pedido y anota cuándo empieza y termina cada llamada."""
+    model_name = "modelo-prueba-pipeline"
+
+    def __init__(self, respuestas=None):
+        self.respuestas = respuestas or RESPUESTAS
+        self.llamadas = []  # (tarea, inicio, fin)
+
+    @staticmethod
+    def _tarea(generation_config) -> str:
+        esquema = generation_config.response_schema
+        return {id(ANALYSIS_SCHEMA): "analisis", id(PROBLEMS_SCHEMA): "problemas",
+                id(RECOMMENDATIONS_SCHEMA): "recomendaciones", id(FUSED_SCHEMA): "fusionado"}[id(esquema)]
+
+    def _respuesta(self, tarea: str) -> Respuesta:
+        respuesta = self.respuestas[tarea]
+        return Respuesta(respuesta if isinstance(respuesta, str) else json.dumps(respuesta, ensure_ascii=False))
+
+    async def generate_content_async(self, prompt, generation_config=None, **kwargs):
+        tarea = self._tarea(generation_config)
+        inicio = time.monotonic()
+        await asyncio.sleep(DEMORA)
+        self.llamadas.append((tarea, inicio, time.monotonic()))
+        return self._respuesta(tarea)
+
+    def generate_content(self, prompt, generation_config=None, **kwargs):
+        assert generation_config.response_mime_type == "application/json"
+        tarea = self._tarea(generation_config)
+        self.llamadas.append((tarea, time.monotonic(), time.monotonic()))
+        return self._respuesta(tarea)
+
+def _analizador(respuestas=None) -> AIAnalyzer:
+    analizador = AIAnalyzer(api_key="clave-de-prueba")
+    analizador.model = ModeloFalso(respuestas)
+    return analizador
+
+def _documento(asunto: str) -> str:
+    return (f"Señores\nAlcaldía Municipal\n\nHECHOS:\nEl 3 de marzo radiqué una solicitud sobre {asunto}.\n\n"
+            f"PETICIONES:\nSolicito copia del expediente.\n\nAtentamente,\nJuan Pérez")
+
+def test_concurrent_pipeline():
+    """Prueba que en modo separado el análisis corra en paralelo con la cadena problemas → recomendaciones"""
+    print("🧪 Probando pipeline concurrente...")
+    analizador = _analizador()
+    inicio = time.monotonic()
+    resultado = analizador.run_pipeline(_documento("alumbrado público"), fusionado=False)
+    duracion = time.monotonic() - inicio
+
+    inicios = {tarea: comienzo for tarea, comienzo, _ in analizador.model.llamadas}
+    fines = {tarea: fin for tarea, _, fin in analizador.model.llamadas}
+    assert sorted(inicios) == ["analisis", "problemas", "recomendaciones"]
+    assert abs(inicios["analisis"] - inicios["problemas"]) < DEMORA / 2
+    assert inicios["recomendaciones"] >= fines["problemas"]  # Las recomendaciones usan los problemas
+    assert 2 * DEMORA <= duracion < 3 * DEMORA, duracion
+    print(f"✅ Tres llamadas en {duracion:.2f} s: la rama más lenta, no la suma ({3 * DEMORA:.1f} s)")
+
+    assert resultado["analisis"]["tipo_documento"] == "Derecho de Petición"
+    assert resultado["problemas"] == PROBLEMAS
+    assert [r["titulo"] for r in resultado["recomendaciones"]] == ["Agregar radicado"]
+    print("✅ El resultado combina las tres estructuras que muestra la aplicación")
+
+def _tareas(analizador: AIAnalyzer) -> list:
+    return sorted(tarea for tarea, _, _ in analizador.model.llamadas)
+
+def test_fused_mode():
+    """Prueba que el modo fusionado use una sola llamada y vuelva al separado si la respuesta llega incompleta"""
+    print("🧪 Probando modo fusionado y separado...")
+    analizador = _analizador()
+    resultado = analizador.run_pipeline(_documento("recolección de basuras"), fusionado=True)
+    assert _tareas(analizador) == ["fusionado"]
+    assert resultado["problemas"] == PROBLEMAS and resultado["recomendaciones"][0]["titulo"] == "Agregar radicado"
+    assert resultado["analisis"]["tipo_documento"] == "Derecho de Petición"
+    print("✅ Fusionado: una llamada devuelve análisis, problemas y recomendaciones")
+
+    # Respuesta fusionada sin las recomendaciones: se repite en modo separado
+    incompleta = {**RESPUESTAS, "fusionado": {"analisis": ANALISIS, "problemas": PROBLEMAS}}
+    analizador = _analizador(incompleta)
+    resultado = analizador.run_pipeline(_documento("poda de árboles"), fusionado=True)
+    assert _tareas(analizador) == ["analisis", "fusionado", "problemas", "recomendaciones"]
+    assert resultado["recomendaciones"][0]["titulo"] == "Agregar radicado"
+    print("✅ Respuesta fusionada incompleta: se completa con las tres llamadas separadas")
+
+    analizador = _analizador()
+    analizador.run_pipeline(_documento("malla vial"))
+    assert _tareas(analizador) == (["fusionado"] if PIPELINE_MODE == "fused" else
+                                   ["analisis", "problemas", "recomendaciones"])
+    print(f"✅ Sin indicar modo se usa GEMINI_PIPELINE_MODE ({PIPELINE_MODE})")
+
+def test_structured_output():
+    """Prueba que cada paso pida JSON con su esquema y lea la respuesta anidada completa de una vez"""
+    print("🧪 Probando salida JSON con esquema...")
+    anidados = [{"tipo": "SUSTANCIAL", "descripcion": "Cita el Art. [5] sin decir {cuál} ley",
+                 "severidad": "MEDIA", "linea": "4", "fundamento_legal": "Ley 1437 de 2011 {CPACA}"}]
+    analizador = _analizador({**RESPUESTAS, "problemas": anidados})
+    texto = _documento("licencias de construcción")
+
+    analisis = analizador.analyze_document(texto)
+    problemas = analizador.detect_problems(texto, analisis)
+    recomendaciones = analizador.generate_recommendations(texto, problemas)
+    assert _tareas(analizador) == ["analisis", "problemas", "recomendaciones"]
+    assert analisis["tipo_documento"] == "Derecho de Petición" and problemas == anidados
+    assert recomendaciones[0]["titulo"] == "Agregar radicado"
+    print("✅ Cada paso pide application/json con su esquema; corchetes y llaves dentro de textos no cortan el JSON")
+
+    # Las respuestas válidas quedan en cache: repetir los pasos no llama al modelo
+    analizador.detect_problems(texto, analisis)
+    analizador.generate_recommendations(texto, problemas)
+    assert len(analizador.model.llamadas) == 3
+    print("✅ Las respuestas leídas sin reparar se sirven desde el cache")
+
+def test_app_pipeline_choice():
+    """Prueba que el interruptor de máxima calidad de la aplicación elija el modo separado"""
+    print("🧪 Probando la elección de modo en la aplicación...")
+    for separado, esperadas in ((False, ["fusionado"]), (True, ["analisis", "problemas", "recomendaciones"])):
+        analizador = _analizador()
+        texto = _documento(f"servicio de acueducto {separado}")
+        app = AppTest.from_file("app.py", default_timeout=60)
+        app.run()
+        app.session_state.ai_analyzer = analizador
+        app.session_state.ai_connected = True
+        app.session_state.document_text = texto
+        app.session_state.current_step = 2
+        app.run()
+        app.toggle(key="pipeline_separate").set_value(separado)
+        app.button(key="start_pipeline").click().run()
+        assert not app.exception, [e.value for e in app.exception]
+        assert _tareas(analizador) == esperadas, _tareas(analizador)
+        assert app.session_state.problems == PROBLEMAS and app.session_state.recommendations_generated
+        print(f"✅ Máxima calidad {'activada' if separado else 'desactivada'}: {len(esperadas)} llamada(s)")
+
+if __name__ == "__main__":
+    test_concurrent_pipeline()
+    test_fused_mode()
+    test_structured_output()
+    test_app_pipeline_choice()
+    print("\n🎉 ¡El pipeline de análisis funciona correctamente!")
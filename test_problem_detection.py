@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar que la detección de problemas revisa todo el documento
+(modelo falso, sin red)
+"""
+
+import json
+import os
+import tempfile
+
+# Cache de respuestas aparte y sin llamadas a count_tokens
+os.environ["LLM_CACHE_DIR"] = tempfile.mkdtemp()
+os.environ["GEMINI_TOKEN_CALIBRATION"] = "false"
+
+from ai_analyzer import AIAnalyzer, estimate_tokens
+
+# Falla que solo aparece en la petición, al final de un documento largo
+FALLA_TARDIA = "Solicito que se ordene lo pertinente sin indicar la norma aplicable."
+
+class Respuesta:
+    def __init__(self, text):
+        self.text = text
+
+class ModeloFalso:
+    """Responde un problema por cada marca que ve en el prompt."""
+    model_name = "modelo-prueba-problemas"
+
+    def __init__(self):
+        self.prompts = []
+
+    def _responder(self, prompt):
+        self.prompts.append(prompt)
+        if "PROBLEMAS DETECTADOS POR FRAGMENTO" in prompt:
+            recibidos = prompt.split("PROBLEMAS DETECTADOS POR FRAGMENTO:\n")[1].split("\n\nIMPORTANTE")[0]
+            return Respuesta(recibidos)
+        problemas = []
+        if FALLA_TARDIA in prompt:
+            problemas.append({"tipo": "SUSTANCIAL", "descripcion": "Petición sin fundamento legal",
+                              "severidad": "ALTA", "linea": "1"})
+        return Respuesta(json.dumps(problemas))
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        respuesta = self._responder(prompt)
+        return iter([respuesta]) if stream else respuesta
+
+    async def generate_content_async(self, prompt, **kwargs):
+        return self._responder(prompt)
+
+def _documento_largo() -> str:
+    hechos = "\n".join(f"El día {i} se radicó el oficio número {1000 + i} sin obtener respuesta de fondo."
+                       for i in range(300))
+    return (f"Señores\nAlcaldía Municipal\n\nHECHOS:\n{hechos}\n\n"
+            f"FUNDAMENTOS DE DERECHO:\nArtículo 23 de la Constitución Política.\n\n"
+            f"PETICIONES:\n{FALLA_TARDIA}\n\nAtentamente,\nJuan Pérez")
+
+def _analizador() -> AIAnalyzer:
+    analizador = AIAnalyzer(api_key="clave-de-prueba")
+    analizador.model = ModeloFalso()
+    return analizador
+
+def test_problem_detection():
+    """Prueba la llamada única con el documento completo y el map-reduce cuando no cabe"""
+    print("🧪 Probando detección de problemas en documentos largos...")
+    texto = _documento_largo()
+    assert estimate_tokens(texto) > 900  # Más que el antiguo recorte de la llamada única
+
+    analizador = _analizador()
+    problemas = analizador.detect_problems(texto, {})
+    assert [p["descripcion"] for p in problemas] == ["Petición sin fundamento legal"]
+    assert len(analizador.model.prompts) == 1 and analizador.packing_reports["problemas"].complete
+    print("✅ El documento que cabe en la llamada va completo: se ve la falla de la petición")
+
+    # Presupuesto menor que el documento: se revisa por fragmentos y la falla sigue apareciendo
+    analizador = _analizador()
+    analizador.PROBLEMS_TOKENS = 1500
+    problemas = analizador.detect_problems(texto, {})
+    assert [p["descripcion"] for p in problemas] == ["Petición sin fundamento legal"]
+    assert len(analizador.model.prompts) >= 2 and "problemas" not in analizador.packing_reports
+    assert list(analizador.detect_problems_stream(texto, {})) == problemas
+    print(f"✅ Sin espacio se revisa por fragmentos ({len(analizador.model.prompts)} llamadas) y se encuentra igual")
+
+if __name__ == "__main__":
+    test_problem_detection()
+    print("\n🎉 ¡La detección de problemas revisa todo el documento!")
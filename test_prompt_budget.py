@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar el empaquetado del documento por presupuesto de tokens
+"""
+
+from prompt_budget import calibrate, chars_per_token, estimate_tokens, pack_document, split_document
+
+PRIORIDADES = ("petición", "encabezado", "fundamentos", "firma", "hechos")
+
+def test_prompt_budget():
+    """Prueba que las peticiones del final entren, que se corte en fin de oración y que se informe el recorte"""
+    print("🧪 Probando presupuesto de tokens del prompt...")
+
+    with open("ejemplo_derecho_peticion.txt", encoding="utf-8") as fh:
+        ejemplo = fh.read()
+
+    completo = pack_document(ejemplo, 5000, PRIORIDADES)
+    assert completo.texto == ejemplo and completo.complete
+    print(f"✅ Documento corto enviado completo: {completo.summary()}")
+
+    # Unos hechos muy largos antes de la solicitud: con un corte por caracteres la solicitud se perdería
+    hechos = "HECHOS:\n" + " ".join(f"El día {i} se radicó un oficio sin respuesta." for i in range(400)) + "\n\n"
+    largo = ejemplo.replace("SOLICITUD:", hechos + "SOLICITUD:")
+    paquete = pack_document(largo, 600, PRIORIDADES)
+    assert "SOLICITUD:" in paquete.texto and "Atentamente" in paquete.texto
+    assert paquete.tokens <= 600 and estimate_tokens(paquete.texto) <= 600 + 5
+    assert "hechos" in paquete.recortadas and paquete.recortadas["hechos"] > 0
+    assert "[...]" not in paquete.texto or paquete.texto.index("[...]") > paquete.texto.index("HECHOS:")
+    print(f"✅ Peticiones conservadas y recorte informado: {paquete.summary()}")
+
+    recorte_hechos = paquete.texto[paquete.texto.index("HECHOS:"):].split("\n[...]\n")[0]
+    assert recorte_hechos.rstrip().endswith(".")
+    print("✅ La sección recortada termina en fin de oración")
+
+    # Sin secciones reconocibles se conservan el inicio y el final
+    sin_secciones = " ".join(f"Oración {i} del escrito." for i in range(2000))
+    paquete = pack_document(sin_secciones, 200, PRIORIDADES)
+    assert paquete.texto.startswith("Oración 0 ") and paquete.texto.endswith("Oración 1999 del escrito.")
+    print(f"✅ Documento sin secciones: inicio y final ({paquete.summary()})")
+
+    # Calibración: un conteo real ajusta la relación caracteres/token del modelo
+    calibrate("modelo-prueba", "a" * 3000, lambda muestra: len(muestra) // 3)
+    assert chars_per_token("modelo-prueba") == 3.0
+    assert estimate_tokens("a" * 300, "modelo-prueba") == 100
+    calibrate("modelo-sin-conteo", "texto", lambda muestra: 1 / 0)
+    assert chars_per_token("modelo-sin-conteo") == chars_per_token(None)
+    print("✅ Calibración por modelo con respaldo a la relación de referencia")
+
+def test_split_document():
+    """Prueba la partición por secciones para la revisión por fragmentos"""
+    print("🧪 Probando partición del documento en fragmentos...")
+
+    with open("ejemplo_derecho_peticion.txt", encoding="utf-8") as fh:
+        ejemplo = fh.read()
+    assert [f.texto for f in split_document(ejemplo, 5000)] == [ejemplo]
+    print("✅ Documento corto en un solo fragmento")
+
+    hechos = "HECHOS:\n" + " ".join(f"El día {i} se radicó un oficio sin respuesta." for i in range(400)) + "\n\n"
+    largo = ejemplo.replace("SOLICITUD:", hechos + "SOLICITUD:")
+    fragmentos = split_document(largo, 900)
+    assert len(fragmentos) > 1
+    assert "".join(f.texto for f in fragmentos) == largo
+    assert all(estimate_tokens(f.texto) <= 900 for f in fragmentos)
+    assert all(f.texto.rstrip().endswith(".") for f in fragmentos[1:-1])
+    assert fragmentos[-1].secciones[-2:] == ["petición", "firma"]
+    assert all(largo.count("\n", 0, f.inicio) + 1 == f.linea_inicial for f in fragmentos)
+    print(f"✅ {len(fragmentos)} fragmentos que cubren todo el documento sin partir oraciones")
+
+    limitados = split_document(largo, 900, max_fragmentos=3)
+    assert 1 < len(limitados) <= 3 < len(fragmentos)
+    assert "".join(f.texto for f in limitados) == largo
+    print(f"✅ Máximo de fragmentos respetado: {len(limitados)}")
+
+if __name__ == "__main__":
+    test_prompt_budget()
+    test_split_document()
+    print("\n🎉 ¡El presupuesto de tokens del prompt funciona correctamente!")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar el límite de solicitudes a Gemini
+"""
+
+import asyncio
+import threading
+import time
+from google.api_core.exceptions import InternalServerError, ResourceExhausted, TooManyRequests
+from rate_limiter import QuotaExceededError, RateLimiter, is_quota_error, retry_after_hint
+
+def test_rate_limiter():
+    """Prueba la espera por cupo, los reintentos ante 429 y el aviso de cuota excedida"""
+    print("🧪 Probando límite de solicitudes...")
+
+    assert is_quota_error(ResourceExhausted("429 Resource has been exhausted"))
+    assert is_quota_error(TooManyRequests("Too Many Requests"))
+    assert not is_quota_error(ValueError("respuesta vacía"))
+    # Solo cuenta el tipo: un mensaje que menciona la cuota o un 429 no basta
+    assert not is_quota_error(ValueError("429: quota del documento inválida"))
+    assert not is_quota_error(InternalServerError("quota service unavailable"))
+    assert retry_after_hint(ResourceExhausted("429 ... retry_delay {\n  seconds: 27\n}")) == 27
+    assert retry_after_hint(ResourceExhausted("Please retry in 3.5s.")) == 3.5
+    print("✅ Errores de cuota y tiempo sugerido reconocidos")
+
+    # 120 solicitudes por minuto = una cada 0,5 s una vez agotada la cubeta
+    limitador = RateLimiter(rpm=120, tpm=1_000_000, max_wait=5)
+    for _ in range(120):
+        limitador.call(lambda: "ok", tokens=10)
+    esperas = []
+    inicio = time.monotonic()
+    assert limitador.call(lambda: "ok", tokens=10, on_wait=esperas.append) == "ok"
+    assert 0.3 < time.monotonic() - inicio < 1.5 and esperas and esperas[0] <= 0.5 + 0.01
+    print(f"✅ Con la cubeta vacía se espera el cupo y se avisa ({esperas[0]:.2f} s)")
+
+    # La espera en cola se ve solo desde la sesión (grupo) que hizo la llamada
+    en_cola = threading.Thread(target=limitador.call, args=(lambda: "ok", 10), kwargs={"grupo": "sesion-a"})
+    en_cola.start()
+    time.sleep(0.1)
+    assert limitador.pending_wait("sesion-a") > 0 and limitador.pending_wait("sesion-b") == 0
+    assert limitador.pending_wait() > 0
+    en_cola.join()
+    print("✅ Cada sesión ve solo la espera de sus llamadas")
+
+    # Tokens por minuto: un prompt grande espera aunque haya solicitudes disponibles
+    limitador = RateLimiter(rpm=1000, tpm=600, max_wait=0.5)
+    limitador.call(lambda: "ok", tokens=600)
+    try:
+        limitador.call(lambda: "ok", tokens=600)
+        assert False, "debía rechazar la espera larga"
+    except QuotaExceededError as e:
+        assert "Cuota de Google Gemini excedida" in str(e) and e.retry_after > 0.5
+    print("✅ Espera mayor al máximo: aviso de cuota excedida en lugar de fallback")
+
+    # 429 con tiempo sugerido: se reintenta y la pausa aplica a toda la cola
+    limitador = RateLimiter(rpm=1000, tpm=1_000_000, max_wait=5, max_retries=3)
+    intentos = []
+    def llamada():
+        intentos.append(time.monotonic())
+        if len(intentos) < 3:
+            raise ResourceExhausted("429 quota exceeded. Please retry in 0.2s.")
+        return "respuesta"
+    assert limitador.call(llamada, tokens=10) == "respuesta"
+    assert len(intentos) == 3 and intentos[1] - intentos[0] >= 0.2
+    assert limitador.stats()["retries"] == 2
+    print(f"✅ Reintentos respetando el tiempo sugerido: {limitador.stats()}")
+
+    def agotada():
+        raise ResourceExhausted("429 quota")
+    def rota():
+        raise ValueError("otro error")
+    limitador = RateLimiter(rpm=1000, tpm=1_000_000, max_wait=5, max_retries=2, base_backoff=0.05)
+    try:
+        limitador.call(agotada, tokens=10)
+        assert False, "debía agotar los reintentos"
+    except QuotaExceededError as e:
+        assert "reintentos" in str(e)
+    reintentos = limitador.stats()["retries"]
+    try:
+        limitador.call(rota, tokens=10)
+        assert False, "debía propagar el error"
+    except ValueError:
+        assert limitador.stats()["retries"] == reintentos
+    print("✅ Reintentos agotados se informan; otros errores pasan sin reintentar")
+
+    limitador = RateLimiter(rpm=120, tpm=1_000_000, max_wait=5)
+    async def varias():
+        async def una():
+            return await limitador.call_async(lambda: asyncio.sleep(0, result="ok"), tokens=10)
+        return await asyncio.gather(*(una() for _ in range(122)))
+    assert asyncio.run(varias()) == ["ok"] * 122 and limitador.stats()["waits"] >= 1
+    print("✅ Versión asíncrona sin bloquear el bucle")
+
+if __name__ == "__main__":
+    test_rate_limiter()
+    print("\n🎉 ¡El límite de solicitudes funciona correctamente!")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar el cache semántico de preguntas del chat
+"""
+
+from collections import Counter
+
+from semantic_cache import SemanticCache, normalize_question, refers_to_history
+
+def test_semantic_cache():
+    """Prueba que las paráfrasis acierten, las preguntas distintas fallen y el alcance por documento"""
+    print("🧪 Probando cache semántico del chat...")
+
+    assert normalize_question("¿Qué leyes cito?") == normalize_question("¿Qué normativa debo citar?")
+    print(f"✅ Normalización: {normalize_question('¿Qué leyes cito?')}")
+
+    cache = SemanticCache(threshold=0.75)
+    cache.store("doc-1", "¿Qué normativa debo citar?", "Cite el Art. 23 de la Constitución")
+    cache.store("doc-1", "¿Cómo mejorar la contestación del documento?", "Estructure la respuesta en secciones")
+    cache.store("doc-1", "¿Cuáles son los problemas más críticos?", "La falta de radicado")
+
+    respuesta, similitud = cache.lookup("doc-1", "¿qué leyes cito?")
+    assert respuesta == "Cite el Art. 23 de la Constitución"
+    print(f"✅ Paráfrasis servida desde cache (similitud {similitud:.2f})")
+
+    respuesta, _ = cache.lookup("doc-1", "como mejoro la respuesta")
+    assert respuesta == "Estructure la respuesta en secciones"
+    print("✅ Variante con otras palabras reconocida")
+
+    assert cache.lookup("doc-1", "¿Qué jurisprudencia aplica?") is None
+    assert cache.lookup("doc-2", "¿Qué normativa debo citar?") is None
+    print("✅ Preguntas distintas u otro documento no reutilizan respuestas")
+
+    # Números y negaciones cambian la respuesta legal aunque el resto de la pregunta coincida
+    cache.store("doc-1", "¿Debo responder en 15 días?", "Sí, el plazo general es de 15 días hábiles")
+    cache.store("doc-1", "¿Qué dice la Ley 1755?", "Regula el derecho fundamental de petición")
+    cache.store("doc-1", "¿La entidad es competente?", "Sí, la entidad es competente")
+    assert cache.lookup("doc-1", "¿Debo responder en 30 días?") is None
+    assert cache.lookup("doc-1", "¿Qué dice la Ley 1437?") is None
+    assert cache.lookup("doc-1", "¿La entidad no es competente?") is None
+    assert cache.lookup("doc-1", "¿la entidad es competente?")[0] == "Sí, la entidad es competente"
+    print("✅ Números y negaciones distintos no reutilizan respuestas")
+
+    stats = cache.stats()
+    assert stats["hits"] == 3 and stats["misses"] == 5 and stats["entries"] == 6
+    print(f"✅ Métricas: {stats}")
+
+    # Al expulsar las más antiguas sus términos dejan de pesar en las búsquedas
+    acotado = SemanticCache(threshold=0.75, max_entries_per_scope=2)
+    acotado.store("doc-1", "¿Qué normativa debo citar?", "Cite el Art. 23")
+    acotado.store("doc-1", "¿Cuáles son los problemas más críticos?", "La falta de radicado")
+    acotado.store("doc-1", "¿Cómo mejorar la contestación del documento?", "Estructure la respuesta")
+    assert acotado.stats()["entries"] == 2 and acotado.lookup("doc-1", "¿Qué normativa debo citar?") is None
+    assert acotado.lookup("doc-1", "¿cuáles son los problemas más críticos?")[0] == "La falta de radicado"
+    assert +acotado._df["doc-1"] == Counter(t for e in acotado._scopes["doc-1"] for t in e[1])
+    print("✅ Con el límite por documento sale la pregunta más antigua")
+
+    estricto = SemanticCache(threshold=1.01)
+    estricto.store("doc-1", "¿Qué normativa debo citar?", "Cite el Art. 23")
+    assert estricto.lookup("doc-1", "¿Qué normativa debo citar?") is None
+    print("✅ Umbral mayor a 1 desactiva el cache")
+
+def test_refers_to_history():
+    """Prueba qué preguntas dependen de la conversación y cuáles se entienden solas"""
+    for pregunta in ("Explica eso mejor", "¿y el plazo?", "¿Lo que mencionaste antes aplica?", "Dame otro", "¿Por qué?"):
+        assert refers_to_history(pregunta), pregunta
+    for pregunta in ("¿Qué normativa debo citar?", "¿Cuáles son los problemas más críticos?", "¿Qué dice la Ley 1755?"):
+        assert not refers_to_history(pregunta), pregunta
+    print("✅ Las preguntas que remiten a turnos anteriores no usan el cache")
+
+def test_semantic_scope():
+    """Prueba que el alcance siga al texto del documento y no a la fecha del análisis"""
+    from ai_analyzer import PROMPT_VERSION, AIAnalyzer
+
+    hoy = {"analisis": {"tipo": "Petición", "fecha_analisis": "01/03/2025"}, "problemas": []}
+    manana = {"analisis": {"tipo": "Petición", "fecha_analisis": "02/03/2025"}, "problemas": []}
+    assert AIAnalyzer._semantic_scope(hoy, "Texto") == AIAnalyzer._semantic_scope(manana, "Texto")
+    assert AIAnalyzer._semantic_scope(hoy, "Texto") != AIAnalyzer._semantic_scope(hoy, "Otro texto")
+    assert AIAnalyzer._semantic_scope(hoy, None) == AIAnalyzer._semantic_scope(manana, None)
+    assert AIAnalyzer._semantic_scope(hoy, "Texto").startswith(f"{PROMPT_VERSION}:")
+    print("✅ Volver a analizar el mismo documento conserva las respuestas guardadas")
+
+if __name__ == "__main__":
+    test_semantic_cache()
+    test_refers_to_history()
+    test_semantic_scope()
+    print("\n🎉 ¡El cache semántico del chat funciona correctamente!")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar la ejecución especulativa del siguiente paso
+"""
+
+import time
+from speculative_executor import SpeculativeExecutor
+
+def _paso_lento(texto: str, contexto: dict) -> str:
+    time.sleep(0.5)
+    return f"{texto}:{contexto['tipo']}"
+
+def test_speculative_executor():
+    """Prueba aprovechamiento, entradas distintas y descarte al cambiar de documento"""
+    print("🧪 Probando ejecución especulativa...")
+    especulacion = SpeculativeExecutor()
+
+    especulacion.prefetch("problems", _paso_lento, "doc1", {"tipo": "DP"})
+    time.sleep(0.6)  # El usuario lee el análisis mientras tanto
+    inicio = time.time()
+    assert especulacion.result("problems", _paso_lento, "doc1", {"tipo": "DP"}) == "doc1:DP"
+    assert time.time() - inicio < 0.1 and especulacion.hits == 1
+    print("✅ El resultado especulado está listo al pulsar el botón")
+
+    # Entradas distintas (otro análisis): se descarta y se calcula de nuevo
+    especulacion.prefetch("problems", _paso_lento, "doc1", {"tipo": "DP"})
+    assert especulacion.result("problems", _paso_lento, "doc1", {"tipo": "Recurso"}) == "doc1:Recurso"
+    assert especulacion.misses == 1
+    print("✅ Entradas distintas no reutilizan la especulación")
+
+    especulacion.prefetch("recommendations", _paso_lento, "doc1", {"tipo": "DP"})
+    especulacion.discard()
+    assert especulacion.result("recommendations", _paso_lento, "doc2", {"tipo": "DP"}) == "doc2:DP"
+    assert especulacion.misses == 2
+    print("✅ Cambiar de documento descarta las especulaciones")
+
+    # Hilos compartidos: una tarea en curso por sesión; la reemplazada sigue contando hasta terminar
+    limitada = SpeculativeExecutor(max_running=1)
+    limitada.prefetch("problems", _paso_lento, "doc1", {"tipo": "DP"})
+    time.sleep(0.1)
+    limitada.prefetch("problems", _paso_lento, "doc2", {"tipo": "DP"})
+    limitada.prefetch("recommendations", _paso_lento, "doc1", {"tipo": "DP"})
+    assert limitada.skipped == 2 and limitada.running == 1
+    assert limitada.take("problems", "doc2", {"tipo": "DP"}) is None
+    time.sleep(0.6)
+    assert limitada.running == 0
+    limitada.prefetch("recommendations", _paso_lento, "doc1", {"tipo": "DP"})
+    assert limitada.result("recommendations", _paso_lento, "doc1", {"tipo": "DP"}) == "doc1:DP"
+    print("✅ Una sesión no acapara los hilos compartidos")
+
+if __name__ == "__main__":
+    test_speculative_executor()
+    print("\n🎉 ¡La ejecución especulativa funciona correctamente!")